@@ -14,11 +14,19 @@ import os
 import csv
 import json
 import hashlib
+import hmac
 import threading
 import time
 import io
 import logging
+import functools
 import re
+import sqlite3
+import queue
+import tempfile
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 from datetime import datetime, timedelta
 from decimal import Decimal
 from typing import Optional, Dict, List, Any, Union
@@ -61,8 +69,13 @@ except (ValueError, ModuleNotFoundError) as e:
 
 # Resto delle importazioni
 import pytz
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, send_file
+from flask import Flask, Response, render_template, request, redirect, url_for, flash, jsonify, session, send_file, abort
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session as SASession
+from sqlalchemy.orm.attributes import set_committed_value
+from markupsafe import Markup
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 
@@ -74,6 +87,14 @@ except ImportError:
     KEYBOARD_AVAILABLE = False
     logger.warning("pynput non disponibile - emulazione tastiera disabilitata")
 
+# Client Redis per la cache condivisa tra processi (opzionale)
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+    redis = None
+
 # Configurazione per lettore seriale
 # Incapsula in un blocco try/except per rendere opzionale pyserial
 try:
@@ -90,6 +111,9 @@ try:
     from config_serial import load_config, save_config
     serial_config = load_config()
     SERIAL_CONFIG = serial_config['serial']
+    READER_CONFIG = serial_config.get('reader', {})
+    SCANNER_LANES = serial_config.get('lanes', [])
+    RECOVERY_CONFIG = serial_config.get('error_recovery', {})
     logger.info("Configurazione seriale caricata da config_serial.json")
 except ImportError:
     logger.warning("config_serial.py non trovato, uso configurazione legacy")
@@ -102,6 +126,9 @@ except ImportError:
         'stopbits': int(os.environ.get('SERIAL_STOPBITS', 1)),
         'timeout': float(os.environ.get('SERIAL_TIMEOUT', 1.0))
     }
+    READER_CONFIG = {}
+    SCANNER_LANES = []
+    RECOVERY_CONFIG = {}
     save_config = None
 except Exception as e:
     logger.error(f"Errore nel caricamento configurazione seriale: {e}")
@@ -114,6 +141,9 @@ except Exception as e:
         'stopbits': 1,
         'timeout': 1.0
     }
+    READER_CONFIG = {}
+    SCANNER_LANES = []
+    RECOVERY_CONFIG = {}
     save_config = None
 
 # Inizializzazione dell'applicazione
@@ -121,10 +151,75 @@ app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'chiave_segreta_molto_sicura')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URI', 'sqlite:///vinicola.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+# Pool di connessioni per i server PostgreSQL (più mense sullo stesso registro)
+if app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgresql'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true'
+    }
+app.config['PG_DUMP_PATH'] = os.environ.get('PG_DUMP_PATH', 'pg_dump')
+app.config['PG_RESTORE_PATH'] = os.environ.get('PG_RESTORE_PATH', 'pg_restore')
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16 MB max upload size
 app.config['APP_NAME'] = os.environ.get('APP_NAME', 'Gestione Vinicola')
 app.config['APP_VERSION'] = os.environ.get('APP_VERSION', '1.0.0')
 
+# Profilo prestazionale SQLite applicato a ogni nuova connessione (vedi apply_sqlite_profile)
+app.config['SQLITE_PROFILE_ENABLED'] = os.environ.get('SQLITE_PROFILE_ENABLED', 'true').lower() == 'true'
+app.config['SQLITE_PRAGMAS'] = {
+    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', -64000)),  # Valore negativo = KiB (64 MB)
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+    'temp_store': os.environ.get('SQLITE_TEMP_STORE', 'MEMORY'),
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)),  # Millisecondi
+}
+
+# Archivio delle transazioni storiche: database SQLite collegato con ATTACH (vedi archive_old_transactions).
+# Senza TRANSACTION_ARCHIVE_PATH l'archivio è <nome database>_archive.db accanto al database principale
+app.config['TRANSACTION_ARCHIVE_ENABLED'] = os.environ.get('TRANSACTION_ARCHIVE_ENABLED', 'true').lower() == 'true'
+app.config['TRANSACTION_ARCHIVE_PATH'] = os.environ.get('TRANSACTION_ARCHIVE_PATH')
+app.config['TRANSACTION_ARCHIVE_DAYS'] = int(os.environ.get('TRANSACTION_ARCHIVE_DAYS', 365))
+app.config['TRANSACTION_ARCHIVE_BATCH_SIZE'] = int(os.environ.get('TRANSACTION_ARCHIVE_BATCH_SIZE', 1000))
+app.config['TRANSACTION_ARCHIVE_INTERVAL_HOURS'] = float(os.environ.get('TRANSACTION_ARCHIVE_INTERVAL_HOURS', 24))
+
+# Ogni quanti secondi la cache delle impostazioni globali ricontrolla il contatore di versione
+app.config['SETTINGS_CACHE_CHECK_SECONDS'] = float(os.environ.get('SETTINGS_CACHE_CHECK_SECONDS', 5))
+
+# Intervallo di compattazione del registro di cassa nel saldo consolidato (vedi compact_cash_ledger)
+app.config['CASH_LEDGER_COMPACT_INTERVAL_SECONDS'] = float(os.environ.get('CASH_LEDGER_COMPACT_INTERVAL_SECONDS', 60))
+
+# Coda di scrittura con group commit per acquisti e ricariche (vedi WritePipeline)
+app.config['WRITE_PIPELINE_ENABLED'] = os.environ.get('WRITE_PIPELINE_ENABLED', 'false').lower() == 'true'
+app.config['WRITE_PIPELINE_BATCH_WINDOW_MS'] = float(os.environ.get('WRITE_PIPELINE_BATCH_WINDOW_MS', 5))
+app.config['WRITE_PIPELINE_MAX_BATCH'] = int(os.environ.get('WRITE_PIPELINE_MAX_BATCH', 100))
+app.config['WRITE_PIPELINE_TIMEOUT'] = float(os.environ.get('WRITE_PIPELINE_TIMEOUT', 30))  # Secondi
+
+# Backend delle versioni dei dati condivise tra processi: 'memory', 'sqlite' o 'redis'
+# (vedi create_cache_backend). Con più worker serve 'sqlite' o 'redis'.
+app.config['CACHE_BACKEND'] = os.environ.get('CACHE_BACKEND', 'memory').lower()
+app.config['CACHE_SQLITE_PATH'] = os.environ.get(
+    'CACHE_SQLITE_PATH', os.path.join(app.instance_path, 'vinicola_cache.db'))
+app.config['CACHE_REDIS_URL'] = os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+app.config['CACHE_KEY_PREFIX'] = os.environ.get('CACHE_KEY_PREFIX', 'vinicola:')
+
+# Numero massimo di frammenti di template renderizzati tenuti in memoria
+app.config['FRAGMENT_CACHE_SIZE'] = int(os.environ.get('FRAGMENT_CACHE_SIZE', 64))
+
+# Cache dei risultati delle query delle pagine admin (vedi QueryCache)
+app.config['QUERY_CACHE_SIZE'] = int(os.environ.get('QUERY_CACHE_SIZE', 128))
+app.config['QUERY_CACHE_TTL_SECONDS'] = float(os.environ.get('QUERY_CACHE_TTL_SECONDS', 300))
+
+# Flusso SSE delle letture (/stream/scans): eventi tenuti per la ripresa e intervallo di heartbeat
+app.config['SCAN_STREAM_BUFFER_SIZE'] = int(os.environ.get('SCAN_STREAM_BUFFER_SIZE', 100))
+app.config['SCAN_STREAM_HEARTBEAT_SECONDS'] = float(os.environ.get('SCAN_STREAM_HEARTBEAT_SECONDS', 15))
+
+# File della configurazione sintesi vocale
+app.config['SPEECH_CONFIG_PATH'] = os.environ.get('SPEECH_CONFIG_PATH', 'speech_nicknames.json')
+
 # Cartella per uploads temporanei se necessario
 UPLOAD_FOLDER = os.path.join(app.root_path, 'uploads')
 if not os.path.exists(UPLOAD_FOLDER):
@@ -135,14 +230,109 @@ login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
+
+@event.listens_for(Engine, 'connect')
+def apply_sqlite_profile(dbapi_connection, connection_record):
+    """
+    Applica il profilo SQLite configurato a ogni connessione aperta dal pool:
+    WAL permette letture concorrenti durante le scritture, synchronous=NORMAL
+    evita un fsync a ogni commit e busy_timeout attende il lock invece di
+    fallire subito con "database is locked".
+    """
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    if not app.config['SQLITE_PROFILE_ENABLED']:
+        return
+    
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma, value in app.config['SQLITE_PRAGMAS'].items():
+            cursor.execute(f"PRAGMA {pragma}={value}")
+    finally:
+        cursor.close()
+
+
+def transaction_archive_path(database):
+    """
+    Percorso del database di archivio per il file di database principale indicato:
+    TRANSACTION_ARCHIVE_PATH se impostato, altrimenti <nome>_archive.db nella stessa
+    cartella, così ogni database (installazione, copia di prova, benchmark) ha il proprio.
+    Un database in memoria ha un archivio in memoria.
+    """
+    if app.config['TRANSACTION_ARCHIVE_PATH']:
+        return app.config['TRANSACTION_ARCHIVE_PATH']
+    if not database or database == ':memory:':
+        return ':memory:'
+    stem, _ = os.path.splitext(database)
+    return f"{stem}_archive.db"
+
+
+@event.listens_for(Engine, 'connect')
+def attach_transaction_archive(dbapi_connection, connection_record):
+    """Collega il database di archivio come schema 'archive' su ogni connessione SQLite."""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    if not app.config['TRANSACTION_ARCHIVE_ENABLED']:
+        return
+    
+    cursor = dbapi_connection.cursor()
+    try:
+        main_file = next(row[2] for row in cursor.execute("PRAGMA database_list") if row[1] == 'main')
+    finally:
+        cursor.close()
+    archive_path = transaction_archive_path(main_file)
+    archive_folder = os.path.dirname(archive_path) if archive_path != ':memory:' else None
+    if archive_folder and not os.path.exists(archive_folder):
+        os.makedirs(archive_folder)
+    
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute("ATTACH DATABASE ? AS archive", (archive_path,))
+    finally:
+        cursor.close()
+
+
+@event.listens_for(Engine, 'connect')
+def register_sqlite_functions(dbapi_connection, connection_record):
+    """
+    Registra su ogni connessione SQLite la funzione credit_hash, così che
+    l'UPDATE condizionale del credito ricalcoli l'hash nella stessa istruzione.
+    """
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    dbapi_connection.create_function('credit_hash', 3, compute_credit_hash, deterministic=True)
+
+
+def get_sqlite_diagnostics():
+    """Legge i valori correnti dei PRAGMA del profilo da una connessione del pool."""
+    if db.engine.dialect.name != 'sqlite':
+        return None
+    
+    synchronous_names = {0: 'OFF', 1: 'NORMAL', 2: 'FULL', 3: 'EXTRA'}
+    temp_store_names = {0: 'DEFAULT', 1: 'FILE', 2: 'MEMORY'}
+    
+    with db.engine.connect() as connection:
+        def pragma(name):
+            return connection.exec_driver_sql(f"PRAGMA {name}").scalar()
+        
+        return {
+            'database': db.engine.url.database,
+            'sqlite_version': sqlite3.sqlite_version,
+            'journal_mode': pragma('journal_mode'),
+            'synchronous': synchronous_names.get(pragma('synchronous')),
+            'cache_size': pragma('cache_size'),
+            'mmap_size': pragma('mmap_size'),
+            'temp_store': temp_store_names.get(pragma('temp_store')),
+            'busy_timeout': pragma('busy_timeout'),
+            'page_size': pragma('page_size'),
+            'page_count': pragma('page_count'),
+            'wal_autocheckpoint': pragma('wal_autocheckpoint')
+        }
+
+
 # SocketIO rimosso per compatibilità PyInstaller - ora usa emulazione tastiera diretta
 
-# Configurazione del lettore di codici a barre seriale
-serial_port = None
-barcode_thread = None
-barcode_data = []
-barcode_lock = threading.Lock()
-last_barcode_time = 0  # Timestamp dell'ultimo barcode letto
+# I lettori di codici a barre seriali (uno per cassa) sono gestiti da scanner_manager
 
 #######################
 # Definizione Modelli #
@@ -186,6 +376,7 @@ class Employee(db.Model):
     """
     id = db.Column(db.Integer, primary_key=True)
     code = db.Column(db.String(50), unique=True)  # Codice a barre della card
+    code_key = db.Column(db.String(50), unique=True, index=True)  # Codice normalizzato per le ricerche (vedi normalize_employee_code)
     first_name = db.Column(db.String(100))
     last_name = db.Column(db.String(100))
     rank = db.Column(db.String(100))
@@ -193,6 +384,12 @@ class Employee(db.Model):
     credit_hash = db.Column(db.String(64))  # Hash per verificare l'integrità del credito
     credit_limit = db.Column(db.Numeric(10, 2), default=0)  # Limite di credito negativo consentito
     
+    @db.validates('code')
+    def validate_code(self, key, code):
+        """Mantiene allineato code_key a ogni inserimento o modifica del codice."""
+        self.code_key = normalize_employee_code(code)
+        return code
+    
     def update_credit(self, new_credit):
         """Aggiorna il credito e genera un nuovo hash."""
         self.credit = new_credit
@@ -200,21 +397,24 @@ class Employee(db.Model):
     
     def update_credit_hash(self):
         """Crea un hash del credito con una chiave segreta per verificare l'integrità."""
-        secret = app.config['SECRET_KEY']
-        data = f"{self.id}:{self.credit}:{self.credit_limit}:{secret}"
-        self.credit_hash = hashlib.sha256(data.encode()).hexdigest()
+        self.credit_hash = compute_credit_hash(self.id, self.credit, self.credit_limit)
+        forget_credit_verification(self.id)
     
     def verify_credit_integrity(self):
-        """Verifica che il credito non sia stato manipolato confrontando l'hash."""
-        if not self.credit_hash:  # Se non c'è hash, crealo
+        """
+        Verifica che il credito non sia stato manipolato confrontando l'hash.
+        Se l'hash manca viene creato, ma il salvataggio resta a chi confermerà la sessione.
+        """
+        if not self.credit_hash:
             self.update_credit_hash()
-            db.session.commit()
             return True
-            
-        secret = app.config['SECRET_KEY']
-        data = f"{self.id}:{self.credit}:{self.credit_limit}:{secret}"
-        computed_hash = hashlib.sha256(data.encode()).hexdigest()
-        return computed_hash == self.credit_hash
+        
+        return verify_credit_hash(self.id, self.credit, self.credit_limit, self.credit_hash)
+    
+    def effective_credit_limit(self):
+        """Limite di credito negativo da applicare: quello globale se impostato, altrimenti quello del dipendente."""
+        global_limit = GlobalSetting.get_value('credit_limit')
+        return global_limit if global_limit is not None else self.credit_limit
     
     def has_sufficient_credit(self, amount):
         """
@@ -225,18 +425,7 @@ class Employee(db.Model):
         if self.code == 'CASSA':
             return True
             
-        # Ottieni il limite di credito globale, se non esiste usa il limite dell'utente
-        global_limit = GlobalSetting.get('credit_limit', None)
-        
-        if global_limit is not None:
-            try:
-                limit = Decimal(global_limit)
-            except:
-                limit = self.credit_limit
-        else:
-            limit = self.credit_limit
-            
-        return (self.credit - amount) >= -limit
+        return (self.credit - amount) >= -self.effective_credit_limit()
     
     def to_dict(self):
         """Converte l'oggetto in un dizionario."""
@@ -256,6 +445,215 @@ class Employee(db.Model):
             'credit_integrity': integrity
         }
 
+def get_employee_for_update(employee_id):
+    """
+    Carica un dipendente bloccandone la riga fino al commit (SELECT ... FOR UPDATE),
+    così due terminali non modificano lo stesso credito in parallelo.
+    Su SQLite la clausola viene omessa: il database ha un solo scrittore.
+    Risponde 404 se il dipendente non esiste.
+    """
+    try:
+        employee_id = int(employee_id)
+    except (TypeError, ValueError):
+        abort(404)
+    
+    employee = db.session.get(Employee, employee_id, with_for_update=True, populate_existing=True)
+    if employee is None:
+        abort(404)
+    return employee
+
+
+def format_credit_amount(value):
+    """Forma canonica di un importo per l'hash del credito: due decimali, come nella colonna."""
+    if value is None:
+        return 'None'
+    return str(Decimal(str(value)).quantize(Decimal('0.01')))
+
+
+# Contesto HMAC con la chiave segreta già elaborata: ogni hash parte da una sua copia
+CREDIT_HASH_CONTEXT = hmac.new(app.config['SECRET_KEY'].encode('utf-8'), digestmod=hashlib.sha256)
+
+# Esiti delle verifiche già fatte: id -> (credito, limite, hash, esito)
+_credit_verifications = {}
+
+
+def compute_credit_hash(employee_id, credit, credit_limit):
+    """
+    Hash di integrità del credito di un dipendente (HMAC-SHA256 con la chiave segreta).
+    Gli importi sono normalizzati a due decimali, così l'hash calcolato in Python
+    coincide con quello calcolato da SQLite (che passa i valori come float).
+    """
+    context = CREDIT_HASH_CONTEXT.copy()
+    context.update(f"{employee_id}:{format_credit_amount(credit)}:{format_credit_amount(credit_limit)}".encode('utf-8'))
+    return context.hexdigest()
+
+
+def compute_legacy_credit_hash(employee_id, credit, credit_limit):
+    """Formato precedente dell'hash (SHA-256 con la chiave in coda), usato solo per la migrazione."""
+    secret = app.config['SECRET_KEY']
+    data = f"{employee_id}:{format_credit_amount(credit)}:{format_credit_amount(credit_limit)}:{secret}"
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def verify_credit_hash(employee_id, credit, credit_limit, credit_hash):
+    """
+    Verifica l'hash di un dipendente ricordando l'esito: finché credito, limite
+    e hash non cambiano, le serializzazioni successive non ricalcolano nulla.
+    Accetta anche gli hash nel formato precedente non ancora migrati.
+    """
+    if not credit_hash:
+        return False
+    
+    key = (credit, credit_limit, credit_hash)
+    cached = _credit_verifications.get(employee_id)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    
+    valid = hmac.compare_digest(compute_credit_hash(employee_id, credit, credit_limit), credit_hash) or \
+        hmac.compare_digest(compute_legacy_credit_hash(employee_id, credit, credit_limit), credit_hash)
+    _credit_verifications[employee_id] = (key, valid)
+    return valid
+
+
+def forget_credit_verification(employee_id=None):
+    """Dimentica l'esito memorizzato per un dipendente (o per tutti)."""
+    if employee_id is None:
+        _credit_verifications.clear()
+    else:
+        _credit_verifications.pop(employee_id, None)
+
+
+def apply_credit_delta(employee, delta, min_credit=None):
+    """
+    Somma delta al credito del dipendente con un unico UPDATE condizionale:
+    
+        UPDATE employee SET credit = round(credit + :delta, 2), credit_hash = ...
+        WHERE id = :id AND round(credit + :delta, 2) >= :min_credit
+    
+    Il database applica la modifica in modo atomico, quindi due terminali che
+    addebitano lo stesso badge non perdono aggiornamenti e la riga resta bloccata
+    solo per la durata dell'istruzione. Il limite si confronta sul valore arrotondato
+    ai centesimi: SQLite somma i NUMERIC come REAL (0.70 - 0.80 = -0.10000000000000009)
+    e senza arrotondamento rifiuterebbe un acquisto che arriva esattamente al limite.
+    Su SQLite l'hash viene ricalcolato dalla
+    funzione credit_hash nella stessa istruzione; sugli altri database viene
+    riscritto subito dopo, mentre la riga è ancora bloccata dalla transazione.
+    
+    Ritorna il nuovo credito, oppure None se la condizione non è soddisfatta
+    (credito insufficiente). L'istanza in sessione viene allineata ai nuovi valori.
+    """
+    delta = Decimal(str(delta))
+    new_credit = db.func.round(Employee.credit + delta, 2)
+    values = {'credit': new_credit}
+    
+    dialect = db.engine.dialect
+    if dialect.name == 'sqlite':
+        values['credit_hash'] = db.func.credit_hash(Employee.id, new_credit, Employee.credit_limit)
+    
+    statement = db.update(Employee).where(Employee.id == employee.id)
+    if min_credit is not None:
+        statement = statement.where(new_credit >= Decimal(str(min_credit)))
+    statement = statement.values(**values).execution_options(synchronize_session=False)
+    
+    if dialect.update_returning:
+        row = db.session.execute(
+            statement.returning(Employee.credit, Employee.credit_limit, Employee.credit_hash)
+        ).first()
+    else:
+        result = db.session.execute(statement)
+        row = None
+        if result.rowcount:
+            row = db.session.execute(
+                db.select(Employee.credit, Employee.credit_limit, Employee.credit_hash)
+                .where(Employee.id == employee.id)
+            ).first()
+    
+    if row is None:
+        return None
+    
+    credit, credit_limit, credit_hash = row
+    if dialect.name != 'sqlite':
+        credit_hash = compute_credit_hash(employee.id, credit, credit_limit)
+        db.session.execute(
+            db.update(Employee)
+            .where(Employee.id == employee.id)
+            .values(credit_hash=credit_hash)
+            .execution_options(synchronize_session=False)
+        )
+    
+    set_committed_value(employee, 'credit', credit)
+    set_committed_value(employee, 'credit_hash', credit_hash)
+    mark_employee_changed(db.session(), employee.id)
+    mark_tables_changed(db.session(), Employee.__tablename__)
+    return credit
+
+
+# Casi al limite esatto per check-credit-limits: (credito, variazione, credito minimo, credito atteso o None se rifiutato)
+CREDIT_LIMIT_CHECKS = [
+    ('0.70', '-0.80', '-0.10', '-0.10'),
+    ('0.70', '-0.81', '-0.10', None),
+    ('10.00', '-10.00', '0', '0.00'),
+    ('0.10', '-0.30', '-0.20', '-0.20'),
+    ('0.30', '-0.10', '0.20', '0.20'),
+]
+
+
+@app.cli.command('check-credit-limits')
+def check_credit_limits_command():
+    """
+    Verifica che il controllo del limite di credito accetti gli acquisti che arrivano
+    esattamente al limite (flask --app app check-credit-limits). Usa dipendenti
+    temporanei in una transazione annullata alla fine.
+    """
+    failures = 0
+    try:
+        for index, (credit, delta, min_credit, expected) in enumerate(CREDIT_LIMIT_CHECKS):
+            employee = Employee(
+                code=f"__CHECK_LIMIT_{index}",
+                first_name='Verifica',
+                last_name='Limite',
+                rank='-',
+                credit=Decimal(credit),
+                credit_limit=Decimal('0')
+            )
+            db.session.add(employee)
+            db.session.flush()
+            
+            result = apply_credit_delta(employee, Decimal(delta), min_credit=Decimal(min_credit))
+            if expected is None:
+                passed = result is None
+            else:
+                passed = result is not None and Decimal(str(result)).quantize(Decimal('0.01')) == Decimal(expected)
+            failures += not passed
+            print(f"{'OK ' if passed else 'ERR'} {credit} {delta} (minimo {min_credit}): "
+                  f"atteso {expected or 'rifiutato'}, ottenuto {result if result is not None else 'rifiutato'}")
+    finally:
+        db.session.rollback()
+    
+    if failures:
+        raise SystemExit(1)
+
+
+def normalize_employee_code(code):
+    """
+    Forma canonica di un codice dipendente usata per le ricerche:
+    senza spazi ai bordi e in maiuscolo, così che i confronti case-insensitive
+    usino l'indice univoco su code_key invece di upper(code).
+    """
+    if code is None:
+        return None
+    code = str(code).strip()
+    return code.upper() if code else None
+
+
+def find_employee_by_code(code):
+    """Cerca un dipendente per codice (case-insensitive) tramite l'indice su code_key."""
+    key = normalize_employee_code(code)
+    if not key:
+        return None
+    return Employee.query.filter_by(code_key=key).first()
+
+
 class Product(db.Model):
     """
     Modello per i prodotti che possono essere acquistati.
@@ -290,9 +688,13 @@ class GlobalSetting(db.Model):
     
     @classmethod
     def get(cls, key, default=None):
-        """Ottiene il valore di un'impostazione."""
-        setting = cls.query.filter_by(key=key).first()
-        return setting.value if setting else default
+        """Ottiene il valore di un'impostazione (dalla cache in memoria)."""
+        return settings_cache.get(key, default)
+    
+    @classmethod
+    def get_value(cls, key, default=None):
+        """Ottiene il valore di un'impostazione già convertito nel suo tipo (vedi SETTING_PARSERS)."""
+        return settings_cache.get_parsed(key, default)
     
     @classmethod
     def set(cls, key, value, description=None):
@@ -305,8 +707,99 @@ class GlobalSetting(db.Model):
         else:
             setting = cls(key=key, value=value, description=description)
             db.session.add(setting)
+        cls.bump_version()
         db.session.commit()
+        settings_cache.invalidate()
         return setting
+    
+    @classmethod
+    def bump_version(cls):
+        """Incrementa il contatore di versione con cui gli altri processi si accorgono delle modifiche."""
+        updated = db.session.execute(
+            db.update(cls).where(cls.key == SETTINGS_VERSION_KEY)
+            .values(value=db.cast(db.cast(cls.value, db.Integer) + 1, db.String))
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not updated:
+            db.session.add(cls(key=SETTINGS_VERSION_KEY, value='1', description='Versione delle impostazioni'))
+
+
+SETTINGS_VERSION_KEY = 'settings_version'
+
+# Conversione delle impostazioni nel loro tipo, eseguita una volta al caricamento della cache
+SETTING_PARSERS = {
+    'credit_limit': Decimal,
+    'prevent_oversell': lambda value: value == 'true',
+}
+
+
+class SettingsCache:
+    """
+    Cache in memoria delle impostazioni globali.
+    
+    Tutte le righe vengono lette con una sola query e convertite una volta sola.
+    GlobalSetting.set svuota la cache del processo corrente; gli altri processi
+    si accorgono della modifica confrontando il contatore di versione, riletto
+    al massimo ogni SETTINGS_CACHE_CHECK_SECONDS.
+    """
+    
+    def __init__(self, check_interval):
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.values = None
+        self.parsed = {}
+        self.version = None
+        self.checked_at = 0
+    
+    def load(self):
+        rows = db.session.query(GlobalSetting.key, GlobalSetting.value).all()
+        values = {key: value for key, value in rows}
+        parsed = {}
+        for key, parser in SETTING_PARSERS.items():
+            if values.get(key) is None:
+                continue
+            try:
+                parsed[key] = parser(values[key])
+            except Exception:
+                logger.warning(f"Invalid value for setting {key}: {values[key]!r}")
+        
+        with self.lock:
+            self.values = values
+            self.parsed = parsed
+            self.version = values.get(SETTINGS_VERSION_KEY)
+            self.checked_at = time.monotonic()
+        return values, parsed
+    
+    def ensure_fresh(self):
+        """Ritorna i valori grezzi e convertiti, ricaricandoli se la versione è cambiata."""
+        values, parsed = self.values, self.parsed
+        if values is None:
+            return self.load()
+        if time.monotonic() - self.checked_at < self.check_interval:
+            return values, parsed
+        
+        version = db.session.query(GlobalSetting.value).filter_by(key=SETTINGS_VERSION_KEY).scalar()
+        if version != self.version:
+            return self.load()
+        self.checked_at = time.monotonic()
+        return values, parsed
+    
+    def invalidate(self):
+        with self.lock:
+            self.values = None
+            self.parsed = {}
+    
+    def get(self, key, default=None):
+        values, _ = self.ensure_fresh()
+        value = values.get(key)
+        return value if value is not None else default
+    
+    def get_parsed(self, key, default=None):
+        _, parsed = self.ensure_fresh()
+        return parsed.get(key, default)
+
+
+settings_cache = SettingsCache(app.config['SETTINGS_CACHE_CHECK_SECONDS'])
 
 
 class Transaction(db.Model):
@@ -324,6 +817,14 @@ class Transaction(db.Model):
     transaction_type = db.Column(db.String(20))  # "credit" (ricarica) o "debit" (consumo)
     quantity = db.Column(db.Integer, default=1)  # Quantità del prodotto acquistato
     
+    # Indici compositi per i filtri per intervallo di date (vedi period_bounds).
+    # AUTOINCREMENT: SQLite non deve riusare gli id delle transazioni eliminate o archiviate
+    __table_args__ = (
+        db.Index('ix_transaction_timestamp_type', 'timestamp', 'transaction_type'),
+        db.Index('ix_transaction_employee_timestamp', 'employee_id', 'timestamp'),
+        {'sqlite_autoincrement': True}
+    )
+    
     # Relazioni
     employee = db.relationship('Employee', backref=db.backref('transactions', lazy=True, order_by="desc(Transaction.timestamp)"))
     operator = db.relationship('Operator', backref=db.backref('transactions', lazy=True))
@@ -343,6 +844,94 @@ class Transaction(db.Model):
             'transaction_type': self.transaction_type
         }
 
+
+class DailyRollup(db.Model):
+    """
+    Riepilogo giornaliero delle transazioni per prodotto, operatore e tipo.
+    Viene aggiornato nella stessa transazione del database di ogni scrittura
+    su Transaction (vedi update_daily_rollups) e alimenta i totali dei report.
+    """
+    __tablename__ = 'daily_rollup'
+
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    transaction_type = db.Column(db.String(20), nullable=False)
+    product_id = db.Column(db.Integer, nullable=False, default=0)  # 0 = nessun prodotto a catalogo
+    product_name = db.Column(db.String(100), nullable=False, default='')  # Nome personalizzato, senza "(xN)"
+    operator_id = db.Column(db.Integer, nullable=False, default=0)  # 0 = nessun operatore
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    amount = db.Column(db.Numeric(12, 2), nullable=False, default=0)  # Somma con segno
+    amount_abs = db.Column(db.Numeric(12, 2), nullable=False, default=0)  # Somma dei valori assoluti
+    transaction_count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('day', 'transaction_type', 'product_id', 'product_name', 'operator_id',
+                            name='uq_daily_rollup_key'),
+    )
+
+
+class CashMovement(db.Model):
+    """
+    Movimento del registro di cassa (solo inserimenti).
+    Ogni entrata o uscita di contante aggiunge una riga con l'importo con segno,
+    così i terminali non si contendono la riga dell'utente CASSA.
+    """
+    __tablename__ = 'cash_movement'
+
+    id = db.Column(db.Integer, primary_key=True)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    amount = db.Column(db.Numeric(12, 2), nullable=False)  # Positivo se entra contante, negativo se esce
+    description = db.Column(db.String(200))
+
+
+class CashSnapshot(db.Model):
+    """
+    Saldo di cassa consolidato fino al movimento last_movement_id.
+    Il saldo corrente è balance più la somma dei movimenti successivi
+    (vedi get_cash_balance e compact_cash_ledger).
+    """
+    __tablename__ = 'cash_snapshot'
+
+    id = db.Column(db.Integer, primary_key=True)
+    balance = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    last_movement_id = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+# Tabella delle transazioni archiviate nel database collegato come schema 'archive'.
+# Ha metadati propri: non viene creata da db.create_all() ma da ensure_archive_schema().
+archive_metadata = db.MetaData()
+archived_transaction_table = db.Table(
+    'transaction', archive_metadata,
+    db.Column('id', db.Integer, primary_key=True),
+    db.Column('timestamp', db.DateTime),
+    db.Column('employee_id', db.Integer),
+    db.Column('operator_id', db.Integer),
+    db.Column('amount', db.Numeric(10, 2)),
+    db.Column('product_id', db.Integer),
+    db.Column('custom_product_name', db.String(100)),
+    db.Column('transaction_type', db.String(20)),
+    db.Column('quantity', db.Integer),
+    db.Index('ix_archive_transaction_timestamp', 'timestamp'),
+    db.Index('ix_archive_transaction_employee_timestamp', 'employee_id', 'timestamp'),
+    schema='archive'
+)
+
+
+class ArchivedTransaction(db.Model):
+    """
+    Transazione spostata nell'archivio. Sola lettura: espone gli stessi attributi
+    di Transaction così che elenchi e report possano unire i due insiemi.
+    """
+    __table__ = archived_transaction_table
+    
+    employee = db.relationship('Employee', primaryjoin='foreign(ArchivedTransaction.employee_id) == Employee.id', viewonly=True)
+    operator = db.relationship('Operator', primaryjoin='foreign(ArchivedTransaction.operator_id) == Operator.id', viewonly=True)
+    product = db.relationship('Product', primaryjoin='foreign(ArchivedTransaction.product_id) == Product.id', viewonly=True)
+    
+    to_dict = Transaction.to_dict
+
+
 # Funzione per generare password casuali per gli operatori
 def generate_random_password(length=5):
     """Genera una password casuale di lunghezza specificata."""
@@ -412,200 +1001,2360 @@ def load_user(user_id):
 
 
 ###################################
-# Funzioni per il lettore seriale #
+# Rubrica dei dipendenti          #
 ###################################
 
-def setup_barcode_reader():
-    """Configura e avvia il lettore di codici a barre seriale."""
-    global serial_port, barcode_thread
+class EmployeeDirectory:
+    """
+    Rubrica in memoria dei dipendenti, indicizzata per codice normalizzato.
     
-    if not SERIAL_AVAILABLE:
-        logger.warning("PySerial non installato. Lettore seriale non disponibile.")
-        return False
+    Contiene per ogni dipendente un record compatto con gli stessi campi di
+    Employee.to_dict(), così l'identificazione di un badge non interroga il
+    database. Viene caricata all'avvio e riallineata dopo ogni commit che
+    tocca la tabella employee (vedi track_directory_changes); se la tabella
+    viene modificata da un altro processo la rubrica è ricaricata per intero.
+    """
     
-    try:
-        # Usa i parametri di configurazione
-        port = SERIAL_CONFIG['port']
-        baud_rate = SERIAL_CONFIG['baudrate']
-        
-        serial_port = serial.Serial(
-            port, 
-            baud_rate, 
-            bytesize=SERIAL_CONFIG['bytesize'],
-            parity=SERIAL_CONFIG['parity'],
-            stopbits=SERIAL_CONFIG['stopbits'],
-            timeout=SERIAL_CONFIG['timeout']
-        )
-        logger.info(f"Lettore di codici a barre connesso su {port}")
-        
-        # Avvio thread per la lettura in background
-        barcode_thread = threading.Thread(target=read_barcode_serial, daemon=True)
-        barcode_thread.start()
-        
-        return True
-    except Exception as e:
-        logger.error(f"Errore configurazione lettore di codici a barre: {str(e)}")
-        return False
-
-
-def read_barcode_serial():
-    """Funzione per leggere continuamente dal lettore di codici a barre."""
-    global serial_port, barcode_data, barcode_lock, last_barcode_time
+    COLUMNS = (Employee.id, Employee.code, Employee.first_name, Employee.last_name, Employee.rank,
+               Employee.credit, Employee.credit_limit, Employee.credit_hash)
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.by_code = {}
+        self.by_id = {}
+        self.loaded = False
+        self.synced = None  # Stato (epoca, versione) della tabella employee all'ultimo allineamento
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.refreshes = 0
+    
+    @staticmethod
+    def make_record(row):
+        """Record compatto di un dipendente a partire da una riga della tabella."""
+        return {
+            'id': row.id,
+            'code': row.code,
+            'first_name': row.first_name,
+            'last_name': row.last_name,
+            'rank': row.rank,
+            'credit': float(row.credit) if row.credit else 0,
+            'credit_limit': float(row.credit_limit) if row.credit_limit else 0,
+            'credit_integrity': verify_credit_hash(row.id, row.credit, row.credit_limit, row.credit_hash)
+        }
     
-    buffer = ""
+    def fetch(self, employee_ids=None):
+        """Legge i dipendenti dal database con una connessione separata dalla sessione."""
+        statement = db.select(*self.COLUMNS)
+        if employee_ids is not None:
+            statement = statement.where(Employee.id.in_(employee_ids))
+        with db.engine.connect() as connection:
+            return [self.make_record(row) for row in connection.execute(statement)]
+    
+    def store(self, record):
+        old = self.by_id.get(record['id'])
+        if old:
+            self.by_code.pop(normalize_employee_code(old['code']), None)
+        self.by_id[record['id']] = record
+        key = normalize_employee_code(record['code'])
+        if key:
+            self.by_code[key] = record
+    
+    def load(self):
+        """Carica l'intera rubrica."""
+        synced = data_versions.snapshot([Employee.__tablename__])
+        records = self.fetch()
+        with self.lock:
+            self.synced = synced
+            self.by_code = {}
+            self.by_id = {}
+            for record in records:
+                self.store(record)
+            self.loaded = True
+            self.loads += 1
+        logger.info(f"Employee directory loaded: {len(records)} employees")
+    
+    def ensure_loaded(self):
+        state, changed_elsewhere = data_versions.sync(Employee.__tablename__, self.synced)
+        if not self.loaded or changed_elsewhere:
+            self.load()
+        else:
+            self.synced = state
+    
+    def invalidate(self):
+        """Svuota la rubrica; verrà ricaricata al prossimo accesso."""
+        with self.lock:
+            self.loaded = False
+            self.by_code = {}
+            self.by_id = {}
+    
+    def refresh(self, employee_ids):
+        """Rilegge dal database i dipendenti indicati (quelli non più presenti vengono rimossi)."""
+        if not self.loaded:
+            return
+        records = self.fetch(employee_ids)
+        with self.lock:
+            found = set()
+            for record in records:
+                self.store(record)
+                found.add(record['id'])
+            for employee_id in set(employee_ids) - found:
+                old = self.by_id.pop(employee_id, None)
+                if old:
+                    self.by_code.pop(normalize_employee_code(old['code']), None)
+            self.refreshes += 1
+    
+    def count_lookup(self, record):
+        with self.lock:
+            if record:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return record
     
-    while True:
+    def get(self, code):
+        """Record del dipendente con il codice indicato (case-insensitive), o None."""
+        self.ensure_loaded()
+        return self.count_lookup(self.by_code.get(normalize_employee_code(code)))
+    
+    def get_by_id(self, employee_id):
+        """Record del dipendente con l'id indicato, o None."""
         try:
-            if serial_port and serial_port.is_open:
-                # Leggi i dati dalla porta seriale
-                data = serial_port.read(serial_port.in_waiting or 1)
-                
-                if data:
-                    # Decodifica i dati
-                    text = data.decode('utf-8', errors='replace')
-                    buffer += text
-                    
-                    # Controlla se abbiamo ricevuto un "invio" (fine codice)
-                    if '\n' in buffer or '\r' in buffer:
-                        # Pulisci il codice ricevuto
-                        barcode = buffer.strip()
-                        
-                        if barcode:  # Solo se il barcode non è vuoto
-                            with barcode_lock:
-                                # Aggiungi il codice alla lista
-                                barcode_data.append(barcode)
-                                # Mantieni solo gli ultimi 5 codici letti
-                                if len(barcode_data) > 5:
-                                    barcode_data.pop(0)
-                                # Aggiorna il timestamp
-                                last_barcode_time = time.time()
-                        
-                            logger.info(f"Codice a barre letto: {barcode}")
-                            
-                            # Cerca immediatamente il dipendente e invia via WebSocket
-                            with app.app_context():
-                                employee = Employee.query.filter(db.func.upper(Employee.code) == db.func.upper(barcode)).first()
-                                
-                                if employee:
-                                    # Verifica l'integrità del credito
-                                    if not employee.verify_credit_integrity():
-                                        employee.update_credit_hash()
-                                        db.session.commit()
-                                        logger.warning(f"Credit integrity issue fixed for {employee.first_name} {employee.last_name}")
-                                    
-                                    logger.info(f"Invio dipendente via WebSocket: {employee.first_name} {employee.last_name}")
-                                    
-                                    # Emula digitazione del codice invece di WebSocket
-                                    if KEYBOARD_AVAILABLE:
-                                        try:
-                                            keyboard_controller = keyboard.Controller()
-                                            keyboard_controller.type(barcode)
-                                            keyboard_controller.press(keyboard.Key.enter)
-                                            keyboard_controller.release(keyboard.Key.enter)
-                                        except Exception as e:
-                                            logger.error(f"Errore emulazione tastiera: {e}")
-                                    
-                                    logger.info("Evento barcode_scanned inviato con successo")
-                                else:
-                                    logger.warning(f"Dipendente non trovato per barcode: {barcode}")
-                                    
-                                    # Dipendente non trovato - emula comunque il codice per permettere inserimento manuale
-                                    if KEYBOARD_AVAILABLE:
-                                        try:
-                                            keyboard_controller = keyboard.Controller()
-                                            keyboard_controller.type(barcode)
-                                            keyboard_controller.press(keyboard.Key.enter)
-                                            keyboard_controller.release(keyboard.Key.enter)
-                                        except Exception as e:
-                                            logger.error(f"Errore emulazione tastiera: {e}")
-                                    
-                                    logger.info(f"⚠️ Evento barcode_scanned (non trovato) inviato")
-                        
-                        buffer = ""
-            
-            # Piccola pausa per ridurre l'utilizzo della CPU
-            time.sleep(0.1)
-            
+            employee_id = int(employee_id)
+        except (TypeError, ValueError):
+            return None
+        self.ensure_loaded()
+        return self.count_lookup(self.by_id.get(employee_id))
+    
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'loaded': self.loaded,
+                'size': len(self.by_id),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else None,
+                'loads': self.loads,
+                'refreshes': self.refreshes
+            }
+
+
+employee_directory = EmployeeDirectory()
+
+
+def mark_employee_changed(session, employee_id):
+    """Segnala che il dipendente va riletto nella rubrica dopo il commit della sessione."""
+    session.info.setdefault('directory_changes', set()).add(employee_id)
+
+
+@event.listens_for(SASession, 'after_flush')
+def track_directory_changes(session, flush_context):
+    """Raccoglie gli id dei dipendenti inseriti, modificati o eliminati nel flush."""
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(instance, Employee) and instance.id is not None:
+            mark_employee_changed(session, instance.id)
+
+
+@event.listens_for(SASession, 'after_commit')
+def refresh_directory_after_commit(session):
+    """Riallinea la rubrica con i dipendenti modificati dalla transazione appena confermata."""
+    changes = session.info.pop('directory_changes', None)
+    if changes:
+        try:
+            employee_directory.refresh(changes)
         except Exception as e:
-            logger.error(f"Errore lettura codice a barre: {str(e)}")
-            # Log errore scanner (non più inviato via WebSocket)
-            logger.error(f"Errore scanner: {str(e)}")
-            time.sleep(1)  # Pausa più lunga in caso di errore
+            logger.error(f"Errore aggiornamento rubrica dipendenti: {str(e)}")
+            employee_directory.invalidate()
 
 
-def get_last_barcode():
-    """Restituisce l'ultimo codice a barre letto dal lettore seriale."""
-    global barcode_data, barcode_lock, last_barcode_time
-    
-    with barcode_lock:
-        if barcode_data:
-            return {
-                'barcode': barcode_data[-1],
-                'timestamp': last_barcode_time
-            }
-        return None
+@event.listens_for(SASession, 'after_rollback')
+def discard_directory_changes(session):
+    session.info.pop('directory_changes', None)
 
 
-##########################
-# Funzioni di utilità   #
-##########################
+def repair_credit_hash(employee_id):
+    """Rigenera l'hash di integrità di un dipendente e ritorna il record aggiornato della rubrica."""
+    employee = db.session.get(Employee, employee_id)
+    if employee is None:
+        return None
+    employee.update_credit_hash()
+    db.session.commit()
+    return employee_directory.get_by_id(employee_id)
 
-def get_credit_stats(employee_id):
-    """Calcola statistiche sul credito di un dipendente."""
-    total_added = db.session.query(db.func.sum(Transaction.amount)).\
-        filter(Transaction.employee_id == employee_id, 
-               Transaction.transaction_type == 'credit').scalar() or 0
-               
-    total_spent = db.session.query(db.func.sum(Transaction.amount)).\
-        filter(Transaction.employee_id == employee_id, 
-               Transaction.transaction_type == 'debit').scalar() or 0
-    
-    # Converti in float per evitare problemi con Decimal/JSON
-    return {
-        'total_added': float(total_added),
-        'total_spent': abs(float(total_spent))
-    }
 
+###################################
+# Autenticazione operatori        #
+###################################
 
-def get_system_stats():
-    """Ottiene statistiche globali del sistema."""
-    total_employees = Employee.query.count()
-    total_credit = db.session.query(db.func.sum(Employee.credit)).scalar() or 0
-    total_transactions = Transaction.query.filter(Transaction.transaction_type != 'cancellation').count()
+class OperatorAuth:
+    """
+    Mappa in memoria dal digest della password all'operatore.
+    
+    Evita di scorrere la tabella operatori (colonna password non indicizzata)
+    a ogni azione protetta. La mappa viene ricostruita al primo accesso dopo
+    il commit di una modifica agli operatori, anche se fatta da un altro
+    processo; se non può essere caricata la ricerca torna sul database.
+    La ricerca è un accesso al dizionario con il digest SHA-256 della password:
+    non è un confronto a tempo costante, ma il tempo dipende dal digest e non
+    dalla password in chiaro.
+    """
     
-    # Transazioni recenti (ultime 24 ore)
-    yesterday = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-    recent_transactions = Transaction.query.filter(Transaction.timestamp >= yesterday, Transaction.transaction_type != 'cancellation').count()
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = None  # digest -> [(id, attivo)] in ordine di id
+        self.synced = None  # Stato (epoca, versione) della tabella operator all'ultimo caricamento
+        self.loads = 0
+        self.hits = 0
+        self.misses = 0
+        self.fallbacks = 0
+    
+    @staticmethod
+    def digest(password):
+        return hashlib.sha256(password.encode('utf-8')).digest()
+    
+    def invalidate(self):
+        with self.lock:
+            self.entries = None
+    
+    def load(self):
+        entries = {}
+        self.synced = data_versions.snapshot([Operator.__tablename__])
+        statement = db.select(Operator.id, Operator.password, Operator.active).order_by(Operator.id)
+        with db.engine.connect() as connection:
+            for row in connection.execute(statement):
+                if row.password is None:
+                    continue
+                entries.setdefault(self.digest(row.password), []).append((row.id, bool(row.active)))
+        self.entries = entries
+        self.loads += 1
     
-    # Lista dipendenti per l'interfaccia prodotti-prima (escludi cassa centrale)
-    employees = Employee.query.filter(Employee.code != 'CASSA').order_by(Employee.last_name, Employee.first_name).all()
-    employees_data = []
-    for emp in employees:
-        employees_data.append({
-            'id': emp.id,
-            'code': emp.code,
-            'first_name': emp.first_name,
-            'last_name': emp.last_name,
-            'rank': emp.rank,
-            'credit': float(emp.credit)
-        })
+    def resolve(self, password, active_only=True):
+        """Ritorna l'id dell'operatore con la password indicata, o None."""
+        if not password:
+            return None
+        digest = self.digest(password)
+        with self.lock:
+            try:
+                state, changed_elsewhere = data_versions.sync(Operator.__tablename__, self.synced)
+                if self.entries is None or changed_elsewhere:
+                    self.load()
+                else:
+                    self.synced = state
+                candidates = self.entries.get(digest, [])
+            except Exception as e:
+                logger.error(f"Errore caricamento mappa operatori: {str(e)}")
+                candidates = None
+        
+        if candidates is None:
+            self.fallbacks += 1
+            query = Operator.query.filter_by(password=password)
+            if active_only:
+                query = query.filter_by(active=True)
+            operator = query.first()
+            return operator.id if operator else None
+        
+        for operator_id, active in candidates:
+            if active or not active_only:
+                self.hits += 1
+                return operator_id
+        self.misses += 1
+        return None
     
-    return {
-        'total_employees': total_employees,
-        'total_credit': float(total_credit),
-        'total_transactions': total_transactions,
-        'recent_transactions': recent_transactions,
-        'employees': employees_data
-    }
+    def stats(self):
+        return {
+            'loaded': self.entries is not None,
+            'loads': self.loads,
+            'hits': self.hits,
+            'misses': self.misses,
+            'fallbacks': self.fallbacks
+        }
 
 
-def export_employees_to_csv():
-    """Esporta i dipendenti in formato CSV."""
-    employees = Employee.query.all()
-    
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
+operator_auth = OperatorAuth()
+
+
+def find_operator_by_password(password, active_only=True):
+    """Operatore con la password indicata (solo attivi, salvo active_only=False)."""
+    operator_id = operator_auth.resolve(password, active_only)
+    return db.session.get(Operator, operator_id) if operator_id is not None else None
+
+
+@event.listens_for(SASession, 'after_flush')
+def track_operator_changes(session, flush_context):
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(instance, Operator):
+            session.info['operators_changed'] = True
+            return
+
+
+@event.listens_for(SASession, 'after_commit')
+def refresh_operators_after_commit(session):
+    if session.info.pop('operators_changed', False):
+        operator_auth.invalidate()
+
+
+@event.listens_for(SASession, 'after_rollback')
+def discard_operator_changes(session):
+    session.info.pop('operators_changed', None)
+
+
+###################################
+# Catalogo prodotti               #
+###################################
+
+class CatalogSnapshot:
+    """
+    Istantanea del catalogo prodotti condivisa da pagine e API.
+    
+    Viene ricostruita solo dopo il commit di una modifica ai prodotti; ogni
+    ricostruzione incrementa la versione, che insieme all'epoca del processo
+    forma l'ETag di /api/products. Il JSON della risposta è serializzato una
+    volta per versione. Se da una versione a quella corrente sono cambiate
+    solo le giacenze, delta_since() ritorna solo quelle. Le modifiche ai
+    prodotti fatte da altri processi causano una ricostruzione completa.
+    """
+    
+    COLUMNS = (Product.id, Product.name, Product.price, Product.active, Product.inventory)
+    DELTA_HISTORY = 500
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.epoch = os.urandom(4).hex()
+        self.version = 0
+        self.base_version = 0  # Versione dell'ultima ricostruzione completa
+        self.products = None
+        self.by_id = {}
+        self.active = []
+        self.active_by_id = []  # Ordine di inserimento, usato dalla griglia dello scanner
+        self.deltas = []  # (versione, {id: giacenza}) dopo base_version
+        self.payload = None
+        self.pending_structural = True
+        self.pending_inventory = set()
+        self.synced = None  # Stato (epoca, versione) della tabella product all'ultimo allineamento
+    
+    @staticmethod
+    def make_record(row):
+        return {
+            'id': row.id,
+            'name': row.name,
+            'price': float(row.price) if row.price else 0,
+            'active': row.active,
+            'inventory': row.inventory
+        }
+    
+    @staticmethod
+    def api_record(product):
+        """Formato di /api/products: giacenza mancante esposta come 0."""
+        return {
+            'id': product['id'],
+            'name': product['name'],
+            'inventory': product['inventory'] if product['inventory'] is not None else 0,
+            'price': product['price']
+        }
+    
+    @property
+    def etag(self):
+        return f"catalog-{self.epoch}-{self.version}"
+    
+    def note_changes(self, structural=False, inventory_ids=()):
+        """Registra le modifiche confermate; l'istantanea viene aggiornata al prossimo accesso."""
+        with self.lock:
+            if structural:
+                self.pending_structural = True
+            self.pending_inventory.update(inventory_ids)
+    
+    def invalidate(self):
+        self.note_changes(structural=True)
+    
+    def current(self):
+        """Ritorna l'istantanea aggiornata, applicando le modifiche in sospeso."""
+        with self.lock:
+            self.synced, changed_elsewhere = data_versions.sync(Product.__tablename__, self.synced)
+            if changed_elsewhere:
+                self.pending_structural = True
+            if self.pending_structural:
+                self.rebuild()
+            elif self.pending_inventory:
+                self.apply_inventory(self.pending_inventory)
+            return self
+    
+    def fetch(self, product_ids=None):
+        statement = db.select(*self.COLUMNS).order_by(Product.name.asc(), Product.id.asc())
+        if product_ids is not None:
+            statement = statement.where(Product.id.in_(product_ids))
+        with db.engine.connect() as connection:
+            return [self.make_record(row) for row in connection.execute(statement)]
+    
+    def rebuild(self):
+        self.products = self.fetch()
+        self.by_id = {product['id']: product for product in self.products}
+        self.version += 1
+        self.base_version = self.version
+        self.deltas = []
+        self.pending_structural = False
+        self.pending_inventory = set()
+        self.serialize()
+    
+    def apply_inventory(self, product_ids):
+        changes = {}
+        for record in self.fetch(list(product_ids)):
+            product = self.by_id.get(record['id'])
+            if product is None:
+                # Prodotto sconosciuto all'istantanea: serve una ricostruzione completa
+                self.rebuild()
+                return
+            product['inventory'] = record['inventory']
+            changes[record['id']] = record['inventory'] if record['inventory'] is not None else 0
+        
+        self.version += 1
+        self.deltas.append((self.version, changes))
+        if len(self.deltas) > self.DELTA_HISTORY:
+            # Oltre questa versione i client ricevono di nuovo il catalogo completo
+            self.base_version = self.deltas.pop(0)[0]
+        self.pending_inventory = set()
+        self.serialize()
+    
+    def serialize(self):
+        self.active = [product for product in self.products if product['active']]
+        self.active_by_id = sorted(self.active, key=lambda product: product['id'])
+        self.payload = json.dumps({
+            'success': True,
+            'epoch': self.epoch,
+            'version': self.version,
+            'products': [self.api_record(product) for product in self.active]
+        }).encode('utf-8')
+    
+    def delta_since(self, epoch, version):
+        """Giacenze cambiate dopo la versione indicata, o None se serve il catalogo completo."""
+        if epoch != self.epoch or version < self.base_version or version > self.version:
+            return None
+        inventory = {}
+        for delta_version, changes in self.deltas:
+            if delta_version > version:
+                inventory.update(changes)
+        return inventory
+
+
+catalog_snapshot = CatalogSnapshot()
+
+
+def mark_catalog_changed(session, structural=False, inventory_ids=()):
+    """Segnala una modifica ai prodotti da applicare al catalogo dopo il commit della sessione."""
+    changes = session.info.setdefault('catalog_changes', {'structural': False, 'inventory': set()})
+    changes['structural'] = changes['structural'] or structural
+    changes['inventory'].update(inventory_ids)
+
+
+@event.listens_for(SASession, 'after_flush')
+def track_catalog_changes(session, flush_context):
+    """Distingue le modifiche alle sole giacenze da quelle che cambiano il catalogo."""
+    for instance in list(session.new) + list(session.deleted):
+        if isinstance(instance, Product):
+            mark_catalog_changed(session, structural=True)
+    
+    for instance in session.dirty:
+        if not isinstance(instance, Product):
+            continue
+        state = db.inspect(instance)
+        changed = {attr.key for attr in state.attrs if attr.history.has_changes()}
+        if changed == {'inventory'}:
+            mark_catalog_changed(session, inventory_ids=[instance.id])
+        elif changed:
+            mark_catalog_changed(session, structural=True)
+
+
+@event.listens_for(SASession, 'after_commit')
+def refresh_catalog_after_commit(session):
+    changes = session.info.pop('catalog_changes', None)
+    if changes:
+        catalog_snapshot.note_changes(changes['structural'], changes['inventory'])
+
+
+@event.listens_for(SASession, 'after_rollback')
+def discard_catalog_changes(session):
+    session.info.pop('catalog_changes', None)
+
+
+###################################
+# Backend delle cache condivise   #
+###################################
+
+class CacheBackend(ABC):
+    """
+    Interfaccia dei backend chiave/valore su cui si appoggiano le cache.
+    
+    I valori sono stringhe; incr() è atomico anche tra processi diversi nei
+    backend condivisi. Le cache in memoria dei singoli processi restano
+    coerenti confrontando le versioni dei dati salvate qui (vedi DataVersions).
+    """
+    
+    name = None
+    
+    @abstractmethod
+    def get(self, key):
+        """Ritorna il valore della chiave, o None se non esiste."""
+    
+    def get_many(self, keys):
+        return [self.get(key) for key in keys]
+    
+    @abstractmethod
+    def set(self, key, value):
+        """Imposta il valore della chiave."""
+    
+    @abstractmethod
+    def add(self, key, value):
+        """Imposta la chiave solo se non esiste; ritorna True se l'ha impostata."""
+    
+    @abstractmethod
+    def incr(self, key):
+        """Incrementa di 1 il contatore (0 se non esiste) e ritorna il nuovo valore."""
+    
+    @abstractmethod
+    def delete(self, key):
+        """Elimina la chiave, se esiste."""
+
+
+class MemoryCacheBackend(CacheBackend):
+    """Backend nel processo corrente: adatto a un solo worker."""
+    
+    name = 'memory'
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+    
+    def get(self, key):
+        return self.values.get(key)
+    
+    def get_many(self, keys):
+        values = self.values
+        return [values.get(key) for key in keys]
+    
+    def set(self, key, value):
+        with self.lock:
+            self.values[key] = str(value)
+    
+    def add(self, key, value):
+        with self.lock:
+            if key in self.values:
+                return False
+            self.values[key] = str(value)
+            return True
+    
+    def incr(self, key):
+        with self.lock:
+            value = int(self.values.get(key) or 0) + 1
+            self.values[key] = str(value)
+            return value
+    
+    def delete(self, key):
+        with self.lock:
+            self.values.pop(key, None)
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """
+    Backend su un file SQLite locale condiviso da tutti i worker della macchina.
+    Ogni processo apre la propria connessione (anche dopo un fork).
+    """
+    
+    name = 'sqlite'
+    
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = None
+        self.pid = None
+    
+    def connect(self):
+        if self.connection is None or self.pid != os.getpid():
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entry (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+            )
+            self.connection = connection
+            self.pid = os.getpid()
+        return self.connection
+    
+    def execute(self, sql, params=()):
+        with self.lock:
+            return self.connect().execute(sql, params).fetchall()
+    
+    def get(self, key):
+        rows = self.execute("SELECT value FROM cache_entry WHERE key = ?", (key,))
+        return rows[0][0] if rows else None
+    
+    def get_many(self, keys):
+        placeholders = ','.join('?' * len(keys))
+        rows = dict(self.execute(f"SELECT key, value FROM cache_entry WHERE key IN ({placeholders})", tuple(keys)))
+        return [rows.get(key) for key in keys]
+    
+    def set(self, key, value):
+        self.execute(
+            "INSERT INTO cache_entry (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, str(value))
+        )
+    
+    def add(self, key, value):
+        with self.lock:
+            cursor = self.connect().execute(
+                "INSERT OR IGNORE INTO cache_entry (key, value) VALUES (?, ?)", (key, str(value))
+            )
+            return cursor.rowcount == 1
+    
+    def incr(self, key):
+        rows = self.execute(
+            "INSERT INTO cache_entry (key, value) VALUES (?, '1') "
+            "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1 RETURNING value",
+            (key,)
+        )
+        return int(rows[0][0])
+    
+    def delete(self, key):
+        self.execute("DELETE FROM cache_entry WHERE key = ?", (key,))
+
+
+class RedisCacheBackend(CacheBackend):
+    """Backend su un server che parla il protocollo Redis (Redis, Valkey, KeyDB, ...)."""
+    
+    name = 'redis'
+    
+    def __init__(self, url, prefix):
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+    
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+    
+    def get_many(self, keys):
+        return self.client.mget([self.prefix + key for key in keys])
+    
+    def set(self, key, value):
+        self.client.set(self.prefix + key, value)
+    
+    def add(self, key, value):
+        return bool(self.client.set(self.prefix + key, value, nx=True))
+    
+    def incr(self, key):
+        return self.client.incr(self.prefix + key)
+    
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+
+def create_cache_backend():
+    """Crea il backend configurato in CACHE_BACKEND; se non è utilizzabile ripiega sulla memoria."""
+    kind = app.config['CACHE_BACKEND']
+    try:
+        if kind == 'sqlite':
+            backend = SQLiteCacheBackend(app.config['CACHE_SQLITE_PATH'])
+            backend.get('epoch')
+            return backend
+        if kind == 'redis':
+            if not REDIS_AVAILABLE:
+                raise RuntimeError("pacchetto redis non installato")
+            backend = RedisCacheBackend(app.config['CACHE_REDIS_URL'], app.config['CACHE_KEY_PREFIX'])
+            backend.client.ping()
+            return backend
+        if kind != 'memory':
+            logger.error(f"Unknown cache backend '{kind}', using memory")
+    except Exception as e:
+        logger.error(f"Cache backend '{kind}' not available, using memory: {str(e)}")
+    return MemoryCacheBackend()
+
+
+###################################
+# Versioni dei dati               #
+###################################
+
+class DataVersions:
+    """
+    Contatori di versione per tabella, incrementati a ogni commit che la modifica.
+    
+    Le API interrogate periodicamente dai terminali ne ricavano l'ETag e
+    rispondono 304 senza interrogare il database se nulla è cambiato.
+    L'epoca distingue gli stati del database: cambia dopo un ripristino, e con
+    il backend in memoria anche a ogni riavvio.
+    
+    I contatori stanno nel backend delle cache, quindi con un backend condiviso
+    tutti i worker vedono gli stessi. Ogni processo ricorda le versioni prodotte
+    dai propri commit: sync() dice a una cache locale se qualcun altro ha
+    modificato la tabella e deve quindi ricaricarla.
+    """
+    
+    OWN_HISTORY = 10000
+    
+    def __init__(self, backend):
+        self.backend = backend
+        self.lock = threading.Lock()
+        self.own = {}  # tabella -> versioni prodotte da questo processo
+        backend.add('epoch', os.urandom(4).hex())
+    
+    @staticmethod
+    def key(table):
+        return f"version:{table}"
+    
+    def bump(self, tables):
+        for table in tables:
+            version = self.backend.incr(self.key(table))
+            with self.lock:
+                own = self.own.setdefault(table, set())
+                own.add(version)
+                if len(own) > self.OWN_HISTORY:
+                    self.own[table] = {v for v in own if v > version - self.OWN_HISTORY}
+    
+    def snapshot(self, tables):
+        """Epoca e versioni correnti delle tabelle indicate."""
+        values = self.backend.get_many(['epoch'] + [self.key(table) for table in tables])
+        return (values[0],) + tuple(int(value or 0) for value in values[1:])
+    
+    def sync(self, table, seen):
+        """
+        Confronta lo stato (epoca, versione) visto da una cache con quello corrente.
+        Ritorna (stato corrente, True se la tabella è stata modificata da altri processi).
+        """
+        state = self.snapshot([table])
+        if seen is None or seen[0] != state[0]:
+            return state, True
+        if state[1] - seen[1] > self.OWN_HISTORY:
+            return state, True
+        with self.lock:
+            own = self.own.get(table, ())
+            changed = any(version not in own for version in range(seen[1] + 1, state[1] + 1))
+        return state, changed
+    
+    def invalidate(self):
+        """Rende non validi tutti gli ETag emessi finora (es. dopo un ripristino)."""
+        self.backend.set('epoch', os.urandom(4).hex())
+    
+    def etag(self, tables, *extra):
+        """ETag forte che dipende dalle versioni delle tabelle indicate e da eventuali parametri."""
+        state = self.snapshot(tables)
+        parts = [state[0]] + [f"{table}.{version}" for table, version in zip(tables, state[1:])]
+        parts.extend(str(value) for value in extra)
+        return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()[:32]
+
+
+cache_backend = create_cache_backend()
+data_versions = DataVersions(cache_backend)
+
+
+def mark_tables_changed(session, *tables):
+    """Segnala tabelle modificate da UPDATE espliciti, da conteggiare dopo il commit della sessione."""
+    session.info.setdefault('changed_tables', set()).update(tables)
+
+
+@event.listens_for(SASession, 'after_flush')
+def track_changed_tables(session, flush_context):
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        table = getattr(instance, '__table__', None)
+        if table is not None:
+            mark_tables_changed(session, table.name)
+
+
+@event.listens_for(SASession, 'after_commit')
+def bump_data_versions_after_commit(session):
+    tables = session.info.pop('changed_tables', None)
+    if tables:
+        try:
+            data_versions.bump(tables)
+        except Exception as e:
+            logger.error(f"Errore aggiornamento versioni dei dati: {str(e)}")
+
+
+@event.listens_for(SASession, 'after_rollback')
+def discard_changed_tables(session):
+    session.info.pop('changed_tables', None)
+
+
+def versioned_json(tables, build, *extra):
+    """
+    Risposta JSON con ETag derivato dalle versioni delle tabelle.
+    Se il client ha già la versione corrente risponde 304 senza chiamare build().
+    """
+    etag = data_versions.etag(tables, *extra)
+    if etag in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+###################################
+# Cache dei frammenti di template #
+###################################
+
+class FragmentCache:
+    """
+    Frammenti HTML già renderizzati, in una LRU di dimensione limitata.
+    
+    La chiave contiene le versioni dei dati da cui il frammento dipende
+    (vedi DataVersions): quando i dati cambiano la chiave cambia e la vecchia
+    voce esce dalla LRU da sola, senza invalidazioni esplicite.
+    """
+    
+    def __init__(self, max_entries):
+        self.lock = threading.Lock()
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def get_or_render(self, key, render):
+        with self.lock:
+            html = self.entries.get(key)
+            if html is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return html
+            self.misses += 1
+        
+        html = render()
+        with self.lock:
+            self.entries[key] = html
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return html
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+    
+    def stats(self):
+        with self.lock:
+            return {
+                'size': len(self.entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+fragment_cache = FragmentCache(app.config['FRAGMENT_CACHE_SIZE'])
+
+
+@app.template_global()
+def cached_fragment(name, tables, *extra, caller=None):
+    """
+    Da usare nei template con un blocco call:
+    
+        {% call cached_fragment('scanner_roster', ['employee']) %} ... {% endcall %}
+    
+    Il contenuto viene renderizzato solo se per quelle versioni delle tabelle
+    (e gli eventuali parametri extra) non è già in cache.
+    """
+    key = (name, data_versions.etag(tables, *extra))
+    return Markup(fragment_cache.get_or_render(key, lambda: str(caller())))
+
+
+class LazyList:
+    """
+    Lista caricata solo al primo utilizzo: passata ai template permette di
+    non eseguire la query se i frammenti che la usano sono già in cache.
+    """
+    
+    def __init__(self, loader):
+        self.loader = loader
+        self.items = None
+    
+    def load(self):
+        if self.items is None:
+            self.items = list(self.loader())
+        return self.items
+    
+    def __iter__(self):
+        return iter(self.load())
+    
+    def __len__(self):
+        return len(self.load())
+    
+    def __bool__(self):
+        return bool(self.load())
+    
+    def __getitem__(self, index):
+        return self.load()[index]
+
+
+###################################
+# Cache dei risultati delle query #
+###################################
+
+class QueryCache:
+    """
+    Risultati di query aggregate riutilizzati finché le tabelle da cui
+    dipendono non cambiano.
+    
+    Ogni voce ricorda le versioni delle sue tabelle (vedi DataVersions) al
+    momento del calcolo: un commit che tocca una di quelle tabelle la rende
+    obsoleta. Il TTL copre le modifiche che non passano dalla sessione
+    (altri processi, SQL manuale). Le voci sono in una LRU di dimensione limitata.
+    """
+    
+    def __init__(self, max_entries, ttl):
+        self.lock = threading.Lock()
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # chiave -> (versioni, calcolato alle, valore)
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.expired = 0
+    
+    def get_or_compute(self, key, tables, compute):
+        versions = data_versions.snapshot(tables)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] != versions:
+                    self.stale += 1
+                elif now - entry[1] > self.ttl:
+                    self.expired += 1
+                else:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[2]
+            self.misses += 1
+        
+        value = compute()
+        with self.lock:
+            self.entries[key] = (versions, now, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return value
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+    
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale': self.stale,
+                'expired': self.expired,
+                'hit_ratio': self.hits / lookups if lookups else None
+            }
+
+
+query_cache = QueryCache(app.config['QUERY_CACHE_SIZE'], app.config['QUERY_CACHE_TTL_SECONDS'])
+
+
+def cached_query(*tables):
+    """
+    Decoratore: memorizza il risultato della funzione per argomenti, finché le
+    tabelle indicate non cambiano. Il valore è condiviso tra le richieste e
+    non va modificato da chi lo riceve.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args):
+            return query_cache.get_or_compute((func.__name__,) + args, tables, lambda: func(*args))
+        return wrapper
+    return decorator
+
+
+###################################
+# Configurazione sintesi vocale   #
+###################################
+
+class SpeechConfigService:
+    """
+    Configurazione della sintesi vocale letta da speech_nicknames.json.
+    
+    Il file viene riletto solo quando cambiano data di modifica o dimensione;
+    la configurazione già migrata e la risposta JSON serializzata restano in
+    memoria insieme al loro ETag. Le scritture passano da un file temporaneo
+    sostituito con os.replace(), così i lettori non vedono mai JSON a metà.
+    """
+    
+    DEFAULT_CONFIG = {
+        '_comment': 'Configurazione avanzata sintesi vocale',
+        'speech_enabled': True,
+        'speech_rate': 1.3,
+        'speech_template': [
+            {'type': 'parameter', 'value': 'GRADO', 'enabled': True, 'order': 1},
+            {'type': 'parameter', 'value': 'COGNOME', 'enabled': True, 'order': 2},
+            {'type': 'parameter', 'value': 'NOME', 'enabled': True, 'order': 3},
+            {'type': 'text', 'value': ', totale ', 'enabled': True, 'order': 4},
+            {'type': 'parameter', 'value': 'TOTALE_ACQUISTO', 'enabled': True, 'order': 5},
+            {'type': 'text', 'value': ' euro, credito residuo ', 'enabled': True, 'order': 6},
+            {'type': 'parameter', 'value': 'CREDITO_RESIDUO', 'enabled': True, 'order': 7},
+            {'type': 'text', 'value': ' euro', 'enabled': True, 'order': 8}
+        ],
+        'nicknames': {}
+    }
+    
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.key = None  # (mtime_ns, size) del file letto
+        self.config = None
+        self.payload = None
+        self.etag = None
+        self.loads = 0
+        self.hits = 0
+    
+    @classmethod
+    def default_config(cls):
+        return json.loads(json.dumps(cls.DEFAULT_CONFIG))
+    
+    def file_key(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+    
+    def current(self):
+        """Ritorna (config, payload, etag), rileggendo il file solo se è cambiato."""
+        with self.lock:
+            key = self.file_key()
+            if key is not None and key == self.key:
+                self.hits += 1
+            else:
+                self.load(key)
+            return self.config, self.payload, self.etag
+    
+    def load(self, key):
+        if key is None:
+            # Se il file non esiste, crea un file di esempio
+            config = self.default_config()
+            try:
+                self.write(config)
+                logger.info(f"Created example speech configuration file: {self.path}")
+            except Exception as e:
+                logger.error(f"Could not create speech configuration file: {e}")
+        else:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    config = json.load(f)
+                
+                # Se non ha il formato nuovo, migra la configurazione
+                if 'speech_template' not in config:
+                    # Mantieni i nickname esistenti e aggiungi le nuove impostazioni
+                    old_nicknames = {k: v for k, v in config.items() if not k.startswith('_')}
+                    config = self.default_config()
+                    config['nicknames'] = old_nicknames
+                    self.write(config)
+                    logger.info("Migrated speech configuration to new format")
+            except Exception as e:
+                logger.warning(f"Could not load speech configuration: {e}")
+                config = self.default_config()
+        
+        self.loads += 1
+        self.remember(config)
+    
+    def remember(self, config):
+        self.key = self.file_key()
+        self.config = config
+        self.payload = json.dumps({'success': True, 'config': config}).encode('utf-8')
+        self.etag = 'speech-' + hashlib.sha256(self.payload).hexdigest()[:16]
+    
+    def write(self, config):
+        """Scrive il file in modo atomico: file temporaneo nella stessa cartella e os.replace()."""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(prefix='.speech_', suffix='.json', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(config, f, indent=2, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+    
+    def save(self, updates):
+        """Aggiorna la configurazione corrente con i valori indicati e la salva."""
+        self.current()
+        with self.lock:
+            config = json.loads(json.dumps(self.config))
+            config.update(updates)
+            self.write(config)
+            self.remember(config)
+            return config
+    
+    def stats(self):
+        with self.lock:
+            return {'path': self.path, 'loads': self.loads, 'hits': self.hits, 'etag': self.etag}
+
+
+speech_config_service = SpeechConfigService(app.config['SPEECH_CONFIG_PATH'])
+
+
+###################################
+# Funzioni per il lettore seriale #
+###################################
+
+class BarcodeFramer:
+    """
+    Divide in codici il flusso di byte del lettore seriale.
+    
+    I byte letti si accumulano in un buffer; ogni terminatore configurato
+    (es. "\\r", "\\n", "\\r\\n") chiude un codice, quindi una sola lettura può
+    produrne più d'uno. Se un codice non viene mai terminato il buffer resta
+    limitato agli ultimi max_size byte.
+    """
+    
+    def __init__(self, terminators=None, encoding='utf-8', errors='replace', max_size=1024):
+        terminators = [t.encode(encoding) for t in (terminators or ['\r', '\n']) if t]
+        # I terminatori più lunghi prima, così "\r\n" vince su "\r"
+        self.pattern = re.compile(b'|'.join(re.escape(t) for t in sorted(terminators, key=len, reverse=True)))
+        self.encoding = encoding
+        self.errors = errors
+        self.max_size = max_size
+        self.buffer = bytearray()
+    
+    def feed(self, data):
+        """Aggiunge i byte letti e ritorna i codici completi (stringhe decodificate)."""
+        self.buffer.extend(data)
+        codes = []
+        position = 0
+        for match in self.pattern.finditer(self.buffer):
+            frame = bytes(self.buffer[position:match.start()])
+            position = match.end()
+            if frame:
+                codes.append(frame.decode(self.encoding, self.errors))
+        del self.buffer[:position]
+        
+        if len(self.buffer) > self.max_size:
+            logger.warning(f"Buffer lettore seriale oltre {self.max_size} byte senza terminatore, dati scartati")
+            del self.buffer[:-self.max_size]
+        return codes
+
+
+def normalize_barcode(code, reader_config=None):
+    """Applica al codice letto le regole della sezione 'reader' di config_serial.json."""
+    reader_config = READER_CONFIG if reader_config is None else reader_config
+    
+    if reader_config.get('strip_spaces', True):
+        code = code.strip()
+    prefix = reader_config.get('ignore_prefix') or ''
+    if prefix and code.startswith(prefix):
+        code = code[len(prefix):]
+    suffix = reader_config.get('ignore_suffix') or ''
+    if suffix and code.endswith(suffix):
+        code = code[:-len(suffix)]
+    if reader_config.get('uppercase'):
+        code = code.upper()
+    elif reader_config.get('lowercase'):
+        code = code.lower()
+    return code
+
+
+def create_barcode_framer(config=None):
+    """Framer configurato con terminatori e codifica della sezione 'serial'."""
+    config = SERIAL_CONFIG if config is None else config
+    return BarcodeFramer(
+        terminators=config.get('terminators'),
+        encoding=config.get('encoding', 'utf-8'),
+        errors=config.get('errors', 'replace'),
+        max_size=int(READER_CONFIG.get('read_buffer_size', 1024))
+    )
+
+
+def emulate_keyboard_input(barcode):
+    """Digita il codice seguito da invio, per le pagine che ascoltano la tastiera."""
+    if not KEYBOARD_AVAILABLE:
+        return
+    try:
+        keyboard_controller = keyboard.Controller()
+        keyboard_controller.type(barcode)
+        keyboard_controller.press(keyboard.Key.enter)
+        keyboard_controller.release(keyboard.Key.enter)
+    except Exception as e:
+        logger.error(f"Errore emulazione tastiera: {e}")
+
+
+def lookup_scanned_barcode(barcode):
+    """Cerca il dipendente del codice letto e ripara l'hash del credito se serve; ritorna il record o None."""
+    with app.app_context():
+        employee = employee_directory.get(barcode)
+        
+        if employee:
+            # Verifica l'integrità del credito
+            if not employee['credit_integrity']:
+                employee = repair_credit_hash(employee['id']) or employee
+                logger.warning(f"Credit integrity issue fixed for {employee['first_name']} {employee['last_name']}")
+            
+            logger.info(f"Dipendente riconosciuto: {employee['first_name']} {employee['last_name']}")
+        else:
+            # Dipendente non trovato - emula comunque il codice per permettere inserimento manuale
+            logger.warning(f"Dipendente non trovato per barcode: {barcode}")
+        
+        return employee
+
+
+class ScanEventBroker:
+    """
+    Ultime letture con il dipendente già risolto, per il flusso /stream/scans.
+    
+    Gli eventi hanno id crescenti e restano in un buffer circolare: un client
+    che si riconnette con Last-Event-ID riceve quelli persi. Chi ascolta
+    attende su una Condition, quindi un terminale inattivo non esegue query.
+    """
+    
+    def __init__(self, size=100):
+        self.events = deque(maxlen=size)
+        self.condition = threading.Condition()
+        self.last_id = 0
+        self.subscribers = 0
+    
+    def publish(self, barcode, employee, lane=None):
+        """Registra una lettura e sveglia i client in ascolto."""
+        with self.condition:
+            self.last_id += 1
+            event = {
+                'id': self.last_id,
+                'success': employee is not None,
+                'barcode': barcode,
+                'timestamp': time.time(),
+                'lane': lane,
+                'employee': employee
+            }
+            if employee is None:
+                event['message'] = 'Dipendente non trovato.'
+            self.events.append(event)
+            self.condition.notify_all()
+        return event
+    
+    def resume_id(self, last_event_id):
+        """
+        Id da cui riprendere dato il Last-Event-ID del client: None se assente o
+        non valido, 0 se è più grande dell'ultimo (server riavviato) così si
+        riparte dall'inizio del buffer.
+        """
+        try:
+            last_event_id = int(last_event_id)
+        except (TypeError, ValueError):
+            return None
+        with self.condition:
+            return last_event_id if 0 <= last_event_id <= self.last_id else 0
+    
+    def latest(self, lane=None):
+        """Id dell'ultimo evento e ultima lettura (della cassa indicata), per i nuovi client."""
+        with self.condition:
+            for event in reversed(self.events):
+                if lane is None or event['lane'] == lane:
+                    return self.last_id, event
+            return self.last_id, None
+    
+    def wait(self, after_id, timeout):
+        """Eventi successivi a after_id; se non ce ne sono attende fino a timeout secondi."""
+        with self.condition:
+            if self.last_id <= after_id:
+                self.condition.wait(timeout)
+            return [event for event in self.events if event['id'] > after_id]
+    
+    def stats(self):
+        with self.condition:
+            return {
+                'last_id': self.last_id,
+                'buffered': len(self.events),
+                'subscribers': self.subscribers
+            }
+
+
+scan_events = ScanEventBroker(app.config['SCAN_STREAM_BUFFER_SIZE'])
+
+
+class ScanPipeline:
+    """
+    Elaborazione a stadi dei codici letti dal lettore seriale.
+    
+    Il thread di lettura si limita ad accodare i codici: un thread cerca il
+    dipendente (e ripara l'hash del credito) e pubblica la lettura su
+    scan_events, un altro digita il codice con
+    l'emulazione tastiera. Le code sono limitate: quando una è piena il codice
+    più vecchio in attesa viene scartato (drop_policy "oldest") oppure quello
+    appena arrivato ("newest"), così una raffica di letture non blocca mai la
+    porta seriale.
+    """
+    
+    STAGES = ('lookup', 'keyboard')
+    
+    def __init__(self, queue_size=64, drop_policy='oldest'):
+        self.drop_policy = drop_policy if drop_policy in ('oldest', 'newest') else 'oldest'
+        self.queues = {stage: queue.Queue(maxsize=queue_size) for stage in self.STAGES}
+        self.lock = threading.Lock()
+        self.threads = {}
+        self.counters = {
+            'submitted': 0,
+            'looked_up': 0,
+            'typed': 0,
+            'dropped': 0,
+            'errors': 0
+        }
+        self.max_depth = {stage: 0 for stage in self.STAGES}
+    
+    def start(self):
+        """Avvia i thread degli stadi (una sola volta)."""
+        with self.lock:
+            for stage, handler in (('lookup', self.run_lookup), ('keyboard', self.run_keyboard)):
+                if stage not in self.threads:
+                    self.threads[stage] = threading.Thread(target=handler, name=f'scan-{stage}', daemon=True)
+                    self.threads[stage].start()
+    
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+    
+    def enqueue(self, stage, barcode):
+        """Accoda un codice allo stadio senza mai bloccare; applica la politica di scarto."""
+        stage_queue = self.queues[stage]
+        while True:
+            try:
+                stage_queue.put_nowait(barcode)
+                break
+            except queue.Full:
+                self.count('dropped')
+                if self.drop_policy == 'newest':
+                    logger.warning(f"Coda {stage} piena, codice scartato: {barcode}")
+                    return False
+                try:
+                    dropped = stage_queue.get_nowait()
+                    logger.warning(f"Coda {stage} piena, codice scartato: {dropped}")
+                except queue.Empty:
+                    pass
+        
+        depth = stage_queue.qsize()
+        with self.lock:
+            if depth > self.max_depth[stage]:
+                self.max_depth[stage] = depth
+        return True
+    
+    def submit(self, barcode, lane=None):
+        """Chiamata dal thread di lettura per ogni codice letto."""
+        self.count('submitted')
+        return self.enqueue('lookup', (lane, barcode))
+    
+    def run_lookup(self):
+        while True:
+            lane, barcode = self.queues['lookup'].get()
+            try:
+                scan_events.publish(barcode, lookup_scanned_barcode(barcode), lane)
+                self.count('looked_up')
+            except Exception as e:
+                self.count('errors')
+                logger.error(f"Errore ricerca dipendente per barcode {barcode}: {str(e)}")
+            # Il codice viene digitato anche se la ricerca fallisce
+            self.enqueue('keyboard', barcode)
+    
+    def run_keyboard(self):
+        while True:
+            barcode = self.queues['keyboard'].get()
+            emulate_keyboard_input(barcode)
+            self.count('typed')
+    
+    def stats(self):
+        with self.lock:
+            return {
+                **self.counters,
+                'drop_policy': self.drop_policy,
+                'depth': {stage: self.queues[stage].qsize() for stage in self.STAGES},
+                'max_depth': dict(self.max_depth),
+                'capacity': self.queues['lookup'].maxsize
+            }
+
+
+scan_pipeline = ScanPipeline(
+    queue_size=int(READER_CONFIG.get('queue_size', 64)),
+    drop_policy=READER_CONFIG.get('drop_policy', 'oldest')
+)
+
+
+class ScannerLane:
+    """
+    Un lettore seriale associato a una cassa (corsia).
+    
+    Ogni corsia ha un solo thread supervisore che apre la porta, legge e, se la
+    porta cade, si riconnette secondo la sezione 'error_recovery' con attese
+    crescenti (reconnect_delay, raddoppiato a ogni tentativo fino a
+    max_reconnect_delay). Dopo max_reconnect_attempts tentativi falliti la
+    corsia passa nello stato 'failed' finché non viene riavviata. Il conteggio
+    dei tentativi si azzera solo se la connessione resta su per almeno
+    max_reconnect_delay, così una porta instabile non viene riaperta a raffica.
+    Il lock protegge solo i dati della corsia, quindi le letture di casse
+    diverse non si contendono nulla.
+    """
+    
+    def __init__(self, lane_id, config):
+        self.lane_id = lane_id
+        self.config = config
+        self.port = None
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        self.history = []
+        self.last_time = 0  # Timestamp dell'ultimo barcode letto
+        self.scans = 0
+        self.bytes_read = 0
+        self.read_errors = 0
+        self.last_error = None
+        self.state = 'stopped'
+        self.transitions = deque(maxlen=20)
+        self.reconnects = 0
+        self.reconnect_timings = deque(maxlen=10)
+        self.next_retry_at = None
+    
+    def set_state(self, state, detail=None):
+        with self.lock:
+            if state == self.state and detail is None:
+                return
+            self.state = state
+            self.transitions.append({'state': state, 'timestamp': time.time(), 'detail': detail})
+        logger.info(f"Lettore cassa {self.lane_id}: {state}" + (f" ({detail})" if detail else ''))
+    
+    def connect(self):
+        """Apre la porta della corsia; False (con l'errore registrato) se non ci riesce."""
+        self.set_state('connecting')
+        try:
+            self.port = serial.Serial(
+                self.config['port'],
+                self.config['baudrate'],
+                bytesize=self.config['bytesize'],
+                parity=self.config['parity'],
+                stopbits=self.config['stopbits'],
+                timeout=self.config['timeout']
+            )
+        except Exception as e:
+            self.port = None
+            self.last_error = str(e)
+            logger.error(f"Errore configurazione lettore di codici a barre (cassa {self.lane_id}): {str(e)}")
+            return False
+        
+        self.set_state('connected', self.config['port'])
+        return True
+    
+    def start(self):
+        """
+        Avvia il supervisore della corsia, se non è già attivo.
+        Il primo tentativo di connessione è sincrono: ritorna True se la porta è aperta.
+        """
+        if self.thread and self.thread.is_alive():
+            return self.connected
+        
+        self.stop_event.clear()
+        connected = self.connect()
+        self.thread = threading.Thread(target=self.run, args=(connected,), name=f'scanner-{self.lane_id}', daemon=True)
+        self.thread.start()
+        return connected
+    
+    def stop(self):
+        """Ferma il supervisore e attende che il thread termini."""
+        self.stop_event.set()
+        self.close()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout=float(self.config.get('timeout') or 1) + 1)
+        self.thread = None
+        self.set_state('stopped')
+    
+    def close(self):
+        port = self.port
+        if port and port.is_open:
+            port.close()
+    
+    @property
+    def connected(self):
+        return bool(self.port and self.port.is_open)
+    
+    def run(self, connected):
+        """Ciclo del supervisore: lettura finché la porta regge, poi riconnessione."""
+        framer = create_barcode_framer(self.config)
+        attempts = 0
+        outage_started = None if connected else time.monotonic()
+        
+        while not self.stop_event.is_set():
+            if not connected:
+                # Con auto_reconnect disattivato non si ritenta mai, né all'avvio né dopo una disconnessione
+                if not RECOVERY_CONFIG.get('auto_reconnect', True):
+                    self.set_state('disconnected', 'riconnessione automatica disattivata')
+                    return
+                if attempts >= int(RECOVERY_CONFIG.get('max_reconnect_attempts', 5)):
+                    self.set_state('failed', f"{attempts} tentativi di riconnessione falliti")
+                    return
+                
+                delay = min(
+                    float(RECOVERY_CONFIG.get('reconnect_delay', 3.0)) * 2 ** attempts,
+                    float(RECOVERY_CONFIG.get('max_reconnect_delay', 30.0))
+                )
+                attempts += 1
+                self.next_retry_at = time.time() + delay
+                self.set_state('reconnecting', f"tentativo {attempts} fra {delay:.1f}s")
+                if self.stop_event.wait(delay):
+                    return
+                self.next_retry_at = None
+                
+                connected = self.connect()
+                if not connected:
+                    continue
+                
+                with self.lock:
+                    self.reconnects += 1
+                    self.reconnect_timings.append({
+                        'timestamp': time.time(),
+                        'attempts': attempts,
+                        'seconds': round(time.monotonic() - outage_started, 3)
+                    })
+                if RECOVERY_CONFIG.get('reset_on_error', True):
+                    framer = create_barcode_framer(self.config)
+            
+            connected_at = time.monotonic()
+            self.read(self.port, framer)
+            connected = False
+            self.close()
+            if self.stop_event.is_set():
+                return
+            if time.monotonic() - connected_at >= float(RECOVERY_CONFIG.get('max_reconnect_delay', 30.0)):
+                attempts = 0
+            outage_started = time.monotonic()
+            self.set_state('disconnected', self.last_error)
+    
+    def read(self, port, framer):
+        """
+        Legge dalla porta finché resta aperta.
+        
+        La lettura è bloccante (fino al timeout della porta) e ritorna appena
+        arrivano byte, senza pause fisse: un codice viene registrato non appena
+        arriva il suo terminatore. Ricerca del dipendente ed emulazione tastiera
+        avvengono nei thread di scan_pipeline.
+        """
+        while port.is_open and not self.stop_event.is_set():
+            try:
+                # Legge tutto quello che è già arrivato, oppure attende il primo byte
+                data = port.read(port.in_waiting or 1)
+            except Exception as e:
+                if port.is_open and not self.stop_event.is_set():
+                    self.read_errors += 1
+                    self.last_error = str(e)
+                    logger.error(f"Errore lettura codice a barre (cassa {self.lane_id}): {str(e)}")
+                return
+            
+            if not data:
+                continue
+            self.bytes_read += len(data)
+            
+            for code in framer.feed(data):
+                barcode = normalize_barcode(code)
+                if barcode:  # Solo se il barcode non è vuoto
+                    self.record(barcode)
+                    scan_pipeline.submit(barcode, self.lane_id)
+    
+    def record(self, barcode):
+        """Aggiunge un codice letto allo storico della corsia."""
+        with self.lock:
+            # Mantiene solo gli ultimi codici letti
+            self.history.append(barcode)
+            del self.history[:-int(READER_CONFIG.get('max_history_size', 5))]
+            self.last_time = time.time()
+            self.scans += 1
+        
+        logger.info(f"Codice a barre letto (cassa {self.lane_id}): {barcode}")
+    
+    def last_barcode(self):
+        with self.lock:
+            if self.history:
+                return {
+                    'barcode': self.history[-1],
+                    'timestamp': self.last_time,
+                    'lane': self.lane_id
+                }
+            return None
+    
+    def stats(self):
+        with self.lock:
+            return {
+                'lane': self.lane_id,
+                'port': self.config.get('port'),
+                'state': self.state,
+                'connected': self.connected,
+                'thread_alive': bool(self.thread and self.thread.is_alive()),
+                'scans': self.scans,
+                'bytes_read': self.bytes_read,
+                'read_errors': self.read_errors,
+                'last_error': self.last_error,
+                'last_barcode_timestamp': self.last_time or None,
+                'history': list(self.history),
+                'reconnects': self.reconnects,
+                'reconnect_timings': list(self.reconnect_timings),
+                'next_retry_at': self.next_retry_at,
+                'transitions': list(self.transitions)
+            }
+
+
+def scanner_lane_configs():
+    """
+    Configurazione delle corsie: ogni voce di 'lanes' in config_serial.json
+    sovrascrive la sezione 'serial' (es. {"id": 2, "port": "COM6"}).
+    Senza 'lanes' c'è una sola corsia con id 1. Una porta può essere usata da
+    una sola corsia: le voci successive con la stessa porta vengono ignorate.
+    """
+    configs = OrderedDict()
+    ports = {}
+    for index, lane in enumerate(SCANNER_LANES or [{}], start=1):
+        lane_id = int(lane.get('id', index))
+        config = {**SERIAL_CONFIG, **{key: value for key, value in lane.items() if key != 'id'}}
+        if config['port'] in ports:
+            logger.error(f"Porta {config['port']} già usata dalla cassa {ports[config['port']]}, cassa {lane_id} ignorata")
+            continue
+        ports[config['port']] = lane_id
+        configs[lane_id] = config
+    return configs
+
+
+class ScannerManager:
+    """
+    Supervisore dei lettori di tutte le corsie.
+    
+    apply() confronta la configurazione con quella delle corsie attive: le corsie
+    invariate continuano a leggere, quelle modificate o rimosse vengono fermate
+    (thread compreso) prima di avviare le nuove, così per ogni porta esiste
+    sempre un solo thread di lettura.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.lanes = OrderedDict(
+            (lane_id, ScannerLane(lane_id, config))
+            for lane_id, config in scanner_lane_configs().items()
+        )
+    
+    def start(self):
+        """Applica la configurazione e avvia le corsie; True se almeno una è connessa."""
+        return self.apply()
+    
+    def apply(self):
+        """Applica a caldo la configurazione corrente delle corsie."""
+        with self.lock:
+            configs = scanner_lane_configs()
+            current = self.lanes
+            lanes = OrderedDict()
+            
+            # Prima si fermano le corsie modificate o rimosse, poi si aprono le nuove porte
+            for lane_id, lane in current.items():
+                if configs.get(lane_id) != lane.config:
+                    lane.stop()
+            
+            for lane_id, config in configs.items():
+                lane = current.get(lane_id)
+                if lane is None or lane.config != config:
+                    lane = ScannerLane(lane_id, config)
+                lanes[lane_id] = lane
+            
+            self.lanes = lanes
+            scan_pipeline.start()
+            started = [lane.start() for lane in lanes.values()]
+            return any(started)
+    
+    def stop(self):
+        with self.lock:
+            for lane in self.lanes.values():
+                lane.stop()
+    
+    @property
+    def connected(self):
+        return any(lane.connected for lane in self.lanes.values())
+    
+    def last_barcode(self, lane_id=None):
+        """Ultimo codice della corsia indicata, o il più recente fra tutte."""
+        if lane_id is not None:
+            lane = self.lanes.get(lane_id)
+            return lane.last_barcode() if lane else None
+        
+        latest = [info for info in (lane.last_barcode() for lane in self.lanes.values()) if info]
+        return max(latest, key=lambda info: info['timestamp']) if latest else None
+    
+    def stats(self):
+        return [lane.stats() for lane in self.lanes.values()]
+
+
+scanner_manager = ScannerManager()
+
+
+def setup_barcode_reader():
+    """Configura e avvia (o aggiorna a caldo) i lettori di codici a barre di tutte le corsie."""
+    if not SERIAL_AVAILABLE:
+        logger.warning("PySerial non installato. Lettore seriale non disponibile.")
+        return False
+    
+    return scanner_manager.apply()
+
+
+def get_last_barcode(lane=None):
+    """Restituisce l'ultimo codice a barre letto (della corsia indicata, se presente)."""
+    return scanner_manager.last_barcode(lane)
+
+
+##########################
+# Intervalli di date     #
+##########################
+
+def day_bounds(day):
+    """
+    Restituisce l'intervallo semiaperto [inizio, fine) di un giorno di calendario.
+    I filtri costruiti su questo intervallo usano gli indici su Transaction.timestamp,
+    a differenza di db.func.date(Transaction.timestamp) che obbliga a scansionare la tabella.
+    """
+    if isinstance(day, datetime):
+        day = day.date()
+    start = datetime.combine(day, datetime.min.time())
+    return start, start + timedelta(days=1)
+
+
+def days_bounds(first_day, last_day):
+    """Intervallo semiaperto che copre i giorni da first_day a last_day inclusi."""
+    start, _ = day_bounds(first_day)
+    _, end = day_bounds(last_day)
+    return start, end
+
+
+def period_bounds(period, custom_date=None, now=None):
+    """
+    Converte un filtro di periodo ('today', 'yesterday', 'week', 'month', 'custom', 'all')
+    in un intervallo semiaperto (start, end). Un estremo None indica nessun limite.
+    Una data personalizzata non valida ricade sul giorno corrente.
+    Le finestre mobili ('week', 'month') partono dall'inizio dell'ora, così l'intervallo
+    resta stabile per un'ora e può fare da chiave di cache.
+    """
+    now = now or datetime.now()
+    hour = now.replace(minute=0, second=0, microsecond=0)
+
+    if period == 'today':
+        return day_bounds(now)
+    if period == 'yesterday':
+        return day_bounds(now - timedelta(days=1))
+    if period == 'week':
+        return hour - timedelta(days=7), None
+    if period == 'month':
+        return hour - timedelta(days=30), None
+    if period == 'custom' and custom_date:
+        try:
+            return day_bounds(datetime.strptime(custom_date, '%Y-%m-%d'))
+        except ValueError as e:
+            logger.error(f"Invalid date format '{custom_date}': {e}")
+            return day_bounds(now)
+
+    # 'all' (o filtro sconosciuto) significa nessun filtro sulla data
+    return None, None
+
+
+def filter_timestamp_range(query, start, end, column=None):
+    """Applica a una query il predicato `column >= start AND column < end`."""
+    column = column if column is not None else Transaction.timestamp
+    if start is not None:
+        query = query.filter(column >= start)
+    if end is not None:
+        query = query.filter(column < end)
+    return query
+
+
+##########################
+# Riepiloghi giornalieri #
+##########################
+
+ROLLUP_KEY_COLUMNS = ('day', 'transaction_type', 'product_id', 'product_name', 'operator_id')
+
+# Movimenti di cassa esclusi dal riepilogo prodotti dei report
+EXCLUDED_PRODUCT_NAMES = {"Prelievo cassa da amministratore"}
+
+
+def split_custom_product_name(name, quantity):
+    """Separa la quantità dal nome di un prodotto personalizzato nel formato "Nome (x2)"."""
+    quantity_match = re.search(r'\(x(\d+)\)', name)
+    if quantity_match:
+        try:
+            quantity = int(quantity_match.group(1))
+            name = re.sub(r'\s*\(x\d+\)', '', name)
+        except ValueError:
+            quantity = 1
+    return name, quantity
+
+
+def rollup_entry(transaction):
+    """
+    Calcola la chiave del riepilogo e la quantità di una transazione.
+    Accetta sia istanze di Transaction sia righe di query con gli stessi attributi.
+    """
+    quantity = transaction.quantity if transaction.quantity else 1
+    product_name = ''
+
+    if transaction.custom_product_name:
+        product_name = transaction.custom_product_name
+        if not transaction.product_id:
+            product_name, quantity = split_custom_product_name(product_name, quantity)
+
+    timestamp = transaction.timestamp or datetime.now()
+    key = (
+        timestamp.date(),
+        transaction.transaction_type or '',
+        transaction.product_id or 0,
+        product_name[:100],
+        transaction.operator_id or 0
+    )
+    return key, quantity
+
+
+def add_rollup_delta(deltas, transaction, sign=1):
+    """Accumula in deltas il contributo (sign=+1) o la rimozione (sign=-1) di una transazione."""
+    key, quantity = rollup_entry(transaction)
+    amount = Decimal(str(transaction.amount or 0))
+    current = deltas.get(key, (0, Decimal('0'), Decimal('0'), 0))
+    deltas[key] = (
+        current[0] + sign * quantity,
+        current[1] + sign * amount,
+        current[2] + sign * abs(amount),
+        current[3] + sign
+    )
+
+
+def apply_rollup_deltas(connection, deltas):
+    """Applica le variazioni ai riepiloghi con un upsert per chiave."""
+    table = DailyRollup.__table__
+    dialect = connection.dialect.name
+
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        dialect_insert = None
+
+    has_removals = False
+    for key, (quantity, amount, amount_abs, count) in deltas.items():
+        values = dict(zip(ROLLUP_KEY_COLUMNS, key))
+        values.update(quantity=quantity, amount=amount, amount_abs=amount_abs, transaction_count=count)
+        has_removals = has_removals or count < 0
+
+        if dialect_insert is not None:
+            statement = dialect_insert(table).values(**values)
+            statement = statement.on_conflict_do_update(
+                index_elements=list(ROLLUP_KEY_COLUMNS),
+                set_={
+                    'quantity': table.c.quantity + statement.excluded.quantity,
+                    'amount': table.c.amount + statement.excluded.amount,
+                    'amount_abs': table.c.amount_abs + statement.excluded.amount_abs,
+                    'transaction_count': table.c.transaction_count + statement.excluded.transaction_count
+                }
+            )
+            connection.execute(statement)
+        else:
+            where = db.and_(*(table.c[column] == values[column] for column in ROLLUP_KEY_COLUMNS))
+            result = connection.execute(table.update().where(where).values(
+                quantity=table.c.quantity + quantity,
+                amount=table.c.amount + amount,
+                amount_abs=table.c.amount_abs + amount_abs,
+                transaction_count=table.c.transaction_count + count
+            ))
+            if result.rowcount == 0:
+                connection.execute(table.insert().values(**values))
+
+    # Rimuove le righe rimaste senza transazioni
+    if has_removals:
+        connection.execute(table.delete().where(table.c.transaction_count <= 0))
+
+
+@event.listens_for(SASession, 'after_flush')
+def update_daily_rollups(session, flush_context):
+    """Aggiorna i riepiloghi per le transazioni inserite o eliminate in questo flush."""
+    deltas = {}
+
+    for obj in session.new:
+        if isinstance(obj, Transaction):
+            add_rollup_delta(deltas, obj, 1)
+    for obj in session.deleted:
+        if isinstance(obj, Transaction):
+            add_rollup_delta(deltas, obj, -1)
+
+    if deltas:
+        apply_rollup_deltas(session.connection(), deltas)
+        mark_tables_changed(session, DailyRollup.__tablename__)
+
+
+def rebuild_daily_rollups(batch_size=5000):
+    """
+    Ricostruisce da zero i riepiloghi giornalieri a partire dallo storico delle transazioni,
+    comprese quelle spostate nell'archivio.
+    """
+    deltas = {}
+    columns = ('timestamp', 'transaction_type', 'product_id', 'custom_product_name',
+               'operator_id', 'quantity', 'amount')
+    hot = Transaction.__table__
+    query = db.select(*(hot.c[name] for name in columns))
+
+    if ensure_archive_schema():
+        archive = archived_transaction_table
+        query = db.union_all(
+            query,
+            db.select(*(archive.c[name] for name in columns)).where(~archived_copies_clause())
+        )
+
+    rows = db.session.execute(query, execution_options={'yield_per': batch_size})
+
+    for row in rows:
+        add_rollup_delta(deltas, row, 1)
+
+    DailyRollup.query.delete()
+    records = []
+    for key, (quantity, amount, amount_abs, count) in deltas.items():
+        record = dict(zip(ROLLUP_KEY_COLUMNS, key))
+        record.update(quantity=quantity, amount=amount, amount_abs=amount_abs, transaction_count=count)
+        records.append(record)
+
+    for i in range(0, len(records), batch_size):
+        db.session.execute(DailyRollup.__table__.insert(), records[i:i + batch_size])
+
+    mark_tables_changed(db.session(), DailyRollup.__tablename__)
+    db.session.commit()
+    logger.info(f"Daily rollups rebuilt: {len(records)} rows")
+    return len(records)
+
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Ricostruisce i riepiloghi giornalieri (flask --app app rebuild-rollups)."""
+    count = rebuild_daily_rollups()
+    print(f"Ricostruiti {count} riepiloghi giornalieri")
+
+
+@cached_query(DailyRollup.__tablename__, Product.__tablename__, Operator.__tablename__)
+def get_rollup_report_stats(first_day, last_day):
+    """
+    Calcola i totali di un report dai riepiloghi dei giorni da first_day a last_day inclusi,
+    con un costo proporzionale a giorni × prodotti invece che al numero di transazioni.
+    """
+    rows = db.session.query(
+        DailyRollup.transaction_type,
+        DailyRollup.product_id,
+        DailyRollup.product_name,
+        DailyRollup.operator_id,
+        db.func.sum(DailyRollup.quantity),
+        db.func.sum(DailyRollup.amount),
+        db.func.sum(DailyRollup.amount_abs)
+    ).filter(
+        DailyRollup.day >= first_day,
+        DailyRollup.day <= last_day
+    ).group_by(
+        DailyRollup.transaction_type,
+        DailyRollup.product_id,
+        DailyRollup.product_name,
+        DailyRollup.operator_id
+    ).all()
+
+    product_ids = {row[1] for row in rows if row[1]}
+    operator_ids = {row[3] for row in rows if row[3]}
+    products = {p.id: p for p in Product.query.filter(Product.id.in_(product_ids))} if product_ids else {}
+    operators = {o.id: o.username for o in Operator.query.filter(Operator.id.in_(operator_ids))} if operator_ids else {}
+
+    credit_sum = 0.0
+    debit_sum = 0.0
+    operator_stats = {}
+    product_stats = {}
+    product_total_quantity = 0
+    product_total_amount = 0.0
+
+    for transaction_type, product_id, product_name, operator_id, quantity, amount, amount_abs in rows:
+        amount = float(amount or 0)
+        amount_abs = float(amount_abs or 0)
+        quantity = int(quantity or 0)
+
+        if transaction_type == 'credit':
+            credit_sum += amount
+        elif transaction_type == 'debit':
+            debit_sum += amount_abs
+
+        # Raggruppa per operatore
+        if operator_id and operator_id in operators:
+            stats = operator_stats.setdefault(operators[operator_id], {'credit': 0, 'debit': 0})
+            if transaction_type == 'credit':
+                stats['credit'] += amount
+            else:
+                stats['debit'] += amount_abs
+
+        # Raggruppa per prodotto (solo consumi)
+        if transaction_type != 'debit':
+            continue
+        product = products.get(product_id)
+        name = product.name if product else product_name
+        if not name or name in EXCLUDED_PRODUCT_NAMES:
+            continue
+
+        stats = product_stats.setdefault(name, {
+            'quantity': 0,
+            'total': 0,
+            'inventory': product.inventory if product else 0,
+            'product_id': product.id if product else None
+        })
+        stats['quantity'] += quantity
+        stats['total'] += amount_abs
+        product_total_quantity += quantity
+        product_total_amount += amount_abs
+
+    return {
+        'credit_sum': credit_sum,
+        'debit_sum': debit_sum,
+        'operator_stats': dict(sorted(operator_stats.items())),
+        'product_stats': dict(sorted(product_stats.items())),
+        'product_total_quantity': product_total_quantity,
+        'product_total_amount': product_total_amount
+    }
+
+
+##########################
+# Archivio transazioni   #
+##########################
+
+ARCHIVE_HORIZON_SETTING = 'transaction_archive_horizon'
+
+
+def archive_available():
+    """True se l'archivio è abilitato e collegato (richiede SQLite)."""
+    return app.config['TRANSACTION_ARCHIVE_ENABLED'] and db.engine.dialect.name == 'sqlite'
+
+
+def ensure_archive_schema():
+    """Crea tabella e indici dell'archivio se mancano."""
+    if not archive_available():
+        if app.config['TRANSACTION_ARCHIVE_ENABLED']:
+            logger.warning("Transaction archive requires SQLite: archiving disabled")
+        return False
+    archive_metadata.create_all(bind=db.engine)
+    return True
+
+
+def get_archive_horizon():
+    """
+    Restituisce l'istante prima del quale le transazioni possono trovarsi nell'archivio,
+    oppure None se l'archivio è vuoto o non disponibile.
+    """
+    if not archive_available():
+        return None
+    horizon = GlobalSetting.get(ARCHIVE_HORIZON_SETTING)
+    return datetime.fromisoformat(horizon) if horizon else None
+
+
+def archive_reaches(start):
+    """True se un intervallo che inizia in start (None = senza limite) include dati archiviati."""
+    horizon = get_archive_horizon()
+    return horizon is not None and (start is None or start < horizon)
+
+
+def archived_copies_clause():
+    """
+    Condizione vera per le righe dell'archivio ancora presenti, identiche, nella tabella
+    principale (archiviazione interrotta prima della DELETE, ripristino di un backup):
+    vanno contate una volta sola.
+    """
+    hot = Transaction.__table__
+    archive = archived_transaction_table
+    return db.select(hot.c.id).where(
+        hot.c.id == archive.c.id,
+        hot.c.timestamp == archive.c.timestamp,
+        hot.c.amount == archive.c.amount
+    ).exists()
+
+
+def raise_transaction_id_floor():
+    """
+    Porta il contatore AUTOINCREMENT della tabella principale almeno all'id più alto
+    dell'archivio, così le nuove transazioni non riusano mai id già archiviati
+    (es. dopo il ripristino di un backup o su un database creato da zero).
+    """
+    if not ensure_archive_schema():
+        return
+    with db.engine.begin() as connection:
+        archived_max = connection.execute(db.select(db.func.max(archived_transaction_table.c.id))).scalar()
+        if not archived_max:
+            return
+        current = connection.exec_driver_sql(
+            "SELECT seq FROM main.sqlite_sequence WHERE name = ?", (Transaction.__tablename__,)
+        ).scalar()
+        if current is None:
+            connection.exec_driver_sql(
+                "INSERT INTO main.sqlite_sequence (name, seq) VALUES (?, ?)",
+                (Transaction.__tablename__, archived_max)
+            )
+        elif current < archived_max:
+            connection.exec_driver_sql(
+                "UPDATE main.sqlite_sequence SET seq = ? WHERE name = ?",
+                (archived_max, Transaction.__tablename__)
+            )
+
+
+def archive_old_transactions(older_than_days=None, batch_size=None):
+    """
+    Sposta nell'archivio, a lotti, le transazioni più vecchie di older_than_days giorni.
+    Ogni lotto viene prima copiato e poi rimosso dalla tabella principale, così
+    un'interruzione non perde mai dati. Dalla tabella principale si eliminano solo
+    le righe presenti nell'archivio con lo stesso contenuto: una riga il cui id è
+    già usato nell'archivio da una transazione diversa resta dov'è e viene segnalata.
+    I riepiloghi giornalieri non vengono toccati: coprono anche lo storico archiviato.
+    """
+    if not ensure_archive_schema():
+        return 0
+    raise_transaction_id_floor()
+
+    older_than_days = older_than_days if older_than_days is not None else app.config['TRANSACTION_ARCHIVE_DAYS']
+    batch_size = batch_size or app.config['TRANSACTION_ARCHIVE_BATCH_SIZE']
+    cutoff, _ = day_bounds(datetime.now() - timedelta(days=older_than_days))
+
+    hot = Transaction.__table__
+    archive = archived_transaction_table
+    columns = [hot.c[column.name] for column in archive.columns]
+
+    archived = 0
+    conflicts = []
+    last_id = 0
+    while True:
+        with db.engine.begin() as connection:
+            ids = connection.execute(
+                db.select(hot.c.id)
+                .where(hot.c.timestamp < cutoff, hot.c.id > last_id)
+                .order_by(hot.c.id)
+                .limit(batch_size)
+            ).scalars().all()
+            if not ids:
+                break
+            last_id = ids[-1]
+
+            # Id già presenti nell'archivio: copie di un lotto interrotto prima della
+            # DELETE (stesso contenuto) oppure id in conflitto (contenuto diverso)
+            existing = {
+                row.id: tuple(row)
+                for row in connection.execute(db.select(archive).where(archive.c.id.in_(ids)))
+            }
+            clashing = set()
+            if existing:
+                for row in connection.execute(db.select(*columns).where(hot.c.id.in_(list(existing)))):
+                    if tuple(row) != existing[row.id]:
+                        clashing.add(row.id)
+
+            new_ids = [transaction_id for transaction_id in ids if transaction_id not in existing]
+            if new_ids:
+                connection.execute(
+                    archive.insert().from_select(
+                        [column.name for column in columns],
+                        db.select(*columns).where(hot.c.id.in_(new_ids))
+                    )
+                )
+
+        if clashing:
+            conflicts.extend(sorted(clashing))
+            logger.error(
+                f"Transactions {sorted(clashing)} not archived: "
+                f"their id is already used by a different archived transaction"
+            )
+
+        moved = [transaction_id for transaction_id in ids if transaction_id not in clashing]
+        if not moved:
+            continue
+        with db.engine.begin() as connection:
+            connection.execute(hot.delete().where(hot.c.id.in_(moved)))
+        data_versions.bump([Transaction.__tablename__])
+        archived += len(moved)
+
+    if archived:
+        horizon = get_archive_horizon()
+        if horizon is None or cutoff > horizon:
+            GlobalSetting.set(ARCHIVE_HORIZON_SETTING, cutoff.isoformat(), 'Limite delle transazioni archiviate')
+        logger.info(f"Archived {archived} transactions older than {cutoff}")
+    if conflicts:
+        logger.error(f"{len(conflicts)} transactions left in the main table because of id conflicts with the archive")
+
+    return archived
+
+
+@app.cli.command('archive-transactions')
+def archive_transactions_command():
+    """Archivia le transazioni vecchie (flask --app app archive-transactions)."""
+    count = archive_old_transactions()
+    print(f"Archiviate {count} transazioni")
+
+
+def start_archive_scheduler():
+    """Avvia un thread che archivia periodicamente le transazioni vecchie."""
+    interval = app.config['TRANSACTION_ARCHIVE_INTERVAL_HOURS'] * 3600
+
+    def run():
+        while True:
+            try:
+                with app.app_context():
+                    archive_old_transactions()
+            except Exception as e:
+                logger.error(f"Errore archiviazione transazioni: {str(e)}")
+            time.sleep(interval)
+
+    if interval > 0 and app.config['TRANSACTION_ARCHIVE_ENABLED']:
+        threading.Thread(target=run, daemon=True).start()
+
+
+def merge_transactions(hot, archived):
+    """
+    Unisce le transazioni della tabella principale e dell'archivio in ordine di timestamp
+    decrescente. Si scartano solo le copie archiviate identiche a una riga ancora presente
+    (archiviazione interrotta prima della DELETE): un id uguale con contenuto diverso è
+    un'altra transazione e resta visibile.
+    """
+    def identity(t):
+        return (t.id, t.timestamp, t.employee_id, t.amount, t.transaction_type)
+
+    hot_rows = {identity(t) for t in hot}
+    merged = list(hot) + [t for t in archived if identity(t) not in hot_rows]
+    merged.sort(key=lambda t: t.timestamp, reverse=True)
+    return merged
+
+
+def delete_archived_transactions(employee_id):
+    """Elimina le transazioni archiviate di un dipendente togliendole anche dai riepiloghi."""
+    if not archive_reaches(None):
+        return 0
+
+    archived = ArchivedTransaction.query.filter_by(employee_id=employee_id).all()
+    if archived:
+        deltas = {}
+        for transaction in archived:
+            add_rollup_delta(deltas, transaction, -1)
+        apply_rollup_deltas(db.session.connection(), deltas)
+        mark_tables_changed(db.session(), DailyRollup.__tablename__)
+        db.session.execute(
+            archived_transaction_table.delete().where(archived_transaction_table.c.employee_id == employee_id)
+        )
+    return len(archived)
+
+
+##########################
+# Funzioni di utilità   #
+##########################
+
+@cached_query(Employee.__tablename__, Transaction.__tablename__)
+def get_admin_dashboard_stats(today):
+    """Conteggi e totali della dashboard amministrativa (saldo di cassa escluso)."""
+    today_start, today_end = day_bounds(today)
+    return {
+        'employees_count': Employee.query.count(),
+        'employees_credit': db.session.query(db.func.sum(Employee.credit)).
+            filter(Employee.code != 'CASSA').scalar() or 0,
+        'transactions_today': filter_timestamp_range(
+            Transaction.query.filter(Transaction.transaction_type != 'cancellation'),
+            today_start, today_end
+        ).count()
+    }
+
+
+@cached_query(Employee.__tablename__)
+def get_negative_credit_employees():
+    """Dipendenti con credito negativo, ordinati per cognome."""
+    employees = Employee.query.filter(Employee.credit < 0).order_by(Employee.last_name.asc()).all()
+    return [
+        {
+            'id': employee.id,
+            'first_name': employee.first_name,
+            'last_name': employee.last_name,
+            'rank': employee.rank,
+            'credit': employee.credit
+        }
+        for employee in employees
+    ]
+
+
+def get_credit_stats(employee_id):
+    """Calcola statistiche sul credito di un dipendente, includendo le transazioni archiviate."""
+    total_added = db.session.query(db.func.sum(Transaction.amount)).\
+        filter(Transaction.employee_id == employee_id,
+               Transaction.transaction_type == 'credit').scalar() or 0
+
+    total_spent = db.session.query(db.func.sum(Transaction.amount)).\
+        filter(Transaction.employee_id == employee_id,
+               Transaction.transaction_type == 'debit').scalar() or 0
+
+    if archive_reaches(None):
+        # Le copie archiviate di righe ancora presenti nella tabella principale non si sommano due volte
+        total_added += db.session.query(db.func.sum(ArchivedTransaction.amount)).\
+            filter(ArchivedTransaction.employee_id == employee_id,
+                   ArchivedTransaction.transaction_type == 'credit',
+                   ~archived_copies_clause()).scalar() or 0
+        total_spent += db.session.query(db.func.sum(ArchivedTransaction.amount)).\
+            filter(ArchivedTransaction.employee_id == employee_id,
+                   ArchivedTransaction.transaction_type == 'debit',
+                   ~archived_copies_clause()).scalar() or 0
+
+    # Converti in float per evitare problemi con Decimal/JSON
+    return {
+        'total_added': float(total_added),
+        'total_spent': abs(float(total_spent))
+    }
+
+
+def get_system_stats():
+    """
+    Ottiene statistiche globali del sistema (ricalcolate solo se dipendenti o transazioni cambiano).
+    Il credito totale comprende il saldo del registro di cassa, come nella dashboard amministrativa:
+    la riga CASSA viene allineata solo dalla compattazione del registro.
+    """
+    stats = dict(compute_system_stats(datetime.now().date()))
+    stats['total_credit'] += float(get_cash_balance())
+    return stats
+
+
+@cached_query(Employee.__tablename__, Transaction.__tablename__)
+def compute_system_stats(today):
+    total_employees = Employee.query.count()
+    total_credit = db.session.query(db.func.sum(Employee.credit)).\
+        filter(Employee.code != 'CASSA').scalar() or 0
+    total_transactions = Transaction.query.filter(Transaction.transaction_type != 'cancellation').count()
+    
+    # Transazioni recenti (giornata odierna)
+    today_start, today_end = day_bounds(today)
+    recent_transactions = filter_timestamp_range(
+        Transaction.query.filter(Transaction.transaction_type != 'cancellation'),
+        today_start, today_end
+    ).count()
+    
+    # Lista dipendenti per l'interfaccia prodotti-prima (escludi cassa centrale)
+    employees = Employee.query.filter(Employee.code != 'CASSA').order_by(Employee.last_name, Employee.first_name).all()
+    employees_data = []
+    for emp in employees:
+        employees_data.append({
+            'id': emp.id,
+            'code': emp.code,
+            'first_name': emp.first_name,
+            'last_name': emp.last_name,
+            'rank': emp.rank,
+            'credit': float(emp.credit)
+        })
+    
+    return {
+        'total_employees': total_employees,
+        'total_credit': float(total_credit),
+        'total_transactions': total_transactions,
+        'recent_transactions': recent_transactions,
+        'employees': employees_data
+    }
+
+
+def export_employees_to_csv():
+    """Esporta i dipendenti in formato CSV."""
+    employees = Employee.query.all()
+    
+    output = io.StringIO()
+    writer = csv.writer(output)
+    
     writer.writerow(['Code', 'First Name', 'Last Name', 'Rank', 'Credit'])
     for employee in employees:
         writer.writerow([
@@ -729,14 +3478,18 @@ def process_employee_row(row):
     code = str(row['Code'])
     
     # Cerca l'impiegato esistente
-    existing_employee = Employee.query.filter(db.func.upper(Employee.code) == db.func.upper(code)).first()
+    existing_employee = find_employee_by_code(code)
     
     if existing_employee:
         # Aggiorna l'impiegato esistente
         existing_employee.first_name = row['First Name']
         existing_employee.last_name = row['Last Name']
         existing_employee.rank = row['Rank']
-        if 'Credit' in row and row['Credit']:
+        if existing_employee.code == 'CASSA':
+            # Il saldo della cassa vive nel registro di cassa: il credito del file non si applica
+            if 'Credit' in row and row['Credit']:
+                logger.warning("Importazione: credito della riga CASSA ignorato (usa il registro di cassa)")
+        elif 'Credit' in row and row['Credit']:
             try:
                 credit_value = float(row['Credit'])
                 existing_employee.update_credit(Decimal(str(credit_value)))
@@ -778,24 +3531,810 @@ def check_integrity_all_employees():
             # Rigenera l'hash
             employee.update_credit_hash()
     
-    # Salva le modifiche se ci sono stati problemi risolti
-    if issues:
+    # Salva le modifiche se ci sono stati problemi risolti o hash mancanti creati
+    if issues or db.session.dirty:
         db.session.commit()
         
     return len(issues) == 0, issues
 
 
-def reset_all_credit_hashes():
-    """Rigenera tutti gli hash di integrità."""
-    employees = Employee.query.all()
-    count = 0
+def reset_all_credit_hashes():
+    """Rigenera tutti gli hash di integrità."""
+    employees = Employee.query.all()
+    count = 0
+    
+    for employee in employees:
+        employee.update_credit_hash()
+        count += 1
+    
+    db.session.commit()
+    return count
+
+
+##########################
+# Backup del database    #
+##########################
+
+BACKUP_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backup')
+
+
+def backup_file_extension():
+    """Estensione dei file di backup per il backend in uso."""
+    return '.db' if db.engine.dialect.name == 'sqlite' else '.dump'
+
+
+def _postgres_command_args():
+    """URL libpq senza password e ambiente con PGPASSWORD per pg_dump/pg_restore."""
+    url = db.engine.url
+    env = dict(os.environ)
+    if url.password:
+        env['PGPASSWORD'] = url.password
+    dsn = url.set(drivername='postgresql', password=None).render_as_string(hide_password=False)
+    return dsn, env
+
+
+# Tabella del file di backup SQLite che contiene le transazioni dell'archivio
+BACKUP_ARCHIVE_TABLE = 'backup_archived_transaction'
+
+
+def copy_archive_into_backup(target):
+    """
+    Copia le transazioni archiviate nella tabella BACKUP_ARCHIVE_TABLE del backup,
+    così un solo file contiene sia il database principale sia l'archivio.
+    Va eseguita dopo la copia del database principale: una transazione archiviata
+    nel frattempo risulta al più in entrambe le tabelle, mai in nessuna.
+    """
+    archive_path = transaction_archive_path(db.engine.url.database)
+    if not archive_available() or not os.path.exists(archive_path):
+        return
+    
+    target.execute("ATTACH DATABASE ? AS archive", (archive_path,))
+    try:
+        exists = target.execute(
+            "SELECT 1 FROM archive.sqlite_master WHERE type = 'table' AND name = ?",
+            (archived_transaction_table.name,)
+        ).fetchone()
+        if exists:
+            target.execute(f'DROP TABLE IF EXISTS main."{BACKUP_ARCHIVE_TABLE}"')
+            target.execute(
+                f'CREATE TABLE main."{BACKUP_ARCHIVE_TABLE}" AS '
+                f'SELECT * FROM archive."{archived_transaction_table.name}"'
+            )
+            target.commit()
+    finally:
+        target.execute("DETACH DATABASE archive")
+
+
+def restore_archive_from_backup():
+    """
+    Dopo il ripristino di un backup SQLite riporta l'archivio allo stato del backup.
+    I backup creati prima che includessero l'archivio non lo contengono: in quel caso
+    si eliminano dall'archivio le copie delle transazioni tornate nella tabella principale.
+    """
+    if not ensure_archive_schema():
+        return
+    
+    archive = archived_transaction_table
+    names = ', '.join(f'"{column.name}"' for column in archive.columns)
+    with db.engine.begin() as connection:
+        included = connection.exec_driver_sql(
+            "SELECT 1 FROM main.sqlite_master WHERE type = 'table' AND name = ?", (BACKUP_ARCHIVE_TABLE,)
+        ).scalar()
+        if included:
+            connection.execute(archive.delete())
+            connection.exec_driver_sql(
+                f'INSERT INTO archive."{archive.name}" ({names}) '
+                f'SELECT {names} FROM main."{BACKUP_ARCHIVE_TABLE}"'
+            )
+            connection.exec_driver_sql(f'DROP TABLE main."{BACKUP_ARCHIVE_TABLE}"')
+        
+        removed = connection.execute(archive.delete().where(archived_copies_clause())).rowcount
+    
+    if removed:
+        logger.info(f"Removed {removed} archived transactions already present in the restored database")
+
+
+def create_database_backup(path):
+    """
+    Crea un backup consistente del database in path.
+    SQLite usa l'API di backup online (corretta anche in modalità WAL e con
+    scritture in corso) e include nello stesso file l'archivio delle transazioni,
+    PostgreSQL usa pg_dump in formato custom.
+    """
+    dialect = db.engine.dialect.name
+    
+    if dialect == 'sqlite':
+        source = sqlite3.connect(db.engine.url.database)
+        target = sqlite3.connect(path)
+        try:
+            source.backup(target)
+            copy_archive_into_backup(target)
+        finally:
+            target.close()
+            source.close()
+    elif dialect == 'postgresql':
+        import subprocess
+        dsn, env = _postgres_command_args()
+        subprocess.run(
+            [app.config['PG_DUMP_PATH'], '--format=custom', f'--file={path}', f'--dbname={dsn}'],
+            check=True, capture_output=True, env=env
+        )
+    else:
+        raise RuntimeError(f"Backup non supportato per il database '{dialect}'")
+
+
+def restore_database_backup(path):
+    """Sostituisce il contenuto del database corrente con il backup in path."""
+    dialect = db.engine.dialect.name
+    
+    # Nessuna connessione del pool deve restare aperta sul vecchio contenuto
+    db.session.remove()
+    db.engine.dispose()
+    
+    if dialect == 'sqlite':
+        source = sqlite3.connect(path)
+        try:
+            if source.execute("PRAGMA quick_check").fetchone()[0] != 'ok':
+                raise ValueError("Il file di backup non è un database SQLite valido")
+            target = sqlite3.connect(db.engine.url.database, timeout=30)
+            try:
+                source.backup(target)
+            finally:
+                target.close()
+        finally:
+            source.close()
+    elif dialect == 'postgresql':
+        import subprocess
+        dsn, env = _postgres_command_args()
+        subprocess.run(
+            [app.config['PG_RESTORE_PATH'], '--clean', '--if-exists', '--no-owner', f'--dbname={dsn}', path],
+            check=True, capture_output=True, env=env
+        )
+    else:
+        raise RuntimeError(f"Ripristino non supportato per il database '{dialect}'")
+    
+    db.engine.dispose()
+    
+    # L'archivio deve corrispondere al database ripristinato
+    if dialect == 'sqlite':
+        restore_archive_from_backup()
+    
+    # Un backup di una versione precedente potrebbe non avere colonne e indici recenti
+    run_schema_migrations()
+    
+    # I dati in memoria non corrispondono più al database ripristinato
+    employee_directory.invalidate()
+    operator_auth.invalidate()
+    settings_cache.invalidate()
+    catalog_snapshot.invalidate()
+    data_versions.invalidate()
+
+
+##########################
+# Registro di cassa       #
+##########################
+
+def record_cash_movement(amount, description=None):
+    """Aggiunge un movimento al registro di cassa (nessun UPDATE su righe condivise)."""
+    movement = CashMovement(amount=Decimal(str(amount)), description=description)
+    db.session.add(movement)
+    return movement
+
+
+def get_cash_snapshot(for_update=False):
+    """Ritorna la riga del saldo consolidato, bloccandola se richiesto."""
+    query = CashSnapshot.query
+    if for_update:
+        query = query.with_for_update()
+    return query.order_by(CashSnapshot.id).first()
+
+
+def get_cash_balance(snapshot=None):
+    """Saldo di cassa corrente: saldo consolidato più i movimenti successivi."""
+    if snapshot is None:
+        snapshot = get_cash_snapshot()
+    balance = snapshot.balance if snapshot else Decimal('0')
+    last_movement_id = snapshot.last_movement_id if snapshot else 0
+    
+    tail = db.session.query(db.func.sum(CashMovement.amount)).\
+        filter(CashMovement.id > last_movement_id).scalar()
+    return Decimal(str(balance)) + Decimal(str(tail or 0))
+
+
+def compact_cash_ledger():
+    """
+    Consolida nel saldo i movimenti registrati dopo l'ultima compattazione e
+    riporta il totale sulla riga dell'utente CASSA, che resta così allineata
+    per le pagine che la leggono. Ritorna il saldo consolidato.
+    """
+    snapshot = get_cash_snapshot(for_update=True)
+    if snapshot is None:
+        snapshot = CashSnapshot(balance=0, last_movement_id=0)
+        db.session.add(snapshot)
+    
+    last_movement_id, tail = db.session.query(
+        db.func.max(CashMovement.id), db.func.sum(CashMovement.amount)
+    ).filter(CashMovement.id > (snapshot.last_movement_id or 0)).one()
+    
+    if last_movement_id is not None:
+        snapshot.balance = Decimal(str(snapshot.balance or 0)) + Decimal(str(tail or 0))
+        snapshot.last_movement_id = last_movement_id
+        snapshot.updated_at = datetime.utcnow()
+    
+    cash_register = Employee.query.filter_by(code='CASSA').first()
+    if cash_register and cash_register.credit != snapshot.balance:
+        cash_register.update_credit(snapshot.balance)
+    
+    db.session.commit()
+    return snapshot.balance
+
+
+def ensure_cash_ledger():
+    """Crea il saldo consolidato iniziale partendo dal credito attuale dell'utente CASSA."""
+    if CashSnapshot.query.first():
+        return
+    
+    cash_register = Employee.query.filter_by(code='CASSA').first()
+    balance = cash_register.credit if cash_register and cash_register.credit else Decimal('0')
+    last_movement_id = db.session.query(db.func.max(CashMovement.id)).scalar() or 0
+    db.session.add(CashSnapshot(balance=balance, last_movement_id=last_movement_id))
+    db.session.commit()
+    logger.info(f"Cash ledger initialized with balance {balance}")
+
+
+def start_cash_ledger_compactor():
+    """Avvia un thread che compatta periodicamente il registro di cassa."""
+    interval = app.config['CASH_LEDGER_COMPACT_INTERVAL_SECONDS']
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                with app.app_context():
+                    compact_cash_ledger()
+            except Exception as e:
+                logger.error(f"Errore compattazione registro di cassa: {str(e)}")
+
+    if interval > 0:
+        threading.Thread(target=run, daemon=True).start()
+
+
+##########################
+# Operazioni di cassa     #
+##########################
+
+def is_oversell_prevented():
+    """Indica se le vendite che porterebbero una giacenza sotto zero vanno rifiutate."""
+    return GlobalSetting.get_value('prevent_oversell', False)
+
+
+def load_cart_products(product_ids):
+    """
+    Carica i prodotti del carrello con una sola query IN e li ritorna per id.
+    Risponde 404 se uno dei prodotti non esiste, come get_or_404.
+    """
+    product_ids = set(product_ids)
+    if not product_ids:
+        return {}
+    
+    products = Product.query.filter(Product.id.in_(product_ids)).populate_existing().all()
+    catalog = {product.id: product for product in products}
+    if len(catalog) != len(product_ids):
+        abort(404)
+    return catalog
+
+
+def find_inventory_shortage(catalog, cart_quantities):
+    """Ritorna il payload di errore per il primo prodotto senza giacenza sufficiente, altrimenti None."""
+    for product_id, quantity in cart_quantities.items():
+        product = catalog[product_id]
+        if product.inventory is not None and product.inventory < quantity:
+            return {
+                'success': False,
+                'message': f'Giacenza insufficiente per {product.name}. Disponibili: {product.inventory}, richiesti: {quantity}'
+            }
+    return None
+
+
+def decrement_inventory(catalog, cart_quantities, prevent_oversell=False):
+    """
+    Scala le giacenze del carrello con un solo UPDATE condizionale eseguito
+    in executemany (una riga di parametri per prodotto):
+    
+        UPDATE product SET inventory = inventory - :quantity
+        WHERE id = :id AND inventory IS NOT NULL [AND inventory >= :quantity]
+    
+    La condizione sulla giacenza si applica solo con prevent_oversell.
+    Ritorna False se qualche prodotto non è stato aggiornato perché la
+    giacenza è nel frattempo scesa sotto la quantità richiesta.
+    """
+    params = [
+        {'b_id': product_id, 'b_quantity': quantity}
+        for product_id, quantity in cart_quantities.items()
+        if catalog[product_id].inventory is not None
+    ]
+    if not params:
+        return True
+    
+    products_table = Product.__table__
+    statement = products_table.update().where(
+        products_table.c.id == db.bindparam('b_id'),
+        products_table.c.inventory.isnot(None)
+    ).values(inventory=products_table.c.inventory - db.bindparam('b_quantity'))
+    
+    mark_catalog_changed(db.session(), inventory_ids=[row['b_id'] for row in params])
+    mark_tables_changed(db.session(), Product.__tablename__)
+    
+    if not prevent_oversell:
+        db.session.execute(statement, params)
+        return True
+    
+    statement = statement.where(products_table.c.inventory >= db.bindparam('b_quantity'))
+    if db.engine.dialect.supports_sane_multi_rowcount:
+        return db.session.execute(statement, params).rowcount == len(params)
+    
+    # Senza un conteggio affidabile in executemany le righe vanno verificate una per una
+    return all(db.session.execute(statement, row).rowcount == 1 for row in params)
+
+
+def perform_checkout(employee_id, products=None, custom_amount=None, custom_product=None, operator_id=None):
+    """
+    Registra un acquisto (prodotti del carrello o importo libero) senza fare commit.
+    Ritorna il payload JSON della risposta: se 'success' è False chi chiama
+    deve annullare le modifiche con un rollback.
+    """
+    employee = Employee.query.get_or_404(employee_id)
+    
+    # Verifica l'integrità del credito
+    if not employee.credit_hash or not employee.verify_credit_integrity():
+        employee.update_credit_hash()
+        db.session.flush()
+        logger.warning(f"Credit integrity fixed during deduction for employee {employee_id}")
+    
+    total_amount = Decimal('0')
+    product_descriptions = []
+    
+    # Determina l'importo da scalare
+    if products is not None:
+        # Se sono stati selezionati dei prodotti
+        cart_lines = [(int(product_data['id']), int(product_data['quantity'])) for product_data in products]
+        cart_lines = [(product_id, quantity) for product_id, quantity in cart_lines if quantity > 0]
+        
+        # Carica tutti i prodotti del carrello con una sola query
+        catalog = load_cart_products(product_id for product_id, _ in cart_lines)
+        
+        # Quantità totale per prodotto (lo stesso prodotto può comparire su più righe)
+        cart_quantities = {}
+        for product_id, quantity in cart_lines:
+            cart_quantities[product_id] = cart_quantities.get(product_id, 0) + quantity
+        
+        prevent_oversell = is_oversell_prevented()
+        if prevent_oversell:
+            shortage = find_inventory_shortage(catalog, cart_quantities)
+            if shortage:
+                return shortage
+        
+        for product_id, quantity in cart_lines:
+            product = catalog[product_id]
+            product_total = product.price * quantity
+            
+            total_amount += product_total
+            product_descriptions.append(f"{product.name} (x{quantity})")
+            
+            # Registra una transazione per ogni prodotto
+            transaction = Transaction(
+                employee_id=employee.id,
+                operator_id=operator_id if operator_id else None,
+                amount=-product_total,  # Negativo perché stiamo sottraendo
+                transaction_type='debit',
+                product_id=product_id,
+                quantity=quantity  # Salva la quantità
+            )
+            db.session.add(transaction)
+        
+        # Aggiorna le giacenze dei prodotti
+        if not decrement_inventory(catalog, cart_quantities, prevent_oversell):
+            # Un altro acquisto ha consumato la giacenza dopo il controllo
+            return find_inventory_shortage(load_cart_products(cart_quantities), cart_quantities) or {
+                'success': False,
+                'message': 'Giacenza insufficiente.'
+            }
+        
+        product_description = ", ".join(product_descriptions)
+        
+    elif custom_amount:
+        # Se è stato inserito un importo personalizzato
+        total_amount = Decimal(custom_amount)
+        product_description = custom_product if custom_product else "Importo personalizzato"
+        
+        # Registra la transazione per l'importo personalizzato
+        transaction = Transaction(
+            employee_id=employee.id,
+            operator_id=operator_id if operator_id else None,
+            amount=-total_amount,  # Negativo perché stiamo sottraendo
+            transaction_type='debit',
+            custom_product_name=product_description
+        )
+        db.session.add(transaction)
+    else:
+        return {
+            'success': False,
+            'message': 'Nessun prodotto o importo specificato.'
+        }
+    
+    # Se l'acquisto è stato fatto dall'utente "cassa", gestisci diversamente
+    if employee.code == 'CASSA':
+        # Per i pagamenti in contanti, aggiungi solo l'importo alla cassa
+        # (non sottrarre perché i soldi entrano fisicamente in cassa)
+        record_cash_movement(total_amount, f"Acquisto in contanti: {product_description}")
+        new_credit = get_cash_balance()
+    else:
+        # Per i dipendenti normali, sottrai dal loro credito solo se il risultato
+        # resta entro il limite: controllo e modifica avvengono nello stesso UPDATE
+        credit_limit = employee.effective_credit_limit()
+        new_credit = apply_credit_delta(employee, -total_amount, min_credit=-credit_limit)
+    
+    if new_credit is None:
+        # Nessuna riga aggiornata: credito insufficiente (considerando il limite)
+        remaining_credit = float(employee.credit)
+        credit_limit = float(credit_limit)
+        
+        return {
+            'success': False,
+            'message': f'Credito insufficiente. Disponibile: €{remaining_credit:.2f}, Limite: €{credit_limit:.2f}',
+            'remaining_credit': remaining_credit,
+            'credit_limit': credit_limit
+        }
+    
+    return {
+        'success': True,
+        'message': f'Scalati €{float(total_amount):.2f} dal credito per {product_description}.',
+        'new_credit': float(new_credit),
+        'credit_limit': float(employee.credit_limit)
+    }
+
+
+def perform_top_up(employee_id, operator_id, amount):
+    """
+    Ricarica il credito di un dipendente e il saldo della cassa senza fare commit.
+    Ritorna il payload JSON della risposta.
+    """
+    employee = Employee.query.get_or_404(employee_id)
+    
+    # Il saldo della cassa si modifica solo tramite il registro di cassa
+    if employee.code == 'CASSA':
+        return {
+            'success': False,
+            'message': 'Non è possibile ricaricare l\'utente "cassa".'
+        }
+    
+    # Aggiorna il credito con un UPDATE atomico
+    new_credit = apply_credit_delta(employee, amount)
+    
+    # Registra la transazione
+    transaction = Transaction(
+        employee_id=employee.id,
+        operator_id=operator_id,
+        amount=amount,
+        transaction_type='credit',
+        custom_product_name="Ricarica credito"
+    )
+    
+    # Aggiorna anche il saldo della cassa (aggiungi perché il contante entra nella cassa)
+    record_cash_movement(amount, f"Ricarica credito di {employee.first_name} {employee.last_name}")
+    
+    db.session.add(transaction)
+    
+    return {
+        'success': True,
+        'message': f'Credito di €{float(amount):.2f} aggiunto con successo.',
+        'new_credit': float(new_credit)
+    }
+
+
+class WritePipeline:
+    """
+    Coda di scrittura con un unico thread scrittore.
+    
+    Le richieste accodano un'operazione (es. perform_checkout) e attendono il
+    risultato su un Future. Il thread scrittore raccoglie le operazioni arrivate
+    entro la finestra configurata e le esegue in un'unica transazione, ognuna
+    nel proprio SAVEPOINT: un acquisto rifiutato o fallito viene annullato da
+    solo, gli altri vengono salvati con un solo commit (e un solo fsync).
+    """
+    
+    def __init__(self, batch_window=0.005, max_batch=100):
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self.thread = None
+        self.connection = None
+        self.batches = 0
+        self.operations = 0
+    
+    def start(self):
+        """Avvia il thread scrittore."""
+        self.thread = threading.Thread(target=self.run, name='write-pipeline', daemon=True)
+        self.thread.start()
+    
+    def submit(self, operation, *args, **kwargs):
+        """Accoda un'operazione e ritorna il Future con il suo payload."""
+        future = Future()
+        self.queue.put((future, operation, args, kwargs))
+        return future
+    
+    def next_batch(self):
+        """Attende la prima operazione e raccoglie quelle che arrivano entro la finestra."""
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+    
+    def run(self):
+        # Lo scrittore tiene per sé una connessione: non compete con le richieste per il pool
+        with app.app_context():
+            self.connection = db.engine.connect()
+        
+        while True:
+            batch = self.next_batch()
+            with app.app_context():
+                # Le operazioni usano db.session: in questo contesto punta alla connessione dello scrittore
+                db.session.registry.set(SASession(bind=self.connection))
+                try:
+                    self.process(batch)
+                except Exception as e:
+                    logger.error(f"Errore nella coda di scrittura: {str(e)}")
+                    db.session.rollback()
+                    for future, _, _, _ in batch:
+                        if not future.done():
+                            future.set_exception(e)
+    
+    def process(self, batch):
+        """Esegue un gruppo di operazioni in una sola transazione."""
+        connection = db.session.connection()
+        if connection.dialect.name == 'sqlite':
+            # Il driver sqlite3 non apre la transazione prima di un SAVEPOINT:
+            # senza BEGIN esplicito il RELEASE del primo savepoint farebbe commit.
+            # IMMEDIATE prende subito il lock di scrittura per tutto il gruppo.
+            connection.exec_driver_sql('BEGIN IMMEDIATE')
+        
+        outcomes = []
+        for future, operation, args, kwargs in batch:
+            if not future.set_running_or_notify_cancel():
+                continue
+            savepoint = db.session.begin_nested()
+            try:
+                result = operation(*args, **kwargs)
+            except Exception as e:
+                savepoint.rollback()
+                outcomes.append((future, None, e))
+                continue
+            if result.get('success'):
+                savepoint.commit()
+            else:
+                savepoint.rollback()
+            outcomes.append((future, result, None))
+        
+        try:
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Commit del gruppo di scrittura fallito: {str(e)}")
+            for future, _, _ in outcomes:
+                future.set_exception(e)
+            return
+        
+        self.batches += 1
+        self.operations += len(outcomes)
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+write_pipeline = None
+write_pipeline_lock = threading.Lock()
+
+
+def get_write_pipeline():
+    """Ritorna la coda di scrittura, avviandola al primo uso; None se è disabilitata."""
+    global write_pipeline
+    
+    if not app.config['WRITE_PIPELINE_ENABLED']:
+        return None
+    with write_pipeline_lock:
+        if write_pipeline is None:
+            write_pipeline = WritePipeline(
+                batch_window=app.config['WRITE_PIPELINE_BATCH_WINDOW_MS'] / 1000,
+                max_batch=app.config['WRITE_PIPELINE_MAX_BATCH']
+            )
+            write_pipeline.start()
+    return write_pipeline
+
+
+def run_write_operation(operation, *args, **kwargs):
+    """
+    Esegue un'operazione di scrittura e ne ritorna il payload.
+    Con la coda di scrittura attiva l'operazione passa dal thread scrittore,
+    altrimenti viene eseguita nella sessione della richiesta con un commit dedicato.
+    Se l'attesa supera WRITE_PIPELINE_TIMEOUT l'operazione ancora in coda viene
+    annullata (non verrà mai eseguita); se è già in esecuzione si attende il suo
+    esito, perché potrebbe essere salvata con il commit del gruppo.
+    """
+    pipeline = get_write_pipeline()
+    if pipeline is not None:
+        # Chiude la transazione di lettura della richiesta: la connessione torna al pool durante l'attesa
+        db.session.rollback()
+        future = pipeline.submit(operation, *args, **kwargs)
+        try:
+            return future.result(timeout=app.config['WRITE_PIPELINE_TIMEOUT'])
+        except FutureTimeoutError:
+            if future.cancel():
+                logger.warning(f"Write operation {operation.__name__} cancelled: still queued after timeout")
+                return {
+                    'success': False,
+                    'message': 'Database occupato: operazione annullata, nessuna modifica eseguita. Riprovare.'
+                }
+            return future.result()
+    
+    result = operation(*args, **kwargs)
+    if result.get('success'):
+        db.session.commit()
+    else:
+        db.session.rollback()
+    return result
+
+
+##########################
+# Migrazioni dello schema #
+##########################
+
+def ensure_model_columns(model):
+    """Aggiunge con ALTER TABLE le colonne del modello che mancano nel database esistente."""
+    table = model.__table__
+    existing = {column['name'] for column in db.inspect(db.engine).get_columns(table.name)}
+    added = []
+    
+    with db.engine.begin() as connection:
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            connection.exec_driver_sql(
+                f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'
+            )
+            added.append(column.name)
+    
+    if added:
+        logger.info(f"Added columns to {table.name}: {', '.join(added)}")
+    return added
+
+
+def ensure_transaction_autoincrement():
+    """
+    Ricrea con AUTOINCREMENT la tabella transaction dei database creati senza.
+    Senza AUTOINCREMENT SQLite riassegna gli id più alti dopo un'eliminazione,
+    compresi quelli di transazioni già spostate nell'archivio.
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return False
+    
+    table = Transaction.__table__
+    legacy = f"{table.name}_legacy"
+    with db.engine.begin() as connection:
+        sql = connection.exec_driver_sql(
+            "SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?", (table.name,)
+        ).scalar()
+        if sql is None or 'AUTOINCREMENT' in sql.upper():
+            return False
+        
+        existing = {row[1] for row in connection.exec_driver_sql(f'PRAGMA main.table_info("{table.name}")')}
+        indexes = [
+            row[1] for row in connection.exec_driver_sql(f'PRAGMA main.index_list("{table.name}")')
+            if not row[1].startswith('sqlite_autoindex')
+        ]
+        connection.exec_driver_sql(f'ALTER TABLE main."{table.name}" RENAME TO "{legacy}"')
+        for index in indexes:
+            connection.exec_driver_sql(f'DROP INDEX main."{index}"')
+        table.create(bind=connection)
+        
+        names = ', '.join(f'"{column.name}"' for column in table.columns if column.name in existing)
+        connection.exec_driver_sql(f'INSERT INTO main."{table.name}" ({names}) SELECT {names} FROM main."{legacy}"')
+        connection.exec_driver_sql(f'DROP TABLE main."{legacy}"')
+    
+    logger.info(f"Recreated table {table.name} with AUTOINCREMENT ids")
+    return True
+
+
+def backfill_employee_code_keys():
+    """Valorizza code_key per i dipendenti creati prima della sua introduzione."""
+    employees = Employee.query.filter(Employee.code_key.is_(None), Employee.code.isnot(None)).all()
+    
+    for employee in employees:
+        employee.code_key = normalize_employee_code(employee.code)
+    
+    if employees:
+        db.session.commit()
+        logger.info(f"Backfilled normalized code for {len(employees)} employees")
+    return len(employees)
+
+
+def migrate_credit_hashes():
+    """
+    Riscrive nel formato HMAC gli hash del credito ancora nel formato precedente.
+    Vengono migrati solo gli hash validi: un credito manomesso resta segnalato.
+    """
+    migrated = 0
+    invalid = 0
+    for employee in Employee.query.filter(Employee.credit_hash.isnot(None)).all():
+        current = compute_credit_hash(employee.id, employee.credit, employee.credit_limit)
+        if hmac.compare_digest(current, employee.credit_hash):
+            continue
+        legacy = compute_legacy_credit_hash(employee.id, employee.credit, employee.credit_limit)
+        if hmac.compare_digest(legacy, employee.credit_hash):
+            employee.credit_hash = current
+            migrated += 1
+        else:
+            invalid += 1
+    
+    if migrated:
+        db.session.commit()
+        logger.info(f"Migrated credit hash of {migrated} employees to HMAC")
+    if invalid:
+        logger.warning(f"SECURITY: {invalid} employees have an invalid credit hash, not migrated")
+    forget_credit_verification()
+    return migrated
+
+
+def ensure_model_indexes(model):
+    """Crea gli indici dichiarati sul modello che mancano nel database esistente."""
+    existing = {index['name'] for index in db.inspect(db.engine).get_indexes(model.__tablename__)}
+    created = []
+    
+    for index in model.__table__.indexes:
+        if index.name in existing:
+            continue
+        try:
+            index.create(bind=db.engine)
+            created.append(index.name)
+        except db.exc.IntegrityError as e:
+            # Un indice univoco non può essere creato se ci sono duplicati già presenti
+            logger.error(f"Cannot create index {index.name}: duplicate values in existing data ({e.orig})")
+    
+    if created:
+        logger.info(f"Created indexes on {model.__tablename__}: {', '.join(created)}")
+    return created
+
+
+def run_schema_migrations():
+    """
+    Allinea i database esistenti (es. vinicola.db) al modello corrente.
+    db.create_all() crea solo le tabelle mancanti: indici e colonne aggiunti
+    in seguito vanno creati qui. Tutte le operazioni sono idempotenti.
+    """
+    ensure_transaction_autoincrement()
+    ensure_model_indexes(Transaction)
     
-    for employee in employees:
-        employee.update_credit_hash()
-        count += 1
+    ensure_model_columns(Employee)
+    backfill_employee_code_keys()
+    ensure_model_indexes(Employee)
+    migrate_credit_hashes()
     
-    db.session.commit()
-    return count
+    ensure_archive_schema()
+    raise_transaction_id_floor()
+    ensure_cash_ledger()
+    
+    # Primo popolamento dei riepiloghi giornalieri su un database con storico
+    if not DailyRollup.query.first() and Transaction.query.first():
+        rebuild_daily_rollups()
 
 
 ####################
@@ -840,7 +4379,7 @@ def logout():
 @login_required
 def dashboard():
     """Dashboard principale."""
-    employees = Employee.query.all()
+    employees = LazyList(lambda: Employee.query.all())
     stats = get_system_stats()
     
     return render_template(
@@ -864,7 +4403,7 @@ def new_employee():
         password = request.form.get('password')
         
         # Verifica se il codice è già esistente
-        existing_employee = Employee.query.filter(db.func.upper(Employee.code) == db.func.upper(code)).first()
+        existing_employee = find_employee_by_code(code)
         if existing_employee:
             flash('Il codice dipendente esiste già.')
             return redirect(url_for('new_employee'))
@@ -895,6 +4434,11 @@ def employee_details(id):
     employee = Employee.query.get_or_404(id)
     transactions = Transaction.query.filter_by(employee_id=id).filter(Transaction.transaction_type != 'cancellation').order_by(Transaction.timestamp.desc()).all()
     
+    # Lo storico completo include le transazioni spostate nell'archivio
+    if archive_reaches(None):
+        archived = ArchivedTransaction.query.filter_by(employee_id=id).filter(ArchivedTransaction.transaction_type != 'cancellation').order_by(ArchivedTransaction.timestamp.desc()).all()
+        transactions = merge_transactions(transactions, archived)
+    
     # Calcola statistiche credito
     credit_stats = get_credit_stats(id)
     
@@ -948,8 +4492,11 @@ def delete_employee(id):
         flash('Non è possibile eliminare l\'utente "cassa" in quanto è necessario per il sistema.', 'danger')
         return redirect(url_for('dashboard'))
     
-    # Elimina tutte le transazioni associate
-    Transaction.query.filter_by(employee_id=id).delete()
+    # Elimina tutte le transazioni associate (una per una, così i riepiloghi
+    # giornalieri vengono aggiornati nello stesso flush)
+    for transaction in Transaction.query.filter_by(employee_id=id):
+        db.session.delete(transaction)
+    delete_archived_transactions(id)
     
     # Elimina il dipendente
     db.session.delete(employee)
@@ -999,7 +4546,7 @@ def add_credit():
         employee = Employee.query.get_or_404(employee_id)
         
         # Verifica che la password dell'operatore sia valida
-        operator = Operator.query.filter_by(password=operator_password, active=True).first()
+        operator = find_operator_by_password(operator_password)
         if not operator:
             return jsonify({
                 'success': False,
@@ -1014,32 +4561,8 @@ def add_credit():
                     'message': 'L\'importo deve essere maggiore di zero.'
                 })
             
-            # Aggiorna il credito
-            new_credit = employee.credit + amount_decimal
-            employee.update_credit(new_credit)
-            
-            # Registra la transazione
-            transaction = Transaction(
-                employee_id=employee.id,
-                operator_id=operator.id,
-                amount=amount_decimal,
-                transaction_type='credit',
-                custom_product_name="Ricarica credito"
-            )
-            
-            # Aggiorna anche il saldo della cassa (aggiungi perché il contante entra nella cassa)
-            cash_register = Employee.query.filter_by(code='CASSA').first()
-            if cash_register:
-                cash_register.update_credit(cash_register.credit + amount_decimal)
-            
-            db.session.add(transaction)
-            db.session.commit()
-            
-            return jsonify({
-                'success': True,
-                'message': f'Credito di €{float(amount_decimal):.2f} aggiunto con successo.',
-                'new_credit': float(employee.credit)
-            })
+            result = run_write_operation(perform_top_up, employee.id, operator.id, amount_decimal)
+            return jsonify(result)
             
         except Exception as e:
             logger.error(f"Error in add_credit: {str(e)}")
@@ -1051,7 +4574,7 @@ def add_credit():
 @app.route('/products_first')
 def products_first():
     """Interfaccia prodotti-prima: selezione prodotti e poi identificazione utente."""
-    products = Product.query.filter_by(active=True).order_by(Product.name.asc()).all()
+    products = catalog_snapshot.current().active
     return render_template('products_first.html', products=products)
 
 
@@ -1073,14 +4596,14 @@ def barcode_scanner():
     Questa è la pagina principale che tutti gli utenti vedono.
     """
     # Ottieni l'ultimo codice a barre letto dal lettore seriale (se disponibile)
-    last_barcode_info = get_last_barcode()
+    last_barcode_info = get_last_barcode(request.args.get('lane', type=int))
     last_barcode = last_barcode_info['barcode'] if last_barcode_info else None
     
-    # Ottieni la lista dei prodotti per la selezione rapida
-    products = Product.query.filter_by(active=True).all()
+    # Ottieni la lista dei prodotti per la selezione rapida (in ordine di inserimento)
+    products = catalog_snapshot.current().active_by_id
     
-    # Ottieni la lista dei dipendenti per la tabella
-    employees = Employee.query.order_by(Employee.last_name).all()
+    # Ottieni la lista dei dipendenti per la tabella (solo se il frammento non è in cache)
+    employees = LazyList(lambda: Employee.query.order_by(Employee.last_name).all())
     
     return render_template(
         'barcode_scanner.html', 
@@ -1094,27 +4617,37 @@ def get_serial_barcode():
     """
     Endpoint per ottenere l'ultimo codice a barre letto dal lettore seriale tramite AJAX.
     La pagina principale fa polling di questo endpoint per rilevare nuove scansioni.
+    Con ?lane=N risponde solo con le letture della cassa N.
     """
-    last_barcode = get_last_barcode()
+    lane = request.args.get('lane', type=int)
+    if lane is not None and lane not in scanner_manager.lanes:
+        return jsonify({
+            'success': False,
+            'message': f'Cassa {lane} non configurata.',
+            'barcode': None,
+            'timestamp': None
+        }), 404
+    
+    last_barcode = get_last_barcode(lane)
     
     if last_barcode:
-        # Se è stato letto un codice, cerca il dipendente
-        employee = Employee.query.filter(db.func.upper(Employee.code) == db.func.upper(last_barcode['barcode'])).first()
+        # Se è stato letto un codice, cerca il dipendente nella rubrica
+        employee = employee_directory.get(last_barcode['barcode'])
         
         if employee:
             # Verifica l'integrità del credito
-            if not employee.verify_credit_integrity():
+            if not employee['credit_integrity']:
                 # Ripristina l'hash e registra il problema
-                employee.update_credit_hash()
-                db.session.commit()
-                logger.warning(f"Credit integrity issue fixed for {employee.first_name} {employee.last_name}")
+                employee = repair_credit_hash(employee['id']) or employee
+                logger.warning(f"Credit integrity issue fixed for {employee['first_name']} {employee['last_name']}")
             
             # Ritorna i dati del dipendente
             return jsonify({
                 'success': True,
                 'barcode': last_barcode['barcode'],
                 'timestamp': last_barcode['timestamp'],
-                'employee': employee.to_dict()
+                'lane': last_barcode['lane'],
+                'employee': employee
             })
         else:
             # Codice letto ma dipendente non trovato
@@ -1122,7 +4655,8 @@ def get_serial_barcode():
                 'success': False,
                 'message': 'Dipendente non trovato.',
                 'barcode': last_barcode['barcode'],
-                'timestamp': last_barcode['timestamp']
+                'timestamp': last_barcode['timestamp'],
+                'lane': last_barcode['lane']
             })
     
     # Nessun codice letto
@@ -1134,17 +4668,64 @@ def get_serial_barcode():
     })
 
 
+@app.route('/stream/scans')
+def stream_scans():
+    """
+    Flusso Server-Sent Events delle letture del lettore seriale.
+    Ogni evento 'scan' ha lo stesso formato di /get_serial_barcode; con ?lane=N
+    arrivano solo le letture della cassa N. Il browser riprende dopo una
+    disconnessione inviando Last-Event-ID; senza, riceve subito l'ultima lettura.
+    """
+    lane = request.args.get('lane', type=int)
+    resume_id = scan_events.resume_id(request.headers.get('Last-Event-ID'))
+    heartbeat = app.config['SCAN_STREAM_HEARTBEAT_SECONDS']
+    
+    def format_event(event):
+        return f"id: {event['id']}\nevent: scan\ndata: {json.dumps(event)}\n\n"
+    
+    def generate():
+        with scan_events.condition:
+            scan_events.subscribers += 1
+        try:
+            yield "retry: 2000\n\n"
+            if resume_id is None:
+                last_id, event = scan_events.latest(lane)
+                if event:
+                    yield format_event(event)
+            else:
+                last_id = resume_id
+            
+            while True:
+                events = scan_events.wait(last_id, heartbeat)
+                if not events:
+                    # Heartbeat: mantiene aperta la connessione attraverso proxy e firewall
+                    yield ": heartbeat\n\n"
+                    continue
+                for event in events:
+                    last_id = event['id']
+                    if lane is None or event['lane'] == lane:
+                        yield format_event(event)
+        finally:
+            with scan_events.condition:
+                scan_events.subscribers -= 1
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
 @app.route('/scan_barcode', methods=['POST'])
 def scan_barcode():
     """Endpoint per scansione manuale di un codice a barre o selezione diretta di un dipendente."""
     barcode = request.form.get('barcode')
     employee_id = request.form.get('employee_id')
     
-    # Cerca il dipendente per ID o per codice a barre
+    # Cerca il dipendente nella rubrica per ID o per codice a barre
     if employee_id:
-        employee = Employee.query.get(employee_id)
+        employee = employee_directory.get_by_id(employee_id)
     elif barcode:
-        employee = Employee.query.filter(db.func.upper(Employee.code) == db.func.upper(barcode)).first()
+        employee = employee_directory.get(barcode)
     else:
         return jsonify({'success': False, 'message': 'Nessun codice o ID dipendente fornito.'})
     
@@ -1152,15 +4733,14 @@ def scan_barcode():
         return jsonify({'success': False, 'message': 'Dipendente non trovato.'})
     
     # Verifica l'integrità del credito prima di restituire i dati
-    if not employee.verify_credit_integrity():
+    if not employee['credit_integrity']:
         # Registra l'incidente di sicurezza
-        logger.warning(f"SECURITY ALERT: Credit integrity check failed for employee {employee.id} " +
-                      f"({employee.first_name} {employee.last_name})")
+        logger.warning(f"SECURITY ALERT: Credit integrity check failed for employee {employee['id']} " +
+                      f"({employee['first_name']} {employee['last_name']})")
         
         # In un sistema reale, qui dovresti avvisare un amministratore e intraprendere azioni di ripristino
         # Per ora, ricrea l'hash e avvisa l'utente
-        employee.update_credit_hash()
-        db.session.commit()
+        repair_credit_hash(employee['id'])
         
         return jsonify({
             'success': False, 
@@ -1170,7 +4750,7 @@ def scan_barcode():
     
     return jsonify({
         'success': True,
-        'employee': employee.to_dict()
+        'employee': employee
     })
 
 
@@ -1197,113 +4777,17 @@ def deduct_credit():
     # Prendi il dipendente dal database
     employee = Employee.query.get_or_404(employee_id)
     
-    # Verifica l'integrità del credito
-    if not employee.verify_credit_integrity():
-        employee.update_credit_hash()
-        db.session.commit()
-        logger.warning(f"Credit integrity fixed during deduction for employee {employee_id}")
-    
     try:
-        total_amount = Decimal('0')
-        product_descriptions = []
-        
-        # Determina l'importo da scalare
-        if products_json:
-            # Se sono stati selezionati dei prodotti
-            products = json.loads(products_json)
-            
-            for product_data in products:
-                product_id = product_data['id']
-                quantity = int(product_data['quantity'])
-                
-                if quantity <= 0:
-                    continue
-                
-                product = Product.query.get_or_404(product_id)
-                product_price = product.price
-                product_total = product_price * quantity
-                
-                total_amount += product_total
-                product_descriptions.append(f"{product.name} (x{quantity})")
-                
-                # Registra una transazione per ogni prodotto
-                transaction = Transaction(
-                    employee_id=employee.id,
-                    operator_id=operator_id if operator_id else None,
-                    amount=-product_total,  # Negativo perché stiamo sottraendo
-                    transaction_type='debit',
-                    product_id=product_id,
-                    quantity=quantity  # Salva la quantità
-                )
-                db.session.add(transaction)
-                
-                # Aggiorna la giacenza del prodotto
-                if product.inventory is not None:
-                    product.inventory -= quantity
-            
-            product_description = ", ".join(product_descriptions)
-            
-        elif custom_amount:
-            # Se è stato inserito un importo personalizzato
-            total_amount = Decimal(custom_amount)
-            product_description = custom_product if custom_product else "Importo personalizzato"
-            
-            # Registra la transazione per l'importo personalizzato
-            transaction = Transaction(
-                employee_id=employee.id,
-                operator_id=operator_id if operator_id else None,
-                amount=-total_amount,  # Negativo perché stiamo sottraendo
-                transaction_type='debit',
-                custom_product_name=product_description
-            )
-            db.session.add(transaction)
-        else:
-            return jsonify({
-                'success': False,
-                'message': 'Nessun prodotto o importo specificato.'
-            })
-        
-        # Controlla se il dipendente ha credito sufficiente (considerando il limite)
-        if not employee.has_sufficient_credit(total_amount):
-            remaining_credit = float(employee.credit)
-            
-            # Ottieni il limite di credito globale, se non esiste usa il limite dell'utente
-            global_limit = GlobalSetting.get('credit_limit', None)
-            
-            if global_limit is not None:
-                try:
-                    credit_limit = float(Decimal(global_limit))
-                except:
-                    credit_limit = float(employee.credit_limit)
-            else:
-                credit_limit = float(employee.credit_limit)
-            
-            return jsonify({
-                'success': False,
-                'message': f'Credito insufficiente. Disponibile: €{remaining_credit:.2f}, Limite: €{credit_limit:.2f}',
-                'remaining_credit': remaining_credit,
-                'credit_limit': credit_limit
-            })
-        
-        # Se l'acquisto è stato fatto dall'utente "cassa", gestisci diversamente
-        if employee.code == 'CASSA':
-            # Per i pagamenti in contanti, aggiungi solo l'importo alla cassa
-            # (non sottrarre perché i soldi entrano fisicamente in cassa)
-            new_credit = employee.credit + total_amount
-            employee.update_credit(new_credit)
-        else:
-            # Per i dipendenti normali, sottrai dal loro credito
-            new_credit = employee.credit - total_amount
-            employee.update_credit(new_credit)
-        
-        db.session.commit()
-            
-        return jsonify({
-            'success': True,
-            'message': f'Scalati €{float(total_amount):.2f} dal credito per {product_description}.',
-            'new_credit': float(employee.credit),
-            'credit_limit': float(employee.credit_limit)
-        })
+        products = json.loads(products_json) if products_json else None
+        result = run_write_operation(
+            perform_checkout,
+            employee.id,
+            products=products,
+            custom_amount=custom_amount,
+            custom_product=custom_product,
+            operator_id=operator_id
+        )
+        return jsonify(result)
         
     except Exception as e:
         logger.error(f"Error in deduct_credit: {str(e)}")
@@ -1327,15 +4811,13 @@ def verify_operator_password():
             })
         
         # Cerca un operatore con la password fornita
-        operators = Operator.query.filter_by(active=True).all()
-        
-        for operator in operators:
-            if operator.password == password:
-                logger.info(f"Operator password verified for operator {operator.id} ({operator.username})")
-                return jsonify({
-                    'success': True,
-                    'operator_id': operator.id
-                })
+        operator = find_operator_by_password(password)
+        if operator:
+            logger.info(f"Operator password verified for operator {operator.id} ({operator.username})")
+            return jsonify({
+                'success': True,
+                'operator_id': operator.id
+            })
         
         logger.warning(f"Invalid operator password attempt: {password}")
         return jsonify({
@@ -1398,34 +4880,74 @@ def admin_dashboard():
         return redirect(url_for('admin_login'))
     
     # Statistiche di sistema
-    employees_count = Employee.query.count()
-    total_credit = db.session.query(db.func.sum(Employee.credit)).scalar() or 0
-    transactions_today = Transaction.query.filter(
-        Transaction.timestamp >= datetime.now().replace(hour=0, minute=0, second=0),
-        Transaction.transaction_type != 'cancellation'
-    ).count()
+    stats = get_admin_dashboard_stats(datetime.now().date())
+    # Il saldo della cassa viene dal registro, non dalla riga CASSA (aggiornata solo alla compattazione)
+    cash_balance = get_cash_balance()
+    total_credit = stats['employees_credit'] + cash_balance
     
     # Elenco operatori
     operators = Operator.query.all()
     
-    # Ottieni il saldo della cassa
-    cash_register = Employee.query.filter_by(code='CASSA').first()
-    cash_balance = float(cash_register.credit) if cash_register else 0.0
     
     # Aggiungi il tab per gli amministratori se l'utente è un super admin
     is_super_admin = session.get('is_super_admin', False)
     
     return render_template(
         'admin_dashboard.html',
-        employees_count=employees_count,
+        employees_count=stats['employees_count'],
         total_credit=float(total_credit),
-        transactions_today=transactions_today,
+        transactions_today=stats['transactions_today'],
         operators=operators,
         is_super_admin=is_super_admin,
-        cash_balance=cash_balance
+        cash_balance=float(cash_balance)
     )
 
 
+@app.route('/admin/diagnostics/database')
+def admin_database_diagnostics():
+    """Mostra il profilo SQLite configurato e i valori effettivi sulle connessioni."""
+    if session.get('admin_logged_in') != True:
+        return jsonify({
+            'success': False,
+            'message': 'Accesso non autorizzato'
+        }), 401
+
+    try:
+        return jsonify({
+            'success': True,
+            'backend': db.engine.dialect.name,
+            'profile_enabled': app.config['SQLITE_PROFILE_ENABLED'],
+            'configured': app.config['SQLITE_PRAGMAS'],
+            'current': get_sqlite_diagnostics()
+        })
+    except Exception as e:
+        logger.error(f"Error in admin_database_diagnostics: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f'Errore interno: {str(e)}'
+        }), 500
+
+
+@app.route('/admin/diagnostics/caches')
+def admin_cache_diagnostics():
+    """Mostra le statistiche delle cache in memoria (rubrica, operatori, frammenti, query, sintesi vocale)."""
+    if session.get('admin_logged_in') != True:
+        return jsonify({
+            'success': False,
+            'message': 'Accesso non autorizzato'
+        }), 401
+
+    return jsonify({
+        'success': True,
+        'backend': cache_backend.name,
+        'employee_directory': employee_directory.stats(),
+        'operator_auth': operator_auth.stats(),
+        'fragment_cache': fragment_cache.stats(),
+        'query_cache': query_cache.stats(),
+        'speech_config': speech_config_service.stats()
+    })
+
+
 @app.route('/admin/withdraw_cash', methods=['POST'])
 def admin_withdraw_cash():
     """Preleva il denaro dalla cassa (tutto o parte del saldo)."""
@@ -1449,8 +4971,10 @@ def admin_withdraw_cash():
                 'message': 'Utente cassa non trovato.'
             })
         
-        # Ottieni il saldo attuale
-        current_balance = float(cash_register.credit)
+        # Ottieni il saldo attuale dal registro, bloccando il saldo consolidato
+        # così che due prelievi o una compattazione non procedano in parallelo
+        snapshot = get_cash_snapshot(for_update=True)
+        current_balance = float(get_cash_balance(snapshot))
         
         if current_balance <= 0:
             return jsonify({
@@ -1485,9 +5009,6 @@ def admin_withdraw_cash():
                     'message': f'Importo superiore al saldo disponibile (€{current_balance:.2f}).'
                 })
         
-        # Calcola il nuovo saldo
-        new_balance = current_balance - withdrawal_amount
-        
         # Crea una transazione per il prelievo
         # Crea un operator virtuale per l'admin se non esiste
         admin_username = session.get('admin_username', 'admin')
@@ -1508,8 +5029,18 @@ def admin_withdraw_cash():
             custom_product_name="Prelievo cassa da amministratore"
         )
         
-        # Aggiorna il saldo della cassa
-        cash_register.update_credit(Decimal(str(new_balance)))
+        # Registra l'uscita di contante; il saldo viene ricontrollato dentro la
+        # transazione di scrittura e il prelievo rifiutato se andrebbe sotto zero
+        record_cash_movement(-withdrawal_amount, "Prelievo cassa da amministratore")
+        db.session.flush()
+        new_balance = get_cash_balance(snapshot)
+        if new_balance < 0:
+            db.session.rollback()
+            available = float(get_cash_balance())
+            return jsonify({
+                'success': False,
+                'message': f'Importo superiore al saldo disponibile (€{available:.2f}).'
+            })
         
         # Salva la transazione
         db.session.add(transaction)
@@ -1519,7 +5050,7 @@ def admin_withdraw_cash():
             'success': True,
             'message': f'Prelievo di €{withdrawal_amount:.2f} effettuato con successo.',
             'amount': withdrawal_amount,
-            'new_balance': new_balance
+            'new_balance': float(new_balance)
         })
         
     except Exception as e:
@@ -1703,7 +5234,7 @@ def admin_employees():
     if session.get('admin_logged_in') != True:
         return redirect(url_for('admin_login'))
     
-    employees = Employee.query.order_by(Employee.last_name).all()
+    employees = LazyList(lambda: Employee.query.order_by(Employee.last_name).all())
     return render_template('admin_employees.html', employees=employees)
 
 
@@ -1723,7 +5254,7 @@ def admin_products():
     if session.get('admin_logged_in') != True:
         return redirect(url_for('admin_login'))
     
-    products = Product.query.order_by(Product.name.asc()).all()
+    products = catalog_snapshot.current().products
     return render_template('admin_products.html', products=products)
 
 @app.route('/admin/products/delete/<int:id>', methods=['POST'])
@@ -1739,7 +5270,7 @@ def admin_delete_product(id):
     return redirect(url_for('admin_products')) 
 
 def get_product_logs_for_period(start_date, end_date):
-    """Estrae i log delle operazioni sui prodotti per il periodo specificato."""
+    """Estrae i log delle operazioni sui prodotti per il periodo semiaperto [start_date, end_date)."""
     import os
     import re
     from datetime import datetime
@@ -1794,7 +5325,7 @@ def get_product_logs_for_period(start_date, end_date):
                         
                         logger.debug(f"Checking timestamp {log_timestamp} against range {start_check} to {end_check}")
                         
-                        if start_check <= log_timestamp <= end_check:
+                        if start_check <= log_timestamp < end_check:
                             # Extract PRODUCT_LOG data
                             # Format: PRODUCT_LOG|ACTION|ID|NAME|PRICE|INVENTORY|USER|TIMESTAMP|EXTRA_INFO
                             product_log_match = re.search(r'PRODUCT_LOG\|([^|]+)\|([^|]+)\|([^|]+)\|([^|]+)\|([^|]+)\|([^|]+)\|([^|]+)(?:\|(.+))?', line)
@@ -1858,13 +5389,9 @@ def admin_reports():
             start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
             end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
             
-            # Imposta l'ora di inizio e fine
-            start_date = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
-            end_date = end_date.replace(hour=23, minute=59, second=59, microsecond=999999)
-            
-            # I timestamp nel database sono già in ora locale, quindi non serve conversione UTC
-            start_date_utc = start_date
-            end_date_utc = end_date
+            # I timestamp nel database sono già in ora locale, quindi non serve conversione UTC.
+            # L'intervallo è semiaperto: [inizio del primo giorno, inizio del giorno dopo l'ultimo)
+            start_date_utc, end_date_utc = days_bounds(start_date, end_date)
             
             report_title = f"Report dal {start_date.strftime('%d/%m/%Y')} al {end_date.strftime('%d/%m/%Y')}"
             report_date = end_date  # Usa la data di fine come data di riferimento
@@ -1881,121 +5408,59 @@ def admin_reports():
             end_date = report_date.replace(hour=23, minute=59, second=59, microsecond=999999)
             
             # I timestamp nel database sono già in ora locale, quindi non serve conversione UTC
-            start_date_utc = start_date
-            end_date_utc = end_date
+            start_date_utc, end_date_utc = day_bounds(report_date)
             
             report_title = f"Report del {report_date.strftime('%d/%m/%Y')}"
         
         logger.info(f"Filtering transactions between {start_date_utc} and {end_date_utc}")
         
-        # Carica le transazioni con le relazioni (includi cancellazioni per admin reports)
-        transactions = Transaction.query.options(
-            db.joinedload(Transaction.employee),
-            db.joinedload(Transaction.operator),
-            db.joinedload(Transaction.product)
-        ).filter(
-            Transaction.timestamp >= start_date_utc,
-            Transaction.timestamp <= end_date_utc
-        ).order_by(Transaction.timestamp.desc()).all()
+        # Carica solo le colonne necessarie all'elenco (includi cancellazioni per admin reports)
+        def report_rows(model):
+            query = db.session.query(
+                model.id.label('id'),
+                model.timestamp.label('timestamp'),
+                model.amount,
+                model.transaction_type,
+                model.custom_product_name,
+                model.quantity,
+                Employee.id.label('employee_id'),
+                Employee.first_name,
+                Employee.last_name,
+                Employee.code,
+                Product.name,
+                Operator.username
+            ).outerjoin(Employee, model.employee_id == Employee.id)\
+             .outerjoin(Product, model.product_id == Product.id)\
+             .outerjoin(Operator, model.operator_id == Operator.id)
+            return filter_timestamp_range(
+                query, start_date_utc, end_date_utc, column=model.timestamp
+            ).order_by(model.timestamp.desc()).all()
+        
+        transactions = report_rows(Transaction)
+        if archive_reaches(start_date_utc):
+            transactions = merge_transactions(transactions, report_rows(ArchivedTransaction))
         
         logger.info(f"Found {len(transactions)} transactions")
         
         # Prepara i dati delle transazioni per il template
         transaction_data = []
-        for t in transactions:
-            # Ottieni i dati del dipendente
-            employee_name = f"{t.employee.first_name} {t.employee.last_name}" if t.employee else "N/A"
-            
-            # Ottieni i dati del prodotto
-            if t.product:
-                product_name = t.product.name
-            else:
-                product_name = t.custom_product_name if t.custom_product_name else "N/A"
-            
-            # Ottieni i dati dell'operatore
-            operator_name = t.operator.username if t.operator else "N/A"
-            
+        for (t_id, timestamp, amount, transaction_type, custom_product_name, quantity,
+             employee_id, first_name, last_name, employee_code, product_name, operator_name) in transactions:
             # Il timestamp è già in ora locale, quindi non serve conversione
-            local_timestamp = t.timestamp
-            
-            # Aggiungi i dati alla lista
             transaction_data.append({
-                'id': t.id,
-                'timestamp': local_timestamp,
-                'amount': float(t.amount),
-                'transaction_type': t.transaction_type,
-                'employee_name': employee_name,
-                'employee_code': t.employee.code if t.employee else None,
-                'product_name': product_name,
-                'operator_name': operator_name,
-                'quantity': t.quantity if t.quantity else 1
+                'id': t_id,
+                'timestamp': timestamp,
+                'amount': float(amount),
+                'transaction_type': transaction_type,
+                'employee_name': f"{first_name} {last_name}" if employee_id is not None else "N/A",
+                'employee_code': employee_code,
+                'product_name': product_name or custom_product_name or "N/A",
+                'operator_name': operator_name or "N/A",
+                'quantity': quantity if quantity else 1
             })
         
-        # Statistiche del periodo
-        credit_sum = sum([t.amount for t in transactions if t.transaction_type == 'credit'])
-        debit_sum = sum([abs(t.amount) for t in transactions if t.transaction_type == 'debit'])
-        
-        # Raggruppa per operatore
-        operator_stats = {}
-        for t in transactions:
-            if t.operator_id:
-                operator_name = t.operator.username
-                if operator_name not in operator_stats:
-                    operator_stats[operator_name] = {'credit': 0, 'debit': 0}
-                
-                if t.transaction_type == 'credit':
-                    operator_stats[operator_name]['credit'] += float(t.amount)
-                else:
-                    operator_stats[operator_name]['debit'] += float(abs(t.amount))
-        
-        # Raggruppa per prodotto
-        product_stats = {}
-        product_total_quantity = 0
-        product_total_amount = 0
-        
-        for t in transactions:
-            if t.transaction_type == 'debit':
-                # Determina il nome del prodotto e la quantità
-                product_name = None
-                quantity = t.quantity if t.quantity else 1  # Usa la quantità salvata nella transazione
-                
-                if t.product:
-                    product_name = t.product.name
-                elif t.custom_product_name:
-                    # Controlla se c'è una quantità nel nome del prodotto personalizzato
-                    # Formato: "Nome prodotto (x2)"
-                    product_name = t.custom_product_name
-                    quantity_match = re.search(r'\(x(\d+)\)', product_name)
-                    if quantity_match:
-                        try:
-                            quantity = int(quantity_match.group(1))
-                            # Rimuovi la parte della quantità dal nome
-                            product_name = re.sub(r'\s*\(x\d+\)', '', product_name)
-                        except ValueError:
-                            quantity = 1
-                
-                # Escludi i prelievi cassa da amministratore dal riepilogo prodotti
-                if product_name and product_name != "Prelievo cassa da amministratore":
-                    # Aggiungi o aggiorna le statistiche del prodotto
-                    if product_name not in product_stats:
-                        # Cerca il prodotto nel database per ottenere la giacenza attuale
-                        current_inventory = 0
-                        if t.product:
-                            current_inventory = t.product.inventory
-                        
-                        product_stats[product_name] = {
-                            'quantity': 0, 
-                            'total': 0,
-                            'inventory': current_inventory,
-                            'product_id': t.product_id if t.product else None
-                        }
-                    
-                    product_stats[product_name]['quantity'] += quantity
-                    product_stats[product_name]['total'] += float(abs(t.amount))
-                    
-                    # Aggiorna i totali
-                    product_total_quantity += quantity
-                    product_total_amount += float(abs(t.amount))
+        # Statistiche del periodo, lette dai riepiloghi giornalieri
+        report_stats = get_rollup_report_stats(start_date_utc.date(), (end_date_utc - timedelta(days=1)).date())
         
         # Get product operation logs
         product_logs = get_product_logs_for_period(start_date_utc, end_date_utc)
@@ -2003,7 +5468,7 @@ def admin_reports():
         # No debug data needed - show empty if no logs found
         
         # Get employees with negative credit (ordered by last name)
-        negative_credit_employees = Employee.query.filter(Employee.credit < 0).order_by(Employee.last_name.asc()).all()
+        negative_credit_employees = get_negative_credit_employees()
         
         return render_template(
             'admin_reports.html',
@@ -2014,13 +5479,8 @@ def admin_reports():
             product_logs=product_logs,
             start_date=start_date if start_date_str else None,
             end_date=end_date if end_date_str else None,
-            credit_sum=float(credit_sum),
-            debit_sum=float(debit_sum),
-            operator_stats=operator_stats,
-            product_stats=product_stats,
-            product_total_quantity=product_total_quantity,
-            product_total_amount=product_total_amount,
-            negative_credit_employees=negative_credit_employees
+            negative_credit_employees=negative_credit_employees,
+            **report_stats
         )
     
     except Exception as e:
@@ -2177,10 +5637,9 @@ def admin_reset_today_transactions():
             })
         
         # Trova tutte le transazioni di oggi
-        from datetime import date
-        today = date.today()
-        today_transactions = Transaction.query.filter(
-            db.func.date(Transaction.timestamp) == today
+        today_start, today_end = day_bounds(datetime.now())
+        today_transactions = filter_timestamp_range(
+            Transaction.query, today_start, today_end
         ).all()
         
         transaction_count = len(today_transactions)
@@ -2222,20 +5681,13 @@ def admin_create_backup():
         })
     
     try:
-        import shutil
-        from datetime import datetime
-        
         # Crea timestamp per il nome del file
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        backup_filename = f'vinicola_backup_{timestamp}.db'
+        backup_filename = f'vinicola_backup_{timestamp}{backup_file_extension()}'
+        backup_path = os.path.join(BACKUP_FOLDER, backup_filename)
         
-        # Percorsi
-        current_db = os.path.join(app.instance_path, 'vinicola.db')
-        backup_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backup')
-        backup_path = os.path.join(backup_folder, backup_filename)
-        
-        # Copia il database
-        shutil.copy2(current_db, backup_path)
+        # Copia consistente del database, anche con altre connessioni attive
+        create_database_backup(backup_path)
         
         logger.info(f"Database backup created: {backup_filename}")
         
@@ -2263,9 +5715,6 @@ def admin_import_backup():
         })
     
     try:
-        import shutil
-        from datetime import datetime
-        
         password = request.form.get('password', '').strip()
         
         if not password:
@@ -2300,21 +5749,20 @@ def admin_import_backup():
         
         # Crea backup di sicurezza del database corrente
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        safety_backup = f'vinicola_pre_import_backup_{timestamp}.db'
-        current_db = os.path.join(app.instance_path, 'vinicola.db')
-        backup_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backup')
-        safety_backup_path = os.path.join(backup_folder, safety_backup)
+        extension = backup_file_extension()
+        safety_backup = f'vinicola_pre_import_backup_{timestamp}{extension}'
+        safety_backup_path = os.path.join(BACKUP_FOLDER, safety_backup)
         
         # Backup di sicurezza
-        shutil.copy2(current_db, safety_backup_path)
+        create_database_backup(safety_backup_path)
         
         # Salva il file caricato temporaneamente
-        temp_path = os.path.join(backup_folder, f'temp_import_{timestamp}.db')
+        temp_path = os.path.join(BACKUP_FOLDER, f'temp_import_{timestamp}{extension}')
         file.save(temp_path)
         
         try:
-            # Sostituisci il database corrente
-            shutil.copy2(temp_path, current_db)
+            # Sostituisci il contenuto del database corrente
+            restore_database_backup(temp_path)
             
             # Rimuovi il file temporaneo
             os.remove(temp_path)
@@ -2328,7 +5776,7 @@ def admin_import_backup():
             
         except Exception as e:
             # In caso di errore, ripristina il backup di sicurezza
-            shutil.copy2(safety_backup_path, current_db)
+            restore_database_backup(safety_backup_path)
             if os.path.exists(temp_path):
                 os.remove(temp_path)
             raise e
@@ -2356,7 +5804,7 @@ def admin_new_employee():
         
         # Se è una richiesta AJAX con password operatore, verifica l'operatore
         if is_ajax and operator_password:
-            operator = Operator.query.filter_by(password=operator_password, active=True).first()
+            operator = find_operator_by_password(operator_password)
             if not operator:
                 return jsonify({
                     'success': False,
@@ -2405,13 +5853,13 @@ def admin_new_employee():
                     return redirect(url_for('barcode_scanner'))
                 
                 # Verifica che la password dell'operatore sia valida
-                operator = Operator.query.filter_by(password=operator_password, active=True).first()
+                operator = find_operator_by_password(operator_password)
                 if not operator:
                     flash('Password operatore non valida.', 'danger')
                     return redirect(url_for('barcode_scanner'))
             
             # Controlla se il codice già esiste
-            existing = Employee.query.filter(db.func.upper(Employee.code) == db.func.upper(code)).first()
+            existing = find_employee_by_code(code)
             if existing:
                 if is_ajax:
                     return jsonify({
@@ -2559,11 +6007,17 @@ def admin_adjust_credit(id):
                 'message': 'Motivo della modifica obbligatorio.'
             })
         
-        # Trova il dipendente
-        employee = Employee.query.get_or_404(id)
+        # Trova il dipendente e ne blocca la riga: il nuovo credito è un valore
+        # assoluto, quindi la differenza va calcolata sul saldo non ancora modificato
+        employee = get_employee_for_update(id)
         
         # Salva il credito precedente per il calcolo della differenza
-        old_credit = employee.credit
+        # (per la cassa è il saldo del registro, con il saldo consolidato bloccato)
+        is_cash_register = employee.code == 'CASSA'
+        if is_cash_register:
+            old_credit = get_cash_balance(get_cash_snapshot(for_update=True))
+        else:
+            old_credit = employee.credit
         new_credit_decimal = Decimal(str(new_credit))
         difference = new_credit_decimal - old_credit
         
@@ -2575,7 +6029,10 @@ def admin_adjust_credit(id):
             })
         
         # Aggiorna il credito del dipendente
-        employee.update_credit(new_credit_decimal)
+        if is_cash_register:
+            record_cash_movement(difference, f"Regolazione amministrativa: {reason.strip()}")
+        else:
+            employee.update_credit(new_credit_decimal)
         
         # Registra la transazione amministrativa
         # IMPORTANTE: Questa transazione NON influisce sulla cassa
@@ -2823,7 +6280,7 @@ def operator_bulk_restock():
             })
         
         # Verifica password operatore
-        operator = Operator.query.filter_by(password=operator_password, active=True).first()
+        operator = find_operator_by_password(operator_password)
         if not operator:
             return jsonify({
                 'success': False,
@@ -2997,7 +6454,7 @@ def operator_delete_product():
             })
         
         # Verify operator password
-        operator = Operator.query.filter_by(password=operator_password, active=True).first()
+        operator = find_operator_by_password(operator_password)
         if not operator:
             return jsonify({
                 'success': False,
@@ -3063,6 +6520,14 @@ def admin_speech_config():
         flash('Errore nel caricamento della configurazione sintesi vocale', 'danger')
         return redirect(url_for('admin_dashboard'))
 
+def speech_config_response():
+    """Risposta JSON della configurazione vocale, con ETag per le richieste condizionali."""
+    _, payload, etag = speech_config_service.current()
+    response = app.response_class(payload, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
 @app.route('/admin/speech_config/save', methods=['POST'])
 def admin_speech_config_save():
     """Salva la configurazione sintesi vocale."""
@@ -3073,24 +6538,11 @@ def admin_speech_config_save():
         }), 401
         
     try:
-        import json
-        import os
-        
         # Ottieni i dati dal form
         data = request.get_json()
-        config_path = 'speech_nicknames.json'
-        
-        # Carica la configurazione esistente o crea una nuova
-        config = {}
-        if os.path.exists(config_path):
-            try:
-                with open(config_path, 'r', encoding='utf-8') as f:
-                    config = json.load(f)
-            except:
-                config = {}
         
-        # Aggiorna la configurazione
-        config.update({
+        # Aggiorna la configurazione esistente e salvala in modo atomico
+        speech_config_service.save({
             '_comment': 'Configurazione avanzata sintesi vocale',
             'speech_enabled': data.get('speech_enabled', True),
             'speech_rate': data.get('speech_rate', 1.3),
@@ -3098,10 +6550,6 @@ def admin_speech_config_save():
             'nicknames': data.get('nicknames', {})
         })
         
-        # Salva la configurazione
-        with open(config_path, 'w', encoding='utf-8') as f:
-            json.dump(config, f, indent=2, ensure_ascii=False)
-        
         logger.info(f"Speech configuration saved by admin {session.get('admin_username')}")
         
         return jsonify({
@@ -3126,49 +6574,7 @@ def admin_speech_config_load():
         }), 401
         
     try:
-        import json
-        import os
-        
-        config_path = 'speech_nicknames.json'
-        default_config = {
-            'speech_enabled': True,
-            'speech_rate': 1.3,
-            'speech_template': [
-                {'type': 'parameter', 'value': 'GRADO', 'enabled': True, 'order': 1},
-                {'type': 'parameter', 'value': 'COGNOME', 'enabled': True, 'order': 2},
-                {'type': 'parameter', 'value': 'NOME', 'enabled': True, 'order': 3},
-                {'type': 'text', 'value': ', totale ', 'enabled': True, 'order': 4},
-                {'type': 'parameter', 'value': 'TOTALE_ACQUISTO', 'enabled': True, 'order': 5},
-                {'type': 'text', 'value': ' euro, credito residuo ', 'enabled': True, 'order': 6},
-                {'type': 'parameter', 'value': 'CREDITO_RESIDUO', 'enabled': True, 'order': 7},
-                {'type': 'text', 'value': ' euro', 'enabled': True, 'order': 8}
-            ],
-            'nicknames': {}
-        }
-        
-        if os.path.exists(config_path):
-            try:
-                with open(config_path, 'r', encoding='utf-8') as f:
-                    config = json.load(f)
-                    
-                # Mantieni i nickname esistenti se non c'è una configurazione completa
-                if 'speech_template' not in config:
-                    config.update(default_config)
-                    # Mantieni i nickname esistenti
-                    if 'nicknames' not in config:
-                        config['nicknames'] = {k: v for k, v in config.items() 
-                                             if k not in ['_comment', 'speech_enabled', 'speech_rate', 'speech_template']}
-                    
-            except Exception as e:
-                logger.warning(f"Error loading speech config: {e}")
-                config = default_config
-        else:
-            config = default_config
-        
-        return jsonify({
-            'success': True,
-            'config': config
-        })
+        return speech_config_response()
         
     except Exception as e:
         logger.error(f"Error loading speech config: {str(e)}")
@@ -3260,12 +6666,17 @@ def import_csv():
 def settings():
     """Pagina impostazioni."""
     if request.method == 'POST':
+        # Gestisci il blocco delle vendite oltre la giacenza (stesso modulo del limite di credito)
+        if 'inventory_settings' in request.form:
+            prevent_oversell = 'true' if request.form.get('prevent_oversell') else 'false'
+            GlobalSetting.set('prevent_oversell', prevent_oversell, 'Blocca le vendite oltre la giacenza')
+        
         # Gestisci l'aggiornamento del limite di credito globale
         if 'global_credit_limit' in request.form:
             try:
                 credit_limit = Decimal(request.form.get('global_credit_limit', '0'))
                 GlobalSetting.set('credit_limit', str(credit_limit), 'Limite di credito negativo globale')
-                flash('Limite di credito globale aggiornato con successo.', 'success')
+                flash('Limiti di vendita aggiornati con successo.', 'success')
             except Exception as e:
                 flash(f'Errore durante l\'aggiornamento del limite di credito: {str(e)}', 'danger')
         
@@ -3280,6 +6691,7 @@ def settings():
     return render_template(
         'settings.html', 
         global_credit_limit=global_credit_limit,
+        prevent_oversell=is_oversell_prevented(),
         **stats
     )
 
@@ -3343,25 +6755,29 @@ def reset_all_hashes():
 
 @app.route('/api/system_stats')
 def api_system_stats():
-    """API per ottenere statistiche del sistema."""
-    return jsonify(get_system_stats())
+    """API per ottenere statistiche del sistema (304 se dipendenti, transazioni e cassa non sono cambiati)."""
+    return versioned_json(
+        [Employee.__tablename__, Transaction.__tablename__, CashMovement.__tablename__, CashSnapshot.__tablename__],
+        get_system_stats,
+        datetime.now().date().isoformat()  # Il conteggio di oggi cambia a mezzanotte
+    )
 
 
 @app.route('/api/employee/<employee_code>')
 def api_get_employee_by_code(employee_code):
     """API per ottenere dipendente tramite codice."""
     try:
-        employee = Employee.query.filter(db.func.upper(Employee.code) == db.func.upper(employee_code)).first()
+        employee = employee_directory.get(employee_code)
         if employee:
             return jsonify({
                 'success': True,
                 'employee': {
-                    'id': employee.id,
-                    'code': employee.code,
-                    'first_name': employee.first_name,
-                    'last_name': employee.last_name,
-                    'rank': employee.rank,
-                    'credit': float(employee.credit)
+                    'id': employee['id'],
+                    'code': employee['code'],
+                    'first_name': employee['first_name'],
+                    'last_name': employee['last_name'],
+                    'rank': employee['rank'],
+                    'credit': employee['credit']
                 }
             })
         else:
@@ -3379,23 +6795,31 @@ def api_get_employee_by_code(employee_code):
 
 @app.route('/api/products')
 def api_products():
-    """API per ottenere l'elenco prodotti con inventario."""
+    """
+    API per ottenere l'elenco prodotti con inventario.
+    Risponde 304 se il client ha già la versione corrente (If-None-Match);
+    con ?since=<versione>&epoch=<epoca> ritorna solo le giacenze cambiate,
+    se nel frattempo il catalogo non è cambiato in altro modo.
+    """
     try:
-        products = Product.query.filter_by(active=True).order_by(Product.name.asc()).all()
-        products_data = []
+        catalog = catalog_snapshot.current()
         
-        for product in products:
-            products_data.append({
-                'id': product.id,
-                'name': product.name,
-                'inventory': product.inventory if product.inventory is not None else 0,
-                'price': float(product.price)
-            })
+        since = request.args.get('since', type=int)
+        if since is not None:
+            inventory = catalog.delta_since(request.args.get('epoch'), since)
+            if inventory is not None:
+                return jsonify({
+                    'success': True,
+                    'epoch': catalog.epoch,
+                    'version': catalog.version,
+                    'delta': True,
+                    'inventory': inventory
+                })
         
-        return jsonify({
-            'success': True,
-            'products': products_data
-        })
+        response = app.response_class(catalog.payload, mimetype='application/json')
+        response.set_etag(catalog.etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
     except Exception as e:
         logger.error(f"Errore API prodotti: {str(e)}")
         return jsonify({
@@ -3408,13 +6832,13 @@ def api_products():
 def api_cash_balance():
     """API endpoint per ottenere il saldo della cassa"""
     try:
-        cash_register = Employee.query.filter_by(code='CASSA').first()
-        cash_balance = float(cash_register.credit) if cash_register else 0.0
-        
-        return jsonify({
-            'success': True,
-            'cash_balance': cash_balance
-        })
+        return versioned_json(
+            [CashMovement.__tablename__, CashSnapshot.__tablename__],
+            lambda: {
+                'success': True,
+                'cash_balance': float(get_cash_balance())
+            }
+        )
     except Exception as e:
         logger.error(f"Error getting cash balance: {str(e)}")
         return jsonify({
@@ -3427,65 +6851,7 @@ def api_cash_balance():
 def api_speech_nicknames():
     """API per ottenere la configurazione completa della sintesi vocale."""
     try:
-        import os
-        import json
-        
-        # Path del file di configurazione
-        config_path = 'speech_nicknames.json'
-        
-        # Configurazione di default
-        default_config = {
-            "_comment": "Configurazione avanzata sintesi vocale",
-            "speech_enabled": True,
-            "speech_rate": 1.3,
-            "speech_template": [
-                {'type': 'parameter', 'value': 'GRADO', 'enabled': True, 'order': 1},
-                {'type': 'parameter', 'value': 'COGNOME', 'enabled': True, 'order': 2},
-                {'type': 'parameter', 'value': 'NOME', 'enabled': True, 'order': 3},
-                {'type': 'text', 'value': ', totale ', 'enabled': True, 'order': 4},
-                {'type': 'parameter', 'value': 'TOTALE_ACQUISTO', 'enabled': True, 'order': 5},
-                {'type': 'text', 'value': ' euro, credito residuo ', 'enabled': True, 'order': 6},
-                {'type': 'parameter', 'value': 'CREDITO_RESIDUO', 'enabled': True, 'order': 7},
-                {'type': 'text', 'value': ' euro', 'enabled': True, 'order': 8}
-            ],
-            "nicknames": {}
-        }
-        
-        # Se il file non esiste, crea un file di esempio
-        if not os.path.exists(config_path):
-            try:
-                with open(config_path, 'w', encoding='utf-8') as f:
-                    json.dump(default_config, f, indent=2, ensure_ascii=False)
-                logger.info(f"Created example speech configuration file: {config_path}")
-            except Exception as e:
-                logger.error(f"Could not create speech configuration file: {e}")
-            config = default_config
-        else:
-            # Leggi la configurazione esistente
-            try:
-                with open(config_path, 'r', encoding='utf-8') as f:
-                    config = json.load(f)
-                
-                # Se non ha il formato nuovo, migra la configurazione
-                if 'speech_template' not in config:
-                    # Mantieni i nickname esistenti e aggiungi le nuove impostazioni
-                    old_nicknames = {k: v for k, v in config.items() if not k.startswith('_')}
-                    config = default_config.copy()
-                    config['nicknames'] = old_nicknames
-                    
-                    # Salva la configurazione aggiornata
-                    with open(config_path, 'w', encoding='utf-8') as f:
-                        json.dump(config, f, indent=2, ensure_ascii=False)
-                    logger.info("Migrated speech configuration to new format")
-                
-            except Exception as e:
-                logger.warning(f"Could not load speech configuration: {e}")
-                config = default_config
-        
-        return jsonify({
-            'success': True,
-            'config': config
-        })
+        return speech_config_response()
         
     except Exception as e:
         logger.error(f"Error in api_speech_nicknames: {str(e)}")
@@ -3507,60 +6873,48 @@ def api_recent_transactions():
         # Get date filter parameters
         date_filter = request.args.get('date_filter', 'today')
         custom_date = request.args.get('custom_date', '')
+        # Apply date filtering ('all' means no date filter)
+        start, end = period_bounds(date_filter, custom_date)
+        
+        def build():
+            # Build base query (exclude cancellation transactions)
+            query = db.session.query(Transaction)\
+                .join(Employee)\
+                .outerjoin(Operator)\
+                .outerjoin(Product)\
+                .filter(Transaction.transaction_type != 'cancellation')
+            
+            query = filter_timestamp_range(query, start, end)
+            
+            transactions = query.order_by(Transaction.timestamp.desc()).limit(500).all()
+            logger.info(f"Found {len(transactions)} transactions for filter: {date_filter}, custom_date: {custom_date}")
+            
+            transactions_data = []
+            for transaction in transactions:
+                transactions_data.append({
+                    'id': transaction.id,
+                    'timestamp': transaction.timestamp.isoformat(),
+                    'employee_name': f"{transaction.employee.first_name} {transaction.employee.last_name}",
+                    'transaction_type': transaction.transaction_type,
+                    'amount': float(transaction.amount),
+                    'product_name': transaction.product.name if transaction.product else None,
+                    'custom_product_name': transaction.custom_product_name,
+                    'quantity': transaction.quantity,
+                    'operator_name': transaction.operator.username if transaction.operator else None
+                })
+            
+            return {
+                'success': True,
+                'transactions': transactions_data
+            }
         
-        # Build base query (exclude cancellation transactions)
-        query = db.session.query(Transaction)\
-            .join(Employee)\
-            .outerjoin(Operator)\
-            .outerjoin(Product)\
-            .filter(Transaction.transaction_type != 'cancellation')
-        
-        # Apply date filtering
-        if date_filter == 'today':
-            today = datetime.now().date()
-            query = query.filter(db.func.date(Transaction.timestamp) == today)
-        elif date_filter == 'yesterday':
-            yesterday = (datetime.now() - timedelta(days=1)).date()
-            query = query.filter(db.func.date(Transaction.timestamp) == yesterday)
-        elif date_filter == 'week':
-            week_ago = datetime.now() - timedelta(days=7)
-            query = query.filter(Transaction.timestamp >= week_ago)
-        elif date_filter == 'month':
-            month_ago = datetime.now() - timedelta(days=30)
-            query = query.filter(Transaction.timestamp >= month_ago)
-        elif date_filter == 'custom' and custom_date:
-            try:
-                filter_date = datetime.strptime(custom_date, '%Y-%m-%d').date()
-                logger.info(f"Filtering transactions for date: {filter_date}")
-                query = query.filter(db.func.date(Transaction.timestamp) == filter_date)
-            except ValueError as e:
-                logger.error(f"Invalid date format '{custom_date}': {e}")
-                # Invalid date format, fall back to today
-                today = datetime.now().date()
-                query = query.filter(db.func.date(Transaction.timestamp) == today)
-        # 'all' means no date filter
-        
-        transactions = query.order_by(Transaction.timestamp.desc()).limit(500).all()
-        logger.info(f"Found {len(transactions)} transactions for filter: {date_filter}, custom_date: {custom_date}")
-        
-        transactions_data = []
-        for transaction in transactions:
-            transactions_data.append({
-                'id': transaction.id,
-                'timestamp': transaction.timestamp.isoformat(),
-                'employee_name': f"{transaction.employee.first_name} {transaction.employee.last_name}",
-                'transaction_type': transaction.transaction_type,
-                'amount': float(transaction.amount),
-                'product_name': transaction.product.name if transaction.product else None,
-                'custom_product_name': transaction.custom_product_name,
-                'quantity': transaction.quantity,
-                'operator_name': transaction.operator.username if transaction.operator else None
-            })
-        
-        return jsonify({
-            'success': True,
-            'transactions': transactions_data
-        })
+        # I filtri relativi (oggi, settimana, ...) dipendono dall'intervallo calcolato ora
+        return versioned_json(
+            [Transaction.__tablename__, Employee.__tablename__, Operator.__tablename__, Product.__tablename__],
+            build,
+            date_filter, custom_date,
+            start.isoformat() if start else '', end.isoformat() if end else ''
+        )
     except Exception as e:
         logger.error(f"Errore API transazioni recenti: {str(e)}")
         return jsonify({
@@ -3625,8 +6979,8 @@ def api_delete_transaction(transaction_id):
                 'message': 'Password operatore richiesta'
             }), 400
         
-        # Verifica password operatore
-        operator = Operator.query.filter_by(password=operator_password).first()
+        # Verifica password operatore (anche operatori disattivati, come in passato)
+        operator = find_operator_by_password(operator_password, active_only=False)
         if not operator:
             return jsonify({
                 'success': False,
@@ -3649,13 +7003,19 @@ def api_delete_transaction(transaction_id):
                 'message': 'Dipendente non trovato'
             }), 404
         
-        # Ripristina il credito del dipendente
+        # Ripristina il credito del dipendente (l'UPDATE atomico ricalcola anche l'hash)
         if transaction.transaction_type == 'credit':
             # Era una ricarica, sottrai l'importo
-            employee.credit -= transaction.amount
+            delta = -transaction.amount
         else:
             # Era un acquisto, aggiungi l'importo
-            employee.credit += abs(transaction.amount)
+            delta = abs(transaction.amount)
+        
+        if employee.code == 'CASSA':
+            # Il saldo della cassa vive nel registro di cassa
+            record_cash_movement(delta, f"Annullamento transazione {transaction.id}")
+        else:
+            apply_credit_delta(employee, delta)
         
         # Ripristina l'inventario del prodotto se applicabile
         if transaction.product_id and transaction.quantity:
@@ -3665,9 +7025,6 @@ def api_delete_transaction(transaction_id):
                     # Era un acquisto, ripristina l'inventario
                     product.inventory += transaction.quantity
         
-        # Ricalcola l'hash di integrità
-        employee.update_credit_hash()
-        
         # Registra l'eliminazione come transazione di annullamento per i report
         cancellation_transaction = Transaction(
             employee_id=employee.id,
@@ -3688,10 +7045,11 @@ def api_delete_transaction(transaction_id):
         
         logger.info(f"Transazione {transaction_id} eliminata dall'operatore {operator.username}")
         
+        new_credit = get_cash_balance() if employee.code == 'CASSA' else employee.credit
         return jsonify({
             'success': True,
             'message': 'Transazione eliminata con successo',
-            'new_credit': float(employee.credit)
+            'new_credit': float(new_credit)
         })
         
     except Exception as e:
@@ -3706,7 +7064,7 @@ def api_delete_transaction(transaction_id):
 @app.route('/api/employees')
 def api_employees():
     """API per ottenere l'elenco completo dei dipendenti."""
-    try:
+    def build():
         employees = Employee.query.filter(Employee.code != 'CASSA').order_by(Employee.last_name, Employee.first_name).all()
         employees_data = []
         
@@ -3721,10 +7079,13 @@ def api_employees():
                 'credit_limit': float(employee.credit_limit) if employee.credit_limit else 0
             })
         
-        return jsonify({
+        return {
             'success': True,
             'employees': employees_data
-        })
+        }
+    
+    try:
+        return versioned_json([Employee.__tablename__], build)
     except Exception as e:
         logger.error(f"Errore API dipendenti: {str(e)}")
         return jsonify({
@@ -3736,13 +7097,17 @@ def api_employees():
 @app.route('/api/serial_status')
 @login_required
 def api_serial_status():
-    """API per verificare lo stato del lettore seriale."""
-    last_barcode = get_last_barcode()
+    """API per verificare lo stato dei lettori seriali (?lane=N per una sola cassa)."""
+    lane = request.args.get('lane', type=int)
+    last_barcode = get_last_barcode(lane)
     status = {
         'available': SERIAL_AVAILABLE,
-        'connected': serial_port is not None and serial_port.is_open if serial_port else False,
+        'connected': scanner_manager.connected,
         'last_barcode': last_barcode['barcode'] if last_barcode else None,
         'last_barcode_timestamp': last_barcode['timestamp'] if last_barcode else None,
+        'lanes': [stats for stats in scanner_manager.stats() if lane is None or stats['lane'] == lane],
+        'pipeline': scan_pipeline.stats(),
+        'stream': scan_events.stats(),
         'config': SERIAL_CONFIG
     }
     return jsonify(status)
@@ -3753,7 +7118,7 @@ def api_serial_status():
 @login_required
 def update_serial_config():
     """Aggiorna configurazione lettore seriale."""
-    global SERIAL_CONFIG, serial_port
+    global SERIAL_CONFIG
     
     # Aggiorna la configurazione in memoria
     SERIAL_CONFIG['port'] = request.form.get('serial_port', SERIAL_CONFIG['port'])
@@ -3769,15 +7134,16 @@ def update_serial_config():
             current_config = load_config()
             current_config['serial'] = SERIAL_CONFIG
             save_config(current_config)
+            
+            # Applica anche le modifiche fatte a mano a corsie e riconnessione
+            SCANNER_LANES[:] = current_config.get('lanes', [])
+            RECOVERY_CONFIG.update(current_config.get('error_recovery', {}))
             logger.info("Configurazione seriale salvata in config_serial.json")
         except Exception as e:
             logger.error(f"Errore nel salvataggio configurazione: {e}")
             flash('Configurazione aggiornata in memoria ma non salvata su file.', 'warning')
     
-    # Riavvia il lettore
-    if serial_port and serial_port.is_open:
-        serial_port.close()
-    
+    # Applica la configurazione: si riavviano solo le casse con parametri cambiati
     success = setup_barcode_reader()
     
     if success:
@@ -3812,6 +7178,7 @@ if __name__ == '__main__':
     # Crea tabelle e dati iniziali
     with app.app_context():
         db.create_all()
+        run_schema_migrations()
         
         # Crea l'admin se non esiste
         if not Admin.query.first():
@@ -3848,13 +7215,21 @@ if __name__ == '__main__':
             db.session.commit()
             logger.info(f"Updated credit hash for {count} employees")
         
+        # Archivia le transazioni vecchie e pianifica le archiviazioni successive
+        start_archive_scheduler()
+        
+        # Consolida periodicamente il registro di cassa nel saldo
+        start_cash_ledger_compactor()
+        
+        # Carica la rubrica dei dipendenti usata per identificare i badge
+        employee_directory.load()
+        
         # Crea la cartella backup se non esiste
-        backup_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backup')
-        if not os.path.exists(backup_folder):
-            os.makedirs(backup_folder)
-            logger.info(f"Created backup folder: {backup_folder}")
+        if not os.path.exists(BACKUP_FOLDER):
+            os.makedirs(BACKUP_FOLDER)
+            logger.info(f"Created backup folder: {BACKUP_FOLDER}")
         else:
-            logger.info(f"Backup folder already exists: {backup_folder}")
+            logger.info(f"Backup folder already exists: {BACKUP_FOLDER}")
     
     # Avvia il lettore di codici a barre seriale se disponibile
     try:
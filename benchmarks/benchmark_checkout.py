@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark del percorso di cassa (deduct_credit)
+-----------------------------------------------
+Confronta il throughput degli acquisti con e senza il profilo SQLite
+(WAL, synchronous=NORMAL, cache, mmap, busy_timeout) e con la coda di
+scrittura a thread singolo che raggruppa più acquisti in un solo commit.
+
+Ogni scenario gira in un processo separato su un database temporaneo nuovo,
+perché la configurazione viene letta da app.py all'importazione.
+
+Uso:
+    python benchmarks/benchmark_checkout.py --threads 8 --requests 200
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Scenario -> variabili d'ambiente impostate prima di importare app.py
+SCENARIOS = {
+    'default': {'SQLITE_PROFILE_ENABLED': 'false', 'WRITE_PIPELINE_ENABLED': 'false'},
+    'profile': {'SQLITE_PROFILE_ENABLED': 'true', 'WRITE_PIPELINE_ENABLED': 'false'},
+    'pipeline': {'SQLITE_PROFILE_ENABLED': 'true', 'WRITE_PIPELINE_ENABLED': 'true'},
+}
+
+
+def seed(vinicola, employees, products):
+    """Crea dipendenti e prodotti di prova."""
+    from decimal import Decimal
+
+    with vinicola.app.app_context():
+        vinicola.db.create_all()
+        vinicola.run_schema_migrations()
+        vinicola.ensure_cash_register_exists()
+
+        for i in range(employees):
+            employee = vinicola.Employee(
+                code=f"BENCH{i:05d}",
+                first_name='Bench',
+                last_name=f"User{i}",
+                rank='Test',
+                credit=Decimal('100000'),
+                credit_limit=Decimal('0')
+            )
+            vinicola.db.session.add(employee)
+        for i in range(products):
+            vinicola.db.session.add(vinicola.Product(
+                name=f"Prodotto {i}", price=Decimal('1.50'), inventory=1000000, active=True
+            ))
+        vinicola.db.session.commit()
+
+        for employee in vinicola.Employee.query.all():
+            employee.update_credit_hash()
+        vinicola.db.session.commit()
+
+        employee_ids = [e.id for e in vinicola.Employee.query.filter(vinicola.Employee.code != 'CASSA')]
+        product_ids = [p.id for p in vinicola.Product.query.all()]
+    return employee_ids, product_ids
+
+
+def run_worker(args):
+    """Esegue uno scenario nel processo corrente e stampa i risultati in JSON."""
+    sys.path.insert(0, REPO_ROOT)
+    import app as vinicola
+    logging.getLogger('vinicola').setLevel(logging.WARNING)
+
+    employee_ids, product_ids = seed(vinicola, args.employees, args.products)
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def client_loop(seed_value):
+        rng = random.Random(seed_value)
+        client = vinicola.app.test_client()
+        local_latencies = []
+        local_errors = 0
+        for _ in range(args.requests):
+            cart = [{'id': rng.choice(product_ids), 'quantity': rng.randint(1, 3)}
+                    for _ in range(args.cart_size)]
+            started = time.perf_counter()
+            response = client.post('/deduct_credit', data={
+                'employee_id': rng.choice(employee_ids),
+                'products': json.dumps(cart)
+            })
+            local_latencies.append(time.perf_counter() - started)
+            if response.status_code != 200 or not response.get_json().get('success'):
+                local_errors += 1
+        with lock:
+            latencies.extend(local_latencies)
+            errors.append(local_errors)
+
+    threads = [threading.Thread(target=client_loop, args=(i,)) for i in range(args.threads)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(json.dumps({
+        'requests': len(latencies),
+        'errors': sum(errors),
+        'elapsed': elapsed,
+        'tps': len(latencies) / elapsed if elapsed else 0,
+        'p50_ms': statistics.median(latencies) * 1000,
+        'p99_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+    }))
+
+
+def run_scenario(name, args):
+    """Lancia uno scenario in un sottoprocesso con un database temporaneo."""
+    workdir = tempfile.mkdtemp(prefix='vinicola_bench_')
+    try:
+        env = dict(os.environ)
+        env.update(SCENARIOS[name])
+        env['DATABASE_URI'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+        command = [sys.executable, os.path.abspath(__file__), '--worker',
+                   '--threads', str(args.threads), '--requests', str(args.requests),
+                   '--employees', str(args.employees), '--products', str(args.products),
+                   '--cart-size', str(args.cart_size)]
+        output = subprocess.run(command, cwd=workdir, env=env, check=True,
+                                capture_output=True, text=True).stdout
+        return json.loads(output.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=8, help='Terminali concorrenti')
+    parser.add_argument('--requests', type=int, default=200, help='Acquisti per terminale')
+    parser.add_argument('--employees', type=int, default=200)
+    parser.add_argument('--products', type=int, default=20)
+    parser.add_argument('--cart-size', type=int, default=3, help='Righe per carrello')
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    print(f"{'Scenario':<12} {'Richieste':>10} {'Errori':>7} {'TPS':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for name in args.scenarios:
+        result = run_scenario(name, args)
+        print(f"{name:<12} {result['requests']:>10} {result['errors']:>7} {result['tps']:>9.1f} "
+              f"{result['p50_ms']:>9.2f} {result['p99_ms']:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
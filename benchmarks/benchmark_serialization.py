@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark della serializzazione dei dipendenti (Employee.to_dict)
+-----------------------------------------------------------------
+Misura il costo per dipendente della verifica dell'hash di integrità:
+
+  legacy  SHA-256 ricalcolato concatenando la chiave a ogni serializzazione
+          (comportamento precedente di to_dict)
+  cold    HMAC da contesto precalcolato, memoria delle verifiche vuota
+  warm    HMAC con le verifiche già memorizzate (liste e scansioni ripetute)
+
+Gira su un database temporaneo nuovo, creato prima di importare app.py.
+
+Uso:
+    python benchmarks/benchmark_serialization.py --employees 2000 --rounds 20
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def seed(vinicola, employees):
+    """Crea i dipendenti di prova con hash validi."""
+    from decimal import Decimal
+
+    with vinicola.app.app_context():
+        vinicola.db.create_all()
+        vinicola.run_schema_migrations()
+
+        for i in range(employees):
+            vinicola.db.session.add(vinicola.Employee(
+                code=f"BENCH{i:05d}",
+                first_name='Bench',
+                last_name=f"User{i}",
+                rank='Test',
+                credit=Decimal('100.00') + i,
+                credit_limit=Decimal('0')
+            ))
+        vinicola.db.session.commit()
+
+        for employee in vinicola.Employee.query.all():
+            employee.update_credit_hash()
+        vinicola.db.session.commit()
+
+
+def legacy_to_dict(vinicola, employee):
+    """Serializzazione come prima: hash SHA-256 ricalcolato a ogni chiamata."""
+    integrity = vinicola.compute_legacy_credit_hash(
+        employee.id, employee.credit, employee.credit_limit
+    ) == employee.credit_hash
+    return {
+        'id': employee.id,
+        'code': employee.code,
+        'first_name': employee.first_name,
+        'last_name': employee.last_name,
+        'rank': employee.rank,
+        'credit': float(employee.credit) if employee.credit else 0,
+        'credit_limit': float(employee.credit_limit) if employee.credit_limit else 0,
+        'credit_integrity': integrity
+    }
+
+
+def measure(employees, rounds, serialize, before_round=None):
+    """Tempo medio per dipendente in microsecondi."""
+    elapsed = 0.0
+    for _ in range(rounds):
+        if before_round:
+            before_round()
+        started = time.perf_counter()
+        for employee in employees:
+            serialize(employee)
+        elapsed += time.perf_counter() - started
+    return elapsed / (rounds * len(employees)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--employees', type=int, default=2000)
+    parser.add_argument('--rounds', type=int, default=20, help='Serializzazioni complete per scenario')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='vinicola_bench_')
+    try:
+        os.environ['DATABASE_URI'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+        os.chdir(workdir)
+        sys.path.insert(0, REPO_ROOT)
+        import app as vinicola
+        logging.getLogger('vinicola').setLevel(logging.WARNING)
+
+        seed(vinicola, args.employees)
+
+        with vinicola.app.app_context():
+            employees = vinicola.Employee.query.all()
+            results = {
+                'legacy': measure(employees, args.rounds, lambda e: legacy_to_dict(vinicola, e)),
+                'cold': measure(employees, args.rounds, lambda e: e.to_dict(),
+                                before_round=vinicola.forget_credit_verification),
+                'warm': measure(employees, args.rounds, lambda e: e.to_dict()),
+            }
+    finally:
+        os.chdir(REPO_ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{'Scenario':<10} {'us/dipendente':>14}")
+    for name, per_employee in results.items():
+        print(f"{name:<10} {per_employee:>14.2f}")
+
+
+if __name__ == '__main__':
+    main()
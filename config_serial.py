@@ -51,7 +51,9 @@ def create_default_config():
             "ignore_suffix": "",
             "uppercase": False,
             "lowercase": False,
-            "strip_spaces": True
+            "strip_spaces": True,
+            "queue_size": 64,
+            "drop_policy": "oldest"
         },
         "logging": {
             "enabled": True,
@@ -69,6 +71,7 @@ def create_default_config():
             "auto_reconnect": True,
             "max_reconnect_attempts": 5,
             "reconnect_delay": 3.0,
+            "max_reconnect_delay": 30.0,
             "reset_on_error": True
         }
     }